@@ -6,6 +6,10 @@ from dotenv import load_dotenv
 import os
 import logging
 import logging.handlers  # เพิ่มสำหรับ RotatingFileHandler
+from device_master_cache import DeviceMasterCache
+from uptime_history import open_history, UPTIME_SNAPSHOT, UPTIME_SNAPSHOT_MINUTES
+from liveness_events import Debouncer, EventPublisher, build_event
+from reachability_probe import probe_devices, merge_state
 
 # Configure logging
 logging.basicConfig(
@@ -58,6 +62,17 @@ MSSQL_PORT = int(os.getenv('MSSQL_PORT', 1433))
 
 INTERVAL = int(os.getenv('INTERVAL', 1))
 
+# LIVENESS_EVENTS=1 publishes debounced state changes to EVENT_TOPIC (liveness_events.py), off by default
+LIVENESS_EVENTS = os.getenv('LIVENESS_EVENTS', '0') == '1'
+
+# PROBE_ENABLED=1 probes the ip_address (PROBE_PORT) of devices without heartbeat to tell
+# a crashed publisher (host reachable) from a network problem (reachability_probe.py)
+PROBE_ENABLED = os.getenv('PROBE_ENABLED', '0') == '1'
+
+# Current state per device and the history of its changes (only transitions are written)
+STATUS_TABLE = 'device_status_tb'
+HISTORY_TABLE = 'device_status_history_tb'
+
 def connect_influxdb():
     global influx_client
     try:
@@ -111,51 +126,20 @@ def connect_mssql():
         error_logger.error(error_msg)
         return None
 
-def get_topic_from_mssql():
-    try:
-        # Connect to MSSQL
-        conn = connect_mssql()
-        if not conn:
-            error_msg = "[get_topic_from_mssql] Failed to connect to MSSQL"
-            print(error_msg)
-            error_logger.error(error_msg)
-            return []
+# device_master_tb, polled by change token
+device_master = DeviceMasterCache(connect_mssql)
 
-        cursor = conn.cursor()
-        
-        # Query distinct tools, machine, process, and location from device_master_tb
-        query = """
-            SELECT DISTINCT tools, machine, process, location 
-            FROM device_master_tb 
-            WHERE tools IS NOT NULL AND machine IS NOT NULL
-        """
-        cursor.execute(query)
-        
-        # Create a list of dictionaries with topic, process, and location
-        topic_list = [
-            {
-                'topic': f"iot_sensors/device_alive/{row[0]}_{row[1]}",
-                'iot_topic': f"iot_sensors/iot_{row[0]}/{row[1]}",
-                'process': row[2],
-                'location': row[3]
-            }
-            for row in cursor.fetchall()
-            if row[0] and row[1]
-        ]
-        
-        # Close connection
-        cursor.close()
-        conn.close()
-        
-        # Return sorted unique topic dictionaries
-        return sorted(topic_list, key=lambda x: x['topic'])
-    except Exception as e:
-        error_msg = f"[get_topic_from_mssql] Error: {str(e)}"
-        print(error_msg)
-        error_logger.error(error_msg)
-        return []
+def get_topic_from_mssql():
+    """Device topic dicts from the device_master_tb cache; the table is only re-read when it changed"""
+    device_master.refresh()
+    return list(device_master.topic_list)
 
 def fetch_influxdb_data(topic_list):
+    """
+    Latest point of every device in one query (LIMIT 1 per topic group).
+    Devices from the master list without a point in the last minute are disconnected.
+    Returns None when InfluxDB could not be queried (state unknown, not disconnected).
+    """
     global influx_client
     result_data = {}
     
@@ -164,50 +148,222 @@ def fetch_influxdb_data(topic_list):
             error_msg = "[fetch_influxdb_data] No InfluxDB connection"
             error_logger.error(error_msg)
             print(error_msg)
-            return result_data
-
-        for topic_dict in topic_list:
-            topic = topic_dict['topic']
-            iot_topic = topic_dict['iot_topic']
-            process = topic_dict['process']
-            location = topic_dict['location']
-            
-            try:
-                # Extract measurement name from topic
-                measurement = 'device_alive'
-                print("topic:", topic)
-                # Query InfluxDB for the latest data point
-                query = f'SELECT * FROM "{measurement}" WHERE topic = \'{topic}\' and time > now() - 1m ORDER BY time DESC LIMIT 1'
-                result = influx_client.query(query)
-
-                # Check if result contains data
-                if result:
-                    data_points = list(result[measurement])
-                    result_data[topic] = data_points
-                    
-                    # Log success for topic with data
-                    success_msg = f"[fetch_influxdb_data] Successfully fetched data for topic: {topic}, process: {process}, location: {location}"
-                    success_logger.info(success_msg)
-                    # print(success_msg)
-                else:
-                    # Log empty result for topic
-                    device_msg = f"[fetch_influxdb_data] Device disconnected for topic: {topic}, process: {process}, location: {location}"
-                    device_logger.debug(device_msg)
-                    # print(device_msg)
-                    
-            except Exception as e:
-                error_msg = f"[fetch_influxdb_data] Error fetching data for topic {topic}: {str(e)}"
-                error_logger.error(error_msg)
-                print(error_msg)
+            return None
+
+        measurement = 'device_alive'
+        query = f'SELECT * FROM "{measurement}" WHERE time > now() - 1m GROUP BY "topic" ORDER BY time DESC LIMIT 1'
+        result = influx_client.query(query)
+
+        latest = {}
+        for (_, tags), points in result.items():
+            topic = (tags or {}).get('topic')
+            if topic:
+                latest[topic] = list(points)
+
+        master_topics = {topic_dict['topic'] for topic_dict in topic_list}
+        alive = master_topics & latest.keys()
+        dead = master_topics - alive
+        unknown = latest.keys() - master_topics
+
+        for topic in alive:
+            result_data[topic] = latest[topic]
+
+        success_msg = (f"[fetch_influxdb_data] {len(alive)} alive, {len(dead)} disconnected, "
+                       f"{len(unknown)} reporting but not in device_master_tb")
+        success_logger.info(success_msg)
+        print(success_msg)
                 
     except Exception as e:
         error_msg = f"[fetch_influxdb_data] General error: {str(e)}"
         error_logger.error(error_msg)
         print(error_msg)
+        return None
         
     return result_data
 
+def parse_point_time(value):
+    """InfluxDB RFC3339 time -> UTC+7 datetime like the other MSSQL tables"""
+    try:
+        parsed = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+    except ValueError:
+        parsed = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+    return parsed + datetime.timedelta(hours=7)
+
+def ensure_status_tables(cursor):
+    cursor.execute(f"""
+        IF OBJECT_ID('{STATUS_TABLE}', 'U') IS NULL
+        CREATE TABLE {STATUS_TABLE} (
+            topic NVARCHAR(255) NOT NULL PRIMARY KEY,
+            process NVARCHAR(255) NULL,
+            location NVARCHAR(255) NULL,
+            connected BIT NOT NULL,
+            last_seen DATETIME2(3) NULL,
+            changed_at DATETIME2(3) NOT NULL
+        )
+    """)
+    cursor.execute(f"""
+        IF OBJECT_ID('{HISTORY_TABLE}', 'U') IS NULL
+        CREATE TABLE {HISTORY_TABLE} (
+            id BIGINT IDENTITY(1,1) PRIMARY KEY,
+            topic NVARCHAR(255) NOT NULL,
+            old_connected BIT NULL,
+            new_connected BIT NOT NULL,
+            last_seen DATETIME2(3) NULL,
+            changed_at DATETIME2(3) NOT NULL
+        )
+    """)
+
+def load_device_states():
+    """{topic: connected} as last persisted, so a restart doesn't report every device as a change"""
+    conn = connect_mssql()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        ensure_status_tables(cursor)
+        conn.commit()
+        cursor.execute(f"SELECT topic, connected FROM {STATUS_TABLE}")
+        return {row[0]: bool(row[1]) for row in cursor.fetchall()}
+    except Exception as e:
+        error_msg = f"[load_device_states] Error: {str(e)}"
+        print(error_msg)
+        error_logger.error(error_msg)
+        return None
+    finally:
+        conn.close()
+
+def find_transitions(device_states, topic_list, influx_data):
+    """[(topic_dict, old, new, last_seen)] for devices whose state differs from device_states"""
+    transitions = []
+    for topic_dict in topic_list:
+        topic = topic_dict['topic']
+        connected = topic in influx_data
+        if device_states.get(topic) != connected:
+            last_seen = parse_point_time(influx_data[topic][0]['time']) if connected else None
+            transitions.append((topic_dict, device_states.get(topic), connected, last_seen))
+    return transitions
+
+def save_transitions(transitions):
+    """One bulk MERGE into device_status_tb and one INSERT into the history per cycle"""
+    if not transitions:
+        return True
+    conn = connect_mssql()
+    if not conn:
+        return False
+    try:
+        changed_at = datetime.datetime.utcnow() + datetime.timedelta(hours=7)
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE #device_status_stage (
+                topic NVARCHAR(255) NOT NULL, process NVARCHAR(255) NULL, location NVARCHAR(255) NULL,
+                old_connected BIT NULL, new_connected BIT NOT NULL, last_seen DATETIME2(3) NULL
+            )
+        """)
+        cursor.fast_executemany = True
+        cursor.executemany(
+            "INSERT INTO #device_status_stage VALUES (?, ?, ?, ?, ?, ?)",
+            [(t['topic'], t['process'], t['location'], old, new, last_seen) for t, old, new, last_seen in transitions]
+        )
+        # One source row per topic: duplicate master rows would make the MERGE update a target row twice
+        cursor.execute("""
+            WITH ranked AS (
+                SELECT ROW_NUMBER() OVER (PARTITION BY topic ORDER BY new_connected DESC, last_seen DESC) AS rn
+                FROM #device_status_stage
+            )
+            DELETE FROM ranked WHERE rn > 1
+        """)
+        cursor.execute(f"""
+            MERGE {STATUS_TABLE} AS target
+            USING #device_status_stage AS source
+            ON target.topic = source.topic
+            WHEN MATCHED THEN
+                UPDATE SET connected = source.new_connected, process = source.process, location = source.location,
+                           last_seen = ISNULL(source.last_seen, target.last_seen), changed_at = ?
+            WHEN NOT MATCHED THEN
+                INSERT (topic, process, location, connected, last_seen, changed_at)
+                VALUES (source.topic, source.process, source.location, source.new_connected, source.last_seen, ?);
+        """, (changed_at, changed_at))
+        cursor.execute(f"""
+            INSERT INTO {HISTORY_TABLE} (topic, old_connected, new_connected, last_seen, changed_at)
+            SELECT topic, old_connected, new_connected, last_seen, ? FROM #device_status_stage
+        """, (changed_at,))
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        error_msg = f"[save_transitions] Error: {str(e)}"
+        print(error_msg)
+        error_logger.error(error_msg)
+        return False
+    finally:
+        conn.close()
+
+def log_transitions(transitions):
+    for topic_dict, old, new, last_seen in transitions:
+        if new:
+            success_msg = (f"[log_transitions] Device connected for topic: {topic_dict['topic']}, "
+                           f"process: {topic_dict['process']}, location: {topic_dict['location']}")
+            success_logger.info(success_msg)
+        else:
+            device_msg = (f"[log_transitions] Device disconnected for topic: {topic_dict['topic']}, "
+                          f"process: {topic_dict['process']}, location: {topic_dict['location']}")
+            device_logger.debug(device_msg)
+
+def record_uptime(history, topic_list, influx_data, last_snapshot):
+    """Add this check to the uptime bitmaps, write the snapshot when due. Returns the last snapshot time."""
+    try:
+        now = time.time()
+        history.record(now, [topic_dict['topic'] for topic_dict in topic_list], influx_data)
+        if now - last_snapshot >= UPTIME_SNAPSHOT_MINUTES * 60:
+            history.save(UPTIME_SNAPSHOT)
+            return now
+    except Exception as e:
+        error_msg = f"[record_uptime] Error: {str(e)}"
+        print(error_msg)
+        error_logger.error(error_msg)
+    return last_snapshot
+
+def publish_liveness_events(debouncer, publisher, topic_list, influx_data, last_seen):
+    """Queue an event for every device whose debounced state changed; never waits for the broker"""
+    now = time.time()
+    for topic_dict in topic_list:
+        topic = topic_dict['topic']
+        connected = topic in influx_data
+        if connected:
+            last_seen[topic] = influx_data[topic][0]['time']
+        old = debouncer.update(topic, connected, now)
+        if old is not None:
+            publisher.put(build_event(topic, device_master.by_topic.get(topic), old, connected, last_seen.get(topic)))
+    success_logger.info(f"[publish_liveness_events] events published: {publisher.published}, "
+                        f"dropped: {publisher.dropped}, queued: {publisher.queue.qsize()}")
+
+def probe_disconnected(topic_list, influx_data):
+    """{topic: merged state} for the devices without heartbeat"""
+    try:
+        devices = [device_master.by_topic[t['topic']] for t in topic_list
+                   if t['topic'] not in influx_data and t['topic'] in device_master.by_topic]
+        reachable = probe_devices(devices)
+        states = {topic: merge_state(False, value) for topic, value in reachable.items()}
+        counts = {}
+        for state in states.values():
+            counts[state] = counts.get(state, 0) + 1
+        success_msg = f"[probe_disconnected] {len(states)} devices without heartbeat: {counts}"
+        print(success_msg)
+        success_logger.info(success_msg)
+        return states
+    except Exception as e:
+        error_msg = f"[probe_disconnected] Error: {str(e)}"
+        print(error_msg)
+        error_logger.error(error_msg)
+        return {}
+
 def main():
+    device_states = None
+    debouncer = Debouncer()
+    publisher = EventPublisher() if LIVENESS_EVENTS else None
+    event_last_seen = {}   # topic -> last heartbeat time, for the events
+    uptime = open_history()
+    last_snapshot = time.time()
     while True:
         try:
             start_time = time.time()
@@ -221,14 +377,30 @@ def main():
                 continue
                 
             influx_data = fetch_influxdb_data(topic_list)
+            if device_states is None:
+                device_states = load_device_states()
+            if influx_data is not None and PROBE_ENABLED:
+                probe_disconnected(topic_list, influx_data)
+            if influx_data is not None and publisher:
+                publish_liveness_events(debouncer, publisher, topic_list, influx_data, event_last_seen)
+            if influx_data is not None:
+                last_snapshot = record_uptime(uptime, topic_list, influx_data, last_snapshot)
+            if device_states is not None and influx_data is not None:
+                transitions = find_transitions(device_states, topic_list, influx_data)
+                if save_transitions(transitions):
+                    log_transitions(transitions)
+                    for topic_dict, _, new, _ in transitions:
+                        device_states[topic_dict['topic']] = new
+                    print(f"{len(transitions)} devices changed state")
             elapsed_time = time.time() - start_time
+            print("using_time: ", elapsed_time)
             remaining_time = max(0, INTERVAL*60 - elapsed_time)
             time.sleep(remaining_time)
-            print("using_time: ", time.time() - start_time)
         except Exception as e:
             error_msg = f"[main] Main error: {str(e)}"
             print(error_msg)
             error_logger.error(error_msg)
+            time.sleep(5)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
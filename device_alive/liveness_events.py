@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+
+import paho.mqtt.client as mqtt
+
+# Device state-change events published by device_alive.py.
+#
+# Debouncer: a device has to be seen in the new state for EVENT_DOWN_CYCLES
+# (going down) / EVENT_UP_CYCLES (coming back) checks in a row, and at least
+# EVENT_MIN_SECONDS must have passed since its previous event, before an event
+# is emitted. A device flapping every cycle produces no events at all.
+#
+# EventPublisher: the liveness cycle only does put_nowait() on a bounded queue.
+# A background thread sends the events as JSON arrays of up to EVENT_BATCH_SIZE
+# (or whatever arrived within EVENT_BATCH_SECONDS) to EVENT_TOPIC. When the
+# broker is slow and the queue is full, or the client refuses the publish (not
+# connected), events are dropped and counted instead of blocking the cycle.
+#
+# EVENT_TOPIC is outside iot_sensors/# so Telegraf does not store it.
+
+MQTT_BROKER = os.getenv('MQTT_BROKER', 'localhost')
+MQTT_PORT = int(os.getenv('MQTT_PORT', 1883))
+EVENT_TOPIC = os.getenv('EVENT_TOPIC', 'device_events/liveness')
+EVENT_DOWN_CYCLES = int(os.getenv('EVENT_DOWN_CYCLES', 2))
+EVENT_UP_CYCLES = int(os.getenv('EVENT_UP_CYCLES', 1))
+EVENT_MIN_SECONDS = int(os.getenv('EVENT_MIN_SECONDS', 300))
+EVENT_QUEUE_SIZE = int(os.getenv('EVENT_QUEUE_SIZE', 10000))
+EVENT_BATCH_SIZE = int(os.getenv('EVENT_BATCH_SIZE', 500))
+EVENT_BATCH_SECONDS = float(os.getenv('EVENT_BATCH_SECONDS', 1))
+
+error_logger = logging.getLogger('error_logger')
+
+
+class Debouncer:
+    def __init__(self, down_cycles=EVENT_DOWN_CYCLES, up_cycles=EVENT_UP_CYCLES, min_seconds=EVENT_MIN_SECONDS):
+        self.down_cycles = down_cycles
+        self.up_cycles = up_cycles
+        self.min_seconds = min_seconds
+        self.reported = {}   # topic -> state last published (None: not known yet)
+        self.candidate = {}  # topic -> (state, consecutive checks)
+        self.last_event = {}  # topic -> time of the last event
+
+    def update(self, topic, connected, now):
+        """Returns the previous reported state when an event is due, else None"""
+        reported = self.reported.get(topic)
+        if reported is None:
+            # First check only sets the baseline
+            self.reported[topic] = connected
+            return None
+        if connected == reported:
+            self.candidate.pop(topic, None)
+            return None
+
+        state, count = self.candidate.get(topic, (connected, 0))
+        count = count + 1 if state == connected else 1
+        self.candidate[topic] = (connected, count)
+        if count < (self.up_cycles if connected else self.down_cycles):
+            return None
+        last_event = self.last_event.get(topic)
+        if last_event is not None and now - last_event < self.min_seconds:
+            return None
+
+        self.reported[topic] = connected
+        self.last_event[topic] = now
+        self.candidate.pop(topic, None)
+        return reported
+
+
+class EventPublisher:
+    def __init__(self, topic=EVENT_TOPIC):
+        self.topic = topic
+        self.queue = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.dropped = 0
+        self.published = 0
+        self.client = mqtt.Client()
+        self.client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+        self.client.loop_start()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + EVENT_BATCH_SECONDS
+            while len(batch) < EVENT_BATCH_SIZE:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                info = self.client.publish(self.topic, json.dumps(batch), qos=1)
+                if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                    self.published += len(batch)
+                else:
+                    # Not connected (yet) or the client queue is full: paho does not raise
+                    self.dropped += len(batch)
+                    error_logger.error(f"[EventPublisher] Error publishing {len(batch)} events: "
+                                       f"{mqtt.error_string(info.rc)}")
+            except Exception as e:
+                self.dropped += len(batch)
+                error_logger.error(f"[EventPublisher] Error publishing {len(batch)} events: {str(e)}")
+
+
+def build_event(topic, device, old, new, last_seen):
+    device = device or {}
+    return {
+        'device': topic,
+        'tools': device.get('tools'),
+        'machine': device.get('machine'),
+        'process': device.get('process'),
+        'location': device.get('location'),
+        'old_state': 'connected' if old else 'disconnected',
+        'new_state': 'connected' if new else 'disconnected',
+        'last_seen': last_seen,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
@@ -0,0 +1,170 @@
+import os
+import time
+import array
+import threading
+
+import paho.mqtt.client as mqtt
+
+from device_alive import get_topic_from_mssql, error_logger, success_logger, device_logger
+
+# Push-based alternative to device_alive.py.
+#
+# Subscribes to iot_sensors/device_alive/# and stores the arrival time of each
+# heartbeat in an array indexed by device id (O(1) per message, no InfluxDB
+# query). Timeouts are kept in a hashed timer wheel of DEVICE_TIMEOUT / TICK
+# slots: a device sits in the slot of its deadline; when the slot comes around
+# the device is either re-filed at last_seen + DEVICE_TIMEOUT (it sent something
+# meanwhile) or marked down. A heartbeat never touches the wheel, only a down
+# device coming back does, so the work per tick is the devices due in that slot.
+#
+#   python mqtt_liveness.py
+#
+# DEVICE_TIMEOUT=90 (s), TICK=1 (s), DEVICE_ALIVE_TOPIC=iot_sensors/device_alive/#
+
+MQTT_BROKER = os.getenv('MQTT_BROKER', 'localhost')
+MQTT_PORT = int(os.getenv('MQTT_PORT', 1883))
+DEVICE_ALIVE_TOPIC = os.getenv('DEVICE_ALIVE_TOPIC', 'iot_sensors/device_alive/#')
+DEVICE_TIMEOUT = float(os.getenv('DEVICE_TIMEOUT', 90))
+TICK = float(os.getenv('TICK', 1))
+INTERVAL = int(os.getenv('INTERVAL', 1))  # minutes between device_master_tb reloads and status lines
+
+
+class TimerWheel:
+    def __init__(self, horizon, tick, now):
+        self.tick = tick
+        self.size = int(horizon / tick) + 2
+        self.slots = [[] for _ in range(self.size)]
+        self.current = int(now / tick)
+
+    def schedule(self, device_id, deadline):
+        # Deadlines past the horizon land early and are re-filed when they fire
+        tick_number = max(int(deadline / self.tick), self.current)
+        self.slots[tick_number % self.size].append(device_id)
+
+    def advance(self, now):
+        """Device ids whose slot has passed since the last call"""
+        due = []
+        target = int(now / self.tick)
+        while self.current <= target:
+            slot = self.current % self.size
+            if self.slots[slot]:
+                due.extend(self.slots[slot])
+                self.slots[slot] = []
+            self.current += 1
+        return due
+
+
+class LivenessTracker:
+    def __init__(self, timeout, tick):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        now = time.time()
+        self.wheel = TimerWheel(timeout, tick, now)
+        self.ids = {}            # topic -> device id
+        self.devices = []        # device id -> device_master_tb row (dict)
+        self.last_seen = array.array('d')
+        self.up = bytearray()
+        self.messages = 0
+        self.unknown_messages = 0
+
+    def load_devices(self, topic_list):
+        """Add devices that are new in device_master_tb; they get one timeout to report"""
+        now = time.time()
+        added = 0
+        with self.lock:
+            for topic_dict in topic_list:
+                if topic_dict['topic'] in self.ids:
+                    continue
+                device_id = len(self.devices)
+                self.ids[topic_dict['topic']] = device_id
+                self.devices.append(topic_dict)
+                self.last_seen.append(now)
+                self.up.append(1)
+                self.wheel.schedule(device_id, now + self.timeout)
+                added += 1
+        return added
+
+    def on_heartbeat(self, topic, now):
+        device_id = self.ids.get(topic)
+        if device_id is None:
+            self.unknown_messages += 1
+            return
+        self.messages += 1
+        self.last_seen[device_id] = now
+        if not self.up[device_id]:
+            with self.lock:
+                if not self.up[device_id]:
+                    self.up[device_id] = 1
+                    self.wheel.schedule(device_id, now + self.timeout)
+            self.log_transition(device_id, True)
+
+    def check(self, now):
+        """Fire due timers; returns the ids that went down"""
+        went_down = []
+        with self.lock:
+            for device_id in self.wheel.advance(now):
+                deadline = self.last_seen[device_id] + self.timeout
+                if deadline > now:
+                    self.wheel.schedule(device_id, deadline)
+                elif self.up[device_id]:
+                    self.up[device_id] = 0
+                    went_down.append(device_id)
+        for device_id in went_down:
+            self.log_transition(device_id, False)
+        return went_down
+
+    def log_transition(self, device_id, up):
+        device = self.devices[device_id]
+        if up:
+            success_msg = (f"[mqtt_liveness] Device connected for topic: {device['topic']}, "
+                           f"process: {device['process']}, location: {device['location']}")
+            success_logger.info(success_msg)
+        else:
+            device_msg = (f"[mqtt_liveness] Device disconnected for topic: {device['topic']}, "
+                          f"process: {device['process']}, location: {device['location']}, "
+                          f"silent for {time.time() - self.last_seen[device_id]:.0f}s")
+            device_logger.debug(device_msg)
+
+    def counts(self):
+        alive = sum(self.up)
+        return alive, len(self.devices) - alive
+
+
+def main():
+    tracker = LivenessTracker(DEVICE_TIMEOUT, TICK)
+    topic_list = get_topic_from_mssql()
+    print(f"Tracking {tracker.load_devices(topic_list)} devices")
+
+    client = mqtt.Client()
+    client.on_connect = lambda c, userdata, flags, rc: c.subscribe(DEVICE_ALIVE_TOPIC)
+    client.on_message = lambda c, userdata, msg: tracker.on_heartbeat(msg.topic, time.time())
+    client.connect(MQTT_BROKER, MQTT_PORT, 60)
+    client.loop_start()
+
+    next_reload = time.time() + INTERVAL * 60
+    try:
+        while True:
+            now = time.time()
+            tracker.check(now)
+            if now >= next_reload:
+                added = tracker.load_devices(get_topic_from_mssql())
+                alive, dead = tracker.counts()
+                success_msg = (f"[mqtt_liveness] {alive} alive, {dead} disconnected, {tracker.messages} heartbeats, "
+                               f"{tracker.unknown_messages} from unknown topics, {added} new devices")
+                print(success_msg)
+                success_logger.info(success_msg)
+                tracker.messages = tracker.unknown_messages = 0
+                next_reload = now + INTERVAL * 60
+            time.sleep(TICK)
+    except KeyboardInterrupt:
+        print("Stopping liveness tracker...")
+    except Exception as e:
+        error_msg = f"[mqtt_liveness] Main error: {str(e)}"
+        print(error_msg)
+        error_logger.error(error_msg)
+    finally:
+        client.loop_stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import os
+import time
+import socket
+import asyncio
+import argparse
+
+# TCP reachability of the devices in device_master_tb (ip_address column).
+#
+# probe_all() opens a TCP connection to PROBE_PORT on every address with at most
+# PROBE_CONCURRENCY connections in flight and a PROBE_TIMEOUT per attempt, so a
+# sweep takes about addresses / concurrency * timeout in the worst case (10k
+# addresses, 1000 in flight, 1s timeout: ~10s when nothing answers, well under
+# that when they do). A refused connection counts as reachable: the host is up,
+# only nothing listens on the port.
+#
+# merge_state() combines the result with the heartbeat state:
+#   connected       heartbeat seen
+#   app_down        no heartbeat, host reachable   -> publisher app crashed
+#   network_down    no heartbeat, host unreachable -> network / power
+#   no_address      no heartbeat, no ip_address in device_master_tb
+#
+#   python reachability_probe.py --selftest            probe local stand-in listeners
+#   python reachability_probe.py 192.168.100.1 192.168.100.2 --port 502
+
+PROBE_PORT = int(os.getenv('PROBE_PORT', 22))
+PROBE_CONCURRENCY = int(os.getenv('PROBE_CONCURRENCY', 1000))
+PROBE_TIMEOUT = float(os.getenv('PROBE_TIMEOUT', 1))
+
+
+async def probe(address, port, timeout, semaphore):
+    async with semaphore:
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(address, port), timeout)
+            writer.close()
+            return True
+        except ConnectionRefusedError:
+            return True
+        except (asyncio.TimeoutError, OSError):
+            return False
+
+
+async def probe_addresses(targets, port, concurrency, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*(probe(address, target_port or port, timeout, semaphore)
+                                     for address, target_port in targets))
+    return dict(zip(targets, results))
+
+
+def probe_all(addresses, port=PROBE_PORT, concurrency=PROBE_CONCURRENCY, timeout=PROBE_TIMEOUT):
+    """{address: reachable}"""
+    results = asyncio.run(probe_addresses([(address, port) for address in addresses], port, concurrency, timeout))
+    return {address: reachable for (address, _), reachable in results.items()}
+
+
+def probe_devices(devices, port=PROBE_PORT):
+    """{topic: reachable} for device dicts with 'topic' and 'ip_address' (None when there is no address)"""
+    addresses = sorted({device['ip_address'] for device in devices if device.get('ip_address')})
+    reachable = probe_all(addresses, port) if addresses else {}
+    return {device['topic']: reachable.get(device.get('ip_address')) for device in devices}
+
+
+def merge_state(connected, reachable):
+    if connected:
+        return 'connected'
+    if reachable is None:
+        return 'no_address'
+    return 'app_down' if reachable else 'network_down'
+
+
+async def start_listeners(count):
+    """Local stand-ins for devices: count listeners on 127.0.0.1, returns (servers, ports)"""
+    async def accept(reader, writer):
+        writer.close()
+
+    servers, ports = [], []
+    for _ in range(count):
+        server = await asyncio.start_server(accept, '127.0.0.1', 0)
+        servers.append(server)
+        ports.append(server.sockets[0].getsockname()[1])
+    return servers, ports
+
+
+def start_black_holes(count):
+    """Stand-ins for unreachable devices: listeners whose backlog is full, so (on Linux) new SYNs are dropped and probes time out"""
+    sockets, ports = [], []
+    for _ in range(count):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(0)
+        port = server.getsockname()[1]
+        sockets.append(server)
+        for _ in range(4):
+            filler = socket.socket()
+            filler.setblocking(False)
+            try:
+                filler.connect(('127.0.0.1', port))
+            except BlockingIOError:
+                pass
+            sockets.append(filler)
+        ports.append(port)
+    return sockets, ports
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def selftest(listeners, closed, silent_count, concurrency, timeout):
+    servers, ports = await start_listeners(listeners)
+    black_holes, silent_ports = start_black_holes(silent_count)
+    await asyncio.sleep(0.1)  # let the fillers complete their handshakes
+    up = [('127.0.0.1', port) for port in ports]
+    refused = [('127.0.0.1', free_port()) for _ in range(closed)]
+    silent = [('127.0.0.1', port) for port in silent_ports]
+
+    start = time.perf_counter()
+    results = await probe_addresses(up + refused + silent, None, concurrency, timeout)
+    elapsed = time.perf_counter() - start
+    for server in servers:
+        server.close()
+    for sock in black_holes:
+        sock.close()
+
+    failures = [target for target in up + refused if not results[target]]
+    failures += [target for target in silent if results[target]]
+    print(f"{len(results)} probes ({listeners} listening, {closed} refused, {silent_count} silent) "
+          f"in {elapsed:.2f}s with {concurrency} in flight, {len(failures)} unexpected results")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent TCP reachability probe")
+    parser.add_argument('addresses', nargs='*')
+    parser.add_argument('--port', type=int, default=PROBE_PORT)
+    parser.add_argument('--concurrency', type=int, default=PROBE_CONCURRENCY)
+    parser.add_argument('--timeout', type=float, default=PROBE_TIMEOUT)
+    parser.add_argument('--selftest', action='store_true', help="probe local listeners instead of devices")
+    parser.add_argument('--listeners', type=int, default=500)
+    parser.add_argument('--closed', type=int, default=100)
+    parser.add_argument('--silent', type=int, default=100, help="stand-ins that never answer")
+    args = parser.parse_args()
+
+    if args.selftest:
+        ok = asyncio.run(selftest(args.listeners, args.closed, args.silent, args.concurrency, args.timeout))
+        raise SystemExit(0 if ok else 1)
+
+    start = time.perf_counter()
+    results = probe_all(args.addresses, args.port, args.concurrency, args.timeout)
+    for address, reachable in results.items():
+        print(f"{address:<20}{'reachable' if reachable else 'unreachable'}")
+    print(f"{len(results)} addresses in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import array
+import argparse
+
+# Rolling uptime per device for device_alive.py.
+#
+# One bit per device per check (INTERVAL minutes) in a ring of UPTIME_DAYS:
+# row d of `bits` holds device d, slot s of every row is overwritten when the
+# check for slot s runs. A shared `checked` bitmap marks the slots that were
+# actually checked, so time the checker itself was down counts as neither up
+# nor down. Uptime % of a window = popcount(row & checked & window) /
+# popcount(checked & window), with the device's first slot clipped off.
+#
+# Size: devices * UPTIME_DAYS * 1440 / INTERVAL / 8 bytes, e.g. 10k devices x 7 days
+# is 12.6 MB at INTERVAL=1 and 2.5 MB at INTERVAL=5.
+#
+# The state is written to UPTIME_SNAPSHOT every UPTIME_SNAPSHOT_MINUTES and read back at start.
+#
+#   python uptime_history.py                        shift (8h) / day / week for every device
+#   python uptime_history.py --window 12h iot_sensors/device_alive/got1_mc_1
+
+UPTIME_DAYS = int(os.getenv('UPTIME_DAYS', 7))
+UPTIME_SNAPSHOT = os.getenv('UPTIME_SNAPSHOT', 'uptime_history.bin')
+UPTIME_SNAPSHOT_MINUTES = int(os.getenv('UPTIME_SNAPSHOT_MINUTES', 10))
+INTERVAL = int(os.getenv('INTERVAL', 1))
+
+SNAPSHOT_VERSION = 1
+
+
+def popcount(value):
+    return bin(value).count('1')
+
+
+class UptimeHistory:
+    def __init__(self, interval_seconds, slots, capacity=1024):
+        self.interval_seconds = interval_seconds
+        self.slots = slots
+        self.row_bytes = (slots + 7) // 8
+        self.capacity = capacity
+        self.bits = bytearray(capacity * self.row_bytes)
+        self.checked = bytearray(self.row_bytes)
+        self.first_slot = array.array('q')
+        self.ids = {}  # topic -> device id
+        self.topics = []
+        self.last_slot = None
+
+    def slot_of(self, timestamp):
+        return int(timestamp // self.interval_seconds)
+
+    def _device_id(self, topic, slot):
+        device_id = self.ids.get(topic)
+        if device_id is None:
+            device_id = len(self.topics)
+            if device_id >= self.capacity:
+                self.capacity *= 2
+                self.bits.extend(bytearray((self.capacity - device_id) * self.row_bytes))
+            self.ids[topic] = device_id
+            self.topics.append(topic)
+            self.first_slot.append(slot)
+        return device_id
+
+    def _clear_checked(self, first, last):
+        for slot in range(first, min(last, first + self.slots)):
+            pos = slot % self.slots
+            self.checked[pos >> 3] &= ~(1 << (pos & 7)) & 0xFF
+
+    def record(self, timestamp, topics, alive):
+        """One check: every topic in topics is up when it is in alive, down otherwise"""
+        slot = self.slot_of(timestamp)
+        if self.last_slot is not None and slot > self.last_slot + 1:
+            self._clear_checked(self.last_slot + 1, slot)  # checker was not running
+        pos = slot % self.slots
+        byte, mask = pos >> 3, 1 << (pos & 7)
+        self.checked[byte] |= mask
+        for topic in topics:
+            offset = self._device_id(topic, slot) * self.row_bytes + byte
+            if topic in alive:
+                self.bits[offset] |= mask
+            else:
+                self.bits[offset] &= ~mask & 0xFF
+        self.last_slot = slot if self.last_slot is None else max(self.last_slot, slot)
+
+    def _window_mask(self, first_slot, last_slot):
+        """Bitmask over ring positions of slots first_slot..last_slot"""
+        count = last_slot - first_slot + 1
+        if count <= 0:
+            return 0
+        if count >= self.slots:
+            return (1 << self.slots) - 1
+        start = first_slot % self.slots
+        end = start + count
+        if end <= self.slots:
+            return ((1 << count) - 1) << start
+        return ((1 << (end - self.slots)) - 1) | (((1 << (self.slots - start)) - 1) << start)
+
+    def uptime(self, topic, window_seconds, now=None):
+        """Uptime % of topic over the last window_seconds, None without checked slots"""
+        device_id = self.ids.get(topic)
+        if device_id is None or self.last_slot is None:
+            return None
+        last_slot = min(self.slot_of(now if now is not None else time.time()), self.last_slot)
+        first_slot = max(last_slot - int(window_seconds // self.interval_seconds) + 1,
+                         self.first_slot[device_id], self.last_slot - self.slots + 1)
+        window = self._window_mask(first_slot, last_slot) & int.from_bytes(self.checked, 'little')
+        checked = popcount(window)
+        if not checked:
+            return None
+        start = device_id * self.row_bytes
+        row = int.from_bytes(self.bits[start:start + self.row_bytes], 'little')
+        return 100.0 * popcount(row & window) / checked
+
+    def save(self, path):
+        header = {
+            'version': SNAPSHOT_VERSION,
+            'interval_seconds': self.interval_seconds,
+            'slots': self.slots,
+            'last_slot': self.last_slot,
+            'topics': self.topics,
+            'first_slot': list(self.first_slot),
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(self.checked)
+            f.write(self.bits[:len(self.topics) * self.row_bytes])
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, interval_seconds, slots):
+        """Snapshot at path, or an empty history when it is missing or was written with other settings"""
+        history = cls(interval_seconds, slots)
+        if not os.path.exists(path):
+            return history
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            if (header.get('version') != SNAPSHOT_VERSION or header['interval_seconds'] != interval_seconds
+                    or header['slots'] != slots):
+                return history
+            history.checked = bytearray(f.read(history.row_bytes))
+            rows = f.read()
+        device_count = len(header['topics'])
+        history.capacity = max(history.capacity, device_count)
+        history.bits = bytearray(rows) + bytearray((history.capacity - device_count) * history.row_bytes)
+        history.topics = header['topics']
+        history.ids = {topic: i for i, topic in enumerate(history.topics)}
+        history.first_slot = array.array('q', header['first_slot'])
+        history.last_slot = header['last_slot']
+        return history
+
+
+def open_history():
+    return UptimeHistory.load(UPTIME_SNAPSHOT, INTERVAL * 60, UPTIME_DAYS * 1440 // INTERVAL)
+
+
+def parse_window(value):
+    units = {'m': 60, 'h': 3600, 'd': 86400}
+    return int(value[:-1]) * units[value[-1]] if value[-1] in units else int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Uptime % per device from the device_alive snapshot")
+    parser.add_argument('topics', nargs='*', help="default: every device in the snapshot")
+    parser.add_argument('--window', action='append', help="e.g. 8h, 1d, 7d (default: 8h, 1d, 7d)")
+    args = parser.parse_args()
+
+    windows = args.window or ['8h', '1d', '7d']
+    history = open_history()
+    if history.last_slot is None:
+        print(f"No uptime snapshot in {UPTIME_SNAPSHOT}")
+        return
+
+    print(f"{'topic':<50}" + ''.join(f"{window:>10}" for window in windows))
+    for topic in args.topics or history.topics:
+        values = [history.uptime(topic, parse_window(window)) for window in windows]
+        print(f"{topic:<50}" + ''.join(f"{'-':>10}" if v is None else f"{v:>9.1f}%" for v in values))
+
+
+if __name__ == "__main__":
+    main()
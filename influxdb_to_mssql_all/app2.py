@@ -9,6 +9,9 @@ import json
 from dotenv import load_dotenv
 import os
 import pandas as pd
+from writer_pool import write_tables_concurrently, latency_summary
+from mssql_statements import sp_executesql, build_sp_executesql, quote_ident, column_param_type
+from consolidated_storage import consolidated_table_name, ensure_day_partitions, create_consolidated_table, insert_consolidated
 # ==========================
 # 🔹 LOAD ENVIRONMENT VARIABLES
 # ==========================
@@ -34,6 +37,9 @@ MQTT_TOPIC_CANNOT_INSERT = os.getenv('MQTT_TOPIC_CANNOT_INSERT')
 # Script Settings
 INTERVAL = int(os.getenv('INTERVAL'))
 DELAY = int(os.getenv('DELAY'))
+WRITER_POOL_SIZE = int(os.getenv('WRITER_POOL_SIZE', 1))  # จำนวน connection สำหรับเขียนตารางพร้อมกัน
+# per_topic: ตาราง raw_* ต่อ topic | consolidated: ตาราง raw_{measurement}_all ต่อ measurement แบ่ง partition รายวัน
+STORAGE_MODE = os.getenv('STORAGE_MODE', 'per_topic')
 
 # 🔹 Measurement-to-Topics Mapping
 MEASUREMENT_TOPIC_MAP = {
@@ -98,12 +104,12 @@ def create_mssql_tables():
         for topic in topics:
             table_name = sanitize_table_name(topic)
 
-            cursor.execute(f"SELECT COUNT(*) FROM sysobjects WHERE name='{table_name}' AND xtype='U'")
+            sp_executesql(cursor, "SELECT COUNT(*) FROM sysobjects WHERE name = ? AND xtype = 'U'", (table_name,))
             if cursor.fetchone()[0] > 0:
                 print(f"⚡ Table '{table_name}' already exists.")
 
                 # 🔸 Get existing column names (excluding 'time', 'topic')
-                cursor.execute(f"SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = '{table_name}' AND COLUMN_NAME NOT IN ('time', 'topic')")
+                sp_executesql(cursor, "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = ? AND COLUMN_NAME NOT IN ('time', 'topic')", (table_name,))
                 columns = [row[0] for row in cursor.fetchall()]
                 table_columns_map[table_name] = columns
                 continue
@@ -145,6 +151,47 @@ def create_mssql_tables():
     cursor.close()
     conn.close()
     return table_columns_map
+# ==========================
+# 🔹 CREATE CONSOLIDATED TABLES (STORAGE_MODE=consolidated)
+# ==========================
+partitions_checked_on = None
+
+def create_consolidated_tables():
+    global partitions_checked_on
+    conn = connect_mssql()
+    cursor = conn.cursor()
+
+    # เพิ่ม partition รายวันล่วงหน้า วันละครั้ง
+    if partitions_checked_on != datetime.date.today():
+        added = ensure_day_partitions(cursor)
+        conn.commit()
+        partitions_checked_on = datetime.date.today()
+        if added:
+            print(f"✅ Added {added} day partitions")
+
+    for measurement in MEASUREMENT_TOPIC_MAP.keys():
+        table_name = consolidated_table_name(measurement)
+
+        sp_executesql(cursor, "SELECT COUNT(*) FROM sysobjects WHERE name = ? AND xtype = 'U'", (table_name,))
+        if cursor.fetchone()[0] > 0:
+            continue
+
+        # ตัวอย่างข้อมูลจาก topic ใดก็ได้ของ measurement นี้
+        query = f"SELECT * FROM \"{measurement}\" ORDER BY time DESC LIMIT 1"
+        points = list(influx_client.query(query).get_points())
+        if not points:
+            print(f"⚠️ No sample data for measurement '{measurement}', skipping table creation.")
+            continue
+
+        data_keys = [key for key in points[0].keys() if key not in ['time', 'topic', 'host']]
+        columns_with_type = [f"{quote_ident(key)} {infer_sql_type_from_value(points[0].get(key))}" for key in data_keys]
+        create_consolidated_table(cursor, table_name, columns_with_type)
+        conn.commit()
+        print(f"✅ Table '{table_name}' created with columns: {', '.join(data_keys)}")
+
+    cursor.close()
+    conn.close()
+
 def infer_sql_type_from_value(value):
     if isinstance(value, bool):
         return "BIT"
@@ -192,64 +239,65 @@ def fetch_influxdb_data():
 
     return all_data
 
+def fetch_influxdb_data_by_measurement():
+    now = datetime.datetime.utcnow()
+    start_time = now - datetime.timedelta(minutes=INTERVAL * 3, seconds=now.second, microseconds=now.microsecond)
+    end_time = start_time + datetime.timedelta(minutes=INTERVAL*3)
+
+    all_data = {}
+
+    # query เดียวต่อ measurement แทน query ต่อ topic
+    for measurement, topics in MEASUREMENT_TOPIC_MAP.items():
+        topic_set = set(topics)
+        query = f"""
+            SELECT * FROM \"{measurement}\"
+            WHERE time >= '{start_time.isoformat()}Z' AND time < '{end_time.isoformat()}Z'
+        """
+        result = influx_client.query(query)
+        all_data[consolidated_table_name(measurement)] = [
+            point for point in result.get_points() if point.get('topic') in topic_set
+        ]
+
+    return all_data
+
 # ==========================
 # 🔹 INSERT INTO MSSQL
 # ==========================
-def insert_data_to_mssql(data):
-    conn = connect_mssql()  # เชื่อมต่อกับ MSSQL
-    cursor = conn.cursor()  # สร้าง cursor สำหรับการทำงานกับฐานข้อมูล
+def insert_consolidated_to_mssql(data):
+    conn = connect_mssql()
+    cursor = conn.cursor()
 
-    for table_name, rows in data.items():  # วนลูปตามตารางในข้อมูล
+    # insert เดียวต่อ measurement (แบ่ง chunk ตามขีดจำกัด parameter ของ MSSQL)
+    for table_name, rows in data.items():
         if not rows:
             print(f"⚠️ ไม่มีข้อมูลให้แทรกสำหรับตาราง: {table_name}")
             continue
-
         try:
-            # เตรียมรายการของ tuple สำหรับการแทรกข้อมูลเป็นชุด
-            insert_values = []
-            for row in rows:  # วนลูปแถวในตารางนั้น
-                timestamp = datetime.datetime.strptime(row['time'], '%Y-%m-%dT%H:%M:%S.%fZ') + timedelta(hours=7)
-                timestamp_str = timestamp.isoformat()
-                topic = row['topic']
-                values = {key: row[key] for key in row if key not in ['time', 'topic', 'host']}
-
-                # ตรวจสอบว่าแถวนี้มีอยู่ในฐานข้อมูลแล้วหรือไม่
-                check_query = f"SELECT COUNT(*) FROM {table_name} WHERE time = %s AND topic = %s"
-                cursor.execute(check_query, (timestamp, topic))
-                if cursor.fetchone()[0] == 0:
-                    # เพิ่มข้อมูลเข้าไปในรายการสำหรับการแทรก
-                    insert_values.append((timestamp, topic, *values.values()))
-
-            if not insert_values:
-                print(f"⚠️ ไม่มีข้อมูลใหม่ให้แทรกสำหรับตาราง: {table_name}")
-                continue
+            data_columns = [key for key in rows[0].keys() if key not in ['time', 'topic', 'host']]
+            insert_values = [
+                (datetime.datetime.strptime(row['time'], '%Y-%m-%dT%H:%M:%S.%fZ') + timedelta(hours=7),
+                 row['topic'],
+                 *[row.get(key) for key in data_columns])
+                for row in rows
+            ]
+            inserted = insert_consolidated(cursor, table_name, ['time', 'topic'] + data_columns, insert_values)
+            conn.commit()
 
-            # เตรียมคำสั่ง INSERT สำหรับการแทรกเป็นชุด
-            columns = ', '.join(['time', 'topic'] + list(values.keys()))
-            placeholders = ', '.join(['%s'] * (len(values) + 2))  # +2 สำหรับ time และ topic
-            insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-
-            # ดำเนินการแทรกข้อมูลเป็นชุด
-            cursor.executemany(insert_query, insert_values)
-            conn.commit()  # ยืนยันการเปลี่ยนแปลงในฐานข้อมูล
-
-            # ส่งข้อความ MQTT เพื่อแจ้งความสำเร็จสำหรับแต่ละแถว
-            for timestamp, topic, *vals in insert_values:
-                mqtt_message = {
-                    "data_id": values.get("data_id", None),  # ปรับตามความเหมาะสมถ้าต้องการ data_id เฉพาะ
-                    "status": "success",
-                    "error": "ok",
-                    "timestamp": timestamp.isoformat(),
-                    "table_name": table_name
-                }
-                mqtt_client.publish(MQTT_TOPIC_CANNOT_INSERT, json.dumps(mqtt_message))
-            print(f"✅ แทรกข้อมูล {len(insert_values)} แถวลงใน: {table_name} สำเร็จ")
+            mqtt_message = {
+                "data_id": None,
+                "status": "success",
+                "error": "ok",
+                "timestamp": datetime.datetime.utcnow().isoformat(),
+                "table_name": table_name,
+                "rows": inserted
+            }
+            mqtt_client.publish(MQTT_TOPIC_CANNOT_INSERT, json.dumps(mqtt_message))
+            print(f"✅ แทรกข้อมูล {inserted} แถวลงใน: {table_name} สำเร็จ")
 
         except Exception as e:
-            conn.rollback()  # ยกเลิกการเปลี่ยนแปลงถ้ามีข้อผิดพลาด
-            # ส่งข้อความ MQTT เพื่อแจ้งข้อผิดพลาด
+            conn.rollback()
             mqtt_message = {
-                "data_id": rows[0].get("data_id", None) if rows else None,
+                "data_id": rows[0].get("data_id", None),
                 "status": "fail",
                 "error": str(e),
                 "timestamp": datetime.datetime.utcnow().isoformat(),
@@ -258,8 +306,100 @@ def insert_data_to_mssql(data):
             mqtt_client.publish(MQTT_TOPIC_CANNOT_INSERT, json.dumps(mqtt_message))
             print(f"⚠️ ไม่สามารถแทรกข้อมูลลงใน: {table_name} | ข้อผิดพลาด: {e}")
 
-    cursor.close()  # ปิด cursor
-    conn.close()  # ปิดการเชื่อมต่อ
+    cursor.close()
+    conn.close()
+
+def insert_table_to_mssql(conn, table_name, rows):
+    """Returns True when rows were committed, False when there was nothing new or the insert failed"""
+    if not rows:
+        print(f"⚠️ ไม่มีข้อมูลให้แทรกสำหรับตาราง: {table_name}")
+        return False
+
+    cursor = conn.cursor()  # สร้าง cursor สำหรับการทำงานกับฐานข้อมูล
+    try:
+        # เตรียมรายการของ tuple สำหรับการแทรกข้อมูลเป็นชุด
+        insert_values = []
+        for row in rows:  # วนลูปแถวในตารางนั้น
+            timestamp = datetime.datetime.strptime(row['time'], '%Y-%m-%dT%H:%M:%S.%fZ') + timedelta(hours=7)
+            timestamp_str = timestamp.isoformat()
+            topic = row['topic']
+            values = {key: row[key] for key in row if key not in ['time', 'topic', 'host']}
+
+            # ตรวจสอบว่าแถวนี้มีอยู่ในฐานข้อมูลแล้วหรือไม่
+            check_query = f"SELECT COUNT(*) FROM {quote_ident(table_name)} WHERE time = ? AND topic = ?"
+            sp_executesql(cursor, check_query, (timestamp, topic))
+            if cursor.fetchone()[0] == 0:
+                # เพิ่มข้อมูลเข้าไปในรายการสำหรับการแทรก
+                insert_values.append((timestamp, topic, *values.values()))
+
+        if not insert_values:
+            print(f"⚠️ ไม่มีข้อมูลใหม่ให้แทรกสำหรับตาราง: {table_name}")
+            return False
+
+        # เตรียมคำสั่ง INSERT สำหรับการแทรกเป็นชุด
+        column_names = ['time', 'topic'] + list(values.keys())
+        columns = ', '.join(quote_ident(col) for col in column_names)
+        placeholders = ', '.join(['?'] * (len(values) + 2))  # +2 สำหรับ time และ topic
+        # ชนิดของพารามิเตอร์มาจาก schema ของตาราง ไม่ใช่จากค่าของแถวแรก (executemany ใช้ declaration เดียวทุกแถว)
+        sp_executesql(cursor, "SELECT COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = ?",
+                      (table_name,))
+        column_types = {name: data_type for name, data_type in cursor.fetchall()}
+        insert_query = build_sp_executesql(
+            f"INSERT INTO {quote_ident(table_name)} ({columns}) VALUES ({placeholders})", insert_values[0],
+            [column_param_type(column_types.get(col)) for col in column_names]
+        )
+
+        # ดำเนินการแทรกข้อมูลเป็นชุด
+        cursor.executemany(insert_query, insert_values)
+        conn.commit()  # ยืนยันการเปลี่ยนแปลงในฐานข้อมูล
+
+        # ส่งข้อความ MQTT เพื่อแจ้งความสำเร็จสำหรับแต่ละแถว
+        for timestamp, topic, *vals in insert_values:
+            mqtt_message = {
+                "data_id": values.get("data_id", None),  # ปรับตามความเหมาะสมถ้าต้องการ data_id เฉพาะ
+                "status": "success",
+                "error": "ok",
+                "timestamp": timestamp.isoformat(),
+                "table_name": table_name
+            }
+            mqtt_client.publish(MQTT_TOPIC_CANNOT_INSERT, json.dumps(mqtt_message))
+        print(f"✅ แทรกข้อมูล {len(insert_values)} แถวลงใน: {table_name} สำเร็จ")
+        return True
+
+    except Exception as e:
+        conn.rollback()  # ยกเลิกการเปลี่ยนแปลงถ้ามีข้อผิดพลาด
+        # ส่งข้อความ MQTT เพื่อแจ้งข้อผิดพลาด
+        mqtt_message = {
+            "data_id": rows[0].get("data_id", None) if rows else None,
+            "status": "fail",
+            "error": str(e),
+            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "table_name": table_name
+        }
+        mqtt_client.publish(MQTT_TOPIC_CANNOT_INSERT, json.dumps(mqtt_message))
+        print(f"⚠️ ไม่สามารถแทรกข้อมูลลงใน: {table_name} | ข้อผิดพลาด: {e}")
+        return False
+    finally:
+        cursor.close()  # ปิด cursor
+
+
+def insert_data_to_mssql(data):
+    if WRITER_POOL_SIZE <= 1:
+        conn = connect_mssql()  # เชื่อมต่อกับ MSSQL
+        for table_name, rows in data.items():  # วนลูปตามตารางในข้อมูล
+            insert_table_to_mssql(conn, table_name, rows)
+        conn.close()  # ปิดการเชื่อมต่อ
+        return
+
+    # ตารางไม่เกี่ยวข้องกัน จึงเขียนขนานกันได้ผ่านหลาย connection
+    start = time.time()
+    latencies = write_tables_concurrently(data, connect_mssql, insert_table_to_mssql, WRITER_POOL_SIZE)
+    summary = latency_summary(latencies.values())
+    print(
+        f"📊 {summary['count']}/{len(data)} tables committed over {WRITER_POOL_SIZE} connections in {time.time() - start:.2f}s | "
+        f"commit latency p50={summary['p50_ms']:.1f}ms p90={summary['p90_ms']:.1f}ms "
+        f"p99={summary['p99_ms']:.1f}ms max={summary['max_ms']:.1f}ms"
+    )
 # def filter_data_by_table_schema_with_types(all_data):
 #     conn = connect_mssql()
 #     cursor = conn.cursor()
@@ -325,12 +465,12 @@ def filter_data_by_table_schema_with_types(all_data):
             continue
 
         # ดึง schema ของตาราง
-        cursor.execute(f"""
+        sp_executesql(cursor, """
             SELECT COLUMN_NAME, DATA_TYPE
             FROM INFORMATION_SCHEMA.COLUMNS
-            WHERE TABLE_NAME = '{table_name}'
+            WHERE TABLE_NAME = ?
               AND COLUMN_NAME NOT IN ('time', 'topic')
-        """)
+        """, (table_name,))
         result = cursor.fetchall()
         column_types = {col[0]: col[1].lower() for col in result}
 
@@ -380,14 +520,20 @@ def main():
         time.sleep(DELAY)
         try:
             start = time.time()
-            create_mssql_tables()
-            # 🔹 ดึงข้อมูลจาก InfluxDB
-            influx_data = fetch_influxdb_data()
+            if STORAGE_MODE == 'consolidated':
+                create_consolidated_tables()
+                influx_data = fetch_influxdb_data_by_measurement()
+            else:
+                create_mssql_tables()
+                # 🔹 ดึงข้อมูลจาก InfluxDB
+                influx_data = fetch_influxdb_data()
             # 🔹 กรองเฉพาะคีย์ที่ตรงกับ column ที่สร้างไว้ใน MSSQL
             filtered_data = filter_data_by_table_schema_with_types(influx_data)
             print("filtered_data: clear")
             # 🔹 Insert ข้อมูล
-            if filtered_data:
+            if filtered_data and STORAGE_MODE == 'consolidated':
+                insert_consolidated_to_mssql(filtered_data)
+            elif filtered_data:
                 
                 insert_data_to_mssql(filtered_data)
                  
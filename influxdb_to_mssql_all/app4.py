@@ -3,6 +3,7 @@ import time
 from influxdb import InfluxDBClient
 import pymssql
 from datetime import datetime
+from mssql_statements import sp_executesql, quote_ident
 
 # Load environment variables
 INFLUXDB_HOST = os.getenv('INFLUXDB_HOST', 'localhost')
@@ -129,7 +130,7 @@ def sync_data():
             table_name = f"{measurement}_tb"
             
             # Get latest timestamp from MSSQL
-            cursor.execute(f"SELECT MAX(time) FROM {table_name}")
+            cursor.execute(f"SELECT MAX(time) FROM {quote_ident(table_name)}")
             last_time = cursor.fetchone()[0]
             
             # Query InfluxDB
@@ -140,26 +141,25 @@ def sync_data():
             points = list(result.get_points())
             
             # Get table columns
-            cursor.execute(f"SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = '{table_name}'")
+            sp_executesql(cursor, "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = ?", (table_name,))
             valid_columns = [row[0] for row in cursor.fetchall()]
             
             for point in points:
                 columns = [col for col in point.keys() if col in valid_columns]
-                values = [f"'{point[col]}'" if isinstance(point[col], str) else str(point[col]) 
-                         for col in columns]
+                values = [point[col] for col in columns]
                 
                 # Check if record exists
                 time_value = point['time']
-                check_query = f"SELECT COUNT(*) FROM {table_name} WHERE time = '{time_value}'"
-                cursor.execute(check_query)
+                check_query = f"SELECT COUNT(*) FROM {quote_ident(table_name)} WHERE time = ?"
+                sp_executesql(cursor, check_query, (time_value,))
                 exists = cursor.fetchone()[0] > 0
                 
                 if not exists:
                     insert_query = f"""
-                    INSERT INTO {table_name} ({','.join(columns)})
-                    VALUES ({','.join(values)})
+                    INSERT INTO {quote_ident(table_name)} ({','.join(quote_ident(col) for col in columns)})
+                    VALUES ({','.join(['?'] * len(values))})
                     """
-                    cursor.execute(insert_query)
+                    sp_executesql(cursor, insert_query, values)
         
         conn.commit()
         conn.close()
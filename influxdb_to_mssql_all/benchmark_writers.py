@@ -0,0 +1,118 @@
+import argparse
+import datetime
+import time
+
+import final6_tvp_log as sync
+import mssql_schema
+from schema_bootstrap import bootstrap
+from mssql_writers import WRITERS, get_writer, get_table_column_types
+
+# Compare the MSSQL writer backends on the same dataset.
+#
+#   python benchmark_writers.py --measurement iot_got1 --minutes 30 --repeat 5
+#
+# The rows are read once from InfluxDB (same path as final6_tvp_log.py) and then
+# written by every backend into a scratch copy of the measurement table
+# ({measurement}_bench_tb), so the production table is never touched.
+
+
+def get_session_cpu_ms(cursor):
+    cursor.execute("SELECT cpu_time FROM sys.dm_exec_sessions WHERE session_id = @@SPID")
+    return cursor.fetchone()[0]
+
+
+def prepare_bench_table(conn, measurement):
+    source_table = f"{measurement}_tb"
+    bench_measurement = f"{measurement}_bench"
+    bench_table = f"{bench_measurement}_tb"
+    cursor = conn.cursor()
+
+    cursor.execute(f"IF OBJECT_ID('usp_Insert_{bench_measurement}', 'P') IS NOT NULL DROP PROCEDURE usp_Insert_{bench_measurement}")
+    cursor.execute(f"IF TYPE_ID('{bench_measurement}_tvp_type') IS NOT NULL DROP TYPE {bench_measurement}_tvp_type")
+    cursor.execute(f"IF OBJECT_ID('{bench_table}', 'U') IS NOT NULL DROP TABLE {bench_table}")
+    cursor.execute(f"SELECT TOP 0 * INTO {bench_table} FROM {source_table}")
+
+    column_types = get_table_column_types(cursor, bench_table)
+    cursor.execute(mssql_schema.build_tvp_type_sql(bench_measurement, column_types, False))
+    cursor.execute(mssql_schema.build_insert_procedure_sql(bench_measurement, bench_table, [name for name, _ in column_types]))
+    conn.commit()
+    cursor.close()
+    return bench_table
+
+
+def run_backend(backend, measurement, columns, rows, batch_size):
+    conn = sync.connect_mssql()
+    if not conn:
+        raise Exception("MSSQL connection failed")
+    try:
+        bench_table = prepare_bench_table(conn, measurement)
+        writer = get_writer(backend)
+        cursor = conn.cursor()
+
+        cpu_before = get_session_cpu_ms(cursor)
+        start = time.perf_counter()
+        for i in range(0, len(rows), batch_size):
+            writer(conn, bench_table, columns, rows[i:i + batch_size])
+            conn.commit()
+        elapsed = time.perf_counter() - start
+        cpu_ms = get_session_cpu_ms(cursor) - cpu_before
+
+        cursor.execute(f"SELECT COUNT(*) FROM {bench_table}")
+        written = cursor.fetchone()[0]
+        cursor.close()
+        return {'rows': written, 'seconds': elapsed, 'cpu_ms': cpu_ms}
+    finally:
+        conn.close()
+
+
+def load_dataset(measurement, minutes, repeat):
+    if not sync.connect_influxdb():
+        raise Exception("InfluxDB connection failed")
+    conn = sync.connect_mssql()
+    if not conn:
+        raise Exception("MSSQL connection failed")
+    try:
+        column_info = bootstrap(conn, sync.influx_client, [measurement]).get(measurement)
+    finally:
+        conn.close()
+    if column_info is None:
+        raise Exception(f"No table/schema for measurement {measurement}")
+
+    since = datetime.datetime.utcnow() - datetime.timedelta(minutes=minutes)
+    data = sync.fetch_influxdb_data(column_info, measurement, since)
+    if not data:
+        raise Exception(f"No data in the last {minutes} minutes for {measurement}")
+
+    columns = list(data[0].keys())
+    rows = [tuple(row[col] for col in columns) for row in data]
+    return columns, rows * repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MSSQL writer backends")
+    parser.add_argument('--measurement', required=True)
+    parser.add_argument('--minutes', type=int, default=30, help="how much InfluxDB history to use as dataset")
+    parser.add_argument('--repeat', type=int, default=1, help="repeat the dataset N times")
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--backends', default=','.join(WRITERS))
+    args = parser.parse_args()
+
+    columns, rows = load_dataset(args.measurement, args.minutes, args.repeat)
+    print(f"Dataset: {len(rows)} rows x {len(columns)} columns from {args.measurement}")
+
+    print(f"{'backend':<18}{'rows':>10}{'seconds':>10}{'rows/sec':>12}{'server cpu ms':>15}{'cpu ms/1k rows':>16}")
+    for backend in args.backends.split(','):
+        backend = backend.strip()
+        try:
+            result = run_backend(backend, args.measurement, columns, rows, args.batch_size)
+        except Exception as e:
+            print(f"{backend:<18}failed: {str(e)}")
+            continue
+        rows_per_sec = result['rows'] / result['seconds'] if result['seconds'] else 0
+        cpu_per_k = result['cpu_ms'] / (result['rows'] / 1000) if result['rows'] else 0
+        print(f"{backend:<18}{result['rows']:>10}{result['seconds']:>10.2f}{rows_per_sec:>12.0f}"
+              f"{result['cpu_ms']:>15}{cpu_per_k:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
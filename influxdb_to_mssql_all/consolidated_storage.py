@@ -0,0 +1,102 @@
+import os
+import datetime
+
+from mssql_statements import build_sp_executesql, sp_executesql, quote_ident
+
+# Consolidated storage for app2.py (STORAGE_MODE=consolidated).
+#
+# Instead of one raw_{tools}_{machine} table per topic, every topic of a
+# measurement goes into raw_{measurement}_all, keyed by (topic, time) and
+# partitioned by day on time. A cycle then needs one insert per measurement,
+# and Grafana reads one table with WHERE topic = ... instead of a UNION.
+# Written for pymssql connections (%s parameters).
+
+PARTITION_FUNCTION = 'pf_raw_day'
+PARTITION_SCHEME = 'ps_raw_day'
+PARTITION_DAYS_BACK = int(os.getenv('PARTITION_DAYS_BACK', 8))
+PARTITION_DAYS_AHEAD = int(os.getenv('PARTITION_DAYS_AHEAD', 7))
+
+# SQL Server limits: 1000 rows per VALUES constructor, 2100 parameters per request
+MAX_VALUES_ROWS = 1000
+MAX_PARAMS = 2099
+
+
+def consolidated_table_name(measurement):
+    return f"raw_{measurement}_all"
+
+
+def get_partition_boundaries(cursor):
+    sp_executesql(cursor, """
+        SELECT CAST(prv.value AS DATETIME)
+        FROM sys.partition_range_values prv
+        JOIN sys.partition_functions pf ON pf.function_id = prv.function_id
+        WHERE pf.name = ?
+    """, (PARTITION_FUNCTION,))
+    return {row[0].date() for row in cursor.fetchall()}
+
+
+def ensure_day_partitions(cursor, today=None):
+    """Create the day partition function/scheme if needed and add boundaries up to today + PARTITION_DAYS_AHEAD"""
+    today = today or datetime.date.today()
+    sp_executesql(cursor, "SELECT COUNT(*) FROM sys.partition_functions WHERE name = ?", (PARTITION_FUNCTION,))
+    if cursor.fetchone()[0] == 0:
+        first_day = today - datetime.timedelta(days=PARTITION_DAYS_BACK)
+        days = [first_day + datetime.timedelta(days=i) for i in range(PARTITION_DAYS_BACK + PARTITION_DAYS_AHEAD + 1)]
+        boundaries = ', '.join(f"'{day:%Y-%m-%d}'" for day in days)
+        cursor.execute(f"CREATE PARTITION FUNCTION {PARTITION_FUNCTION} (DATETIME) AS RANGE RIGHT FOR VALUES ({boundaries})")
+        cursor.execute(f"CREATE PARTITION SCHEME {PARTITION_SCHEME} AS PARTITION {PARTITION_FUNCTION} ALL TO ([PRIMARY])")
+        return len(days)
+
+    existing = get_partition_boundaries(cursor)
+    added = 0
+    for i in range(PARTITION_DAYS_AHEAD + 1):
+        day = today + datetime.timedelta(days=i)
+        if day not in existing:
+            cursor.execute(f"ALTER PARTITION SCHEME {PARTITION_SCHEME} NEXT USED [PRIMARY]")
+            cursor.execute(f"ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() SPLIT RANGE ('{day:%Y-%m-%d}')")
+            added += 1
+    return added
+
+
+def create_consolidated_table(cursor, table_name, columns_with_type):
+    """columns_with_type: ["[col] TYPE", ...] for the data columns (without time/topic)"""
+    columns_sql = ''.join(f"{column},\n                " for column in columns_with_type)
+    cursor.execute(f"""
+        CREATE TABLE {quote_ident(table_name)} (
+            topic VARCHAR(255) NOT NULL,
+            time DATETIME NOT NULL,
+            {columns_sql}CONSTRAINT {quote_ident('PK_' + table_name)} PRIMARY KEY CLUSTERED (topic, time)
+        ) ON {PARTITION_SCHEME}(time)
+    """)
+
+
+def insert_consolidated(cursor, table_name, columns, rows):
+    """
+    Insert rows (tuples ordered like columns, which must start with time, topic)
+    in as few statements as the VALUES/parameter limits allow. Rows whose
+    (topic, time) already exist are skipped by the statement itself.
+    Returns the number of rows inserted.
+    """
+    # The same (topic, time) twice in one VALUES list would violate the key
+    unique_rows = list({(row[1], row[0]): row for row in rows}.values())
+
+    column_sql = ', '.join(quote_ident(col) for col in columns)
+    row_sql = f"({', '.join(['?'] * len(columns))})"
+    chunk_size = max(1, min(MAX_VALUES_ROWS, MAX_PARAMS // len(columns)))
+    inserted = 0
+
+    for start in range(0, len(unique_rows), chunk_size):
+        chunk = unique_rows[start:start + chunk_size]
+        sql = f"""
+            INSERT INTO {quote_ident(table_name)} ({column_sql})
+            SELECT {column_sql}
+            FROM (VALUES {', '.join([row_sql] * len(chunk))}) AS v ({column_sql})
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {quote_ident(table_name)} t WHERE t.topic = v.topic AND t.time = CAST(v.time AS DATETIME)
+            );
+            SELECT @@ROWCOUNT
+        """
+        params = [value for row in chunk for value in row]
+        cursor.execute(build_sp_executesql(sql, params), tuple(params))
+        inserted += cursor.fetchone()[0]
+    return inserted
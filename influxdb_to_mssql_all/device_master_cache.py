@@ -0,0 +1,110 @@
+import logging
+
+# In-memory copy of device_master_tb shared by device_alive.py and final6_tvp_log.py
+# (the same file lives in device_alive/ and influxdb_to_mssql_all/).
+#
+# refresh() keeps one connection open and asks only for a change token
+# (row count + CHECKSUM_AGG over the columns); the table is read again, and the
+# topic / measurement / enrichment maps rebuilt, only when the token changes.
+# When MSSQL can't be reached the last loaded data stays in use.
+
+error_logger = logging.getLogger('error_logger')
+success_logger = logging.getLogger('success_logger')
+
+TOKEN_SQL = """
+    SELECT COUNT_BIG(*), CHECKSUM_AGG(CHECKSUM(tools, machine, process, location, ip_address))
+    FROM device_master_tb
+"""
+
+DEVICES_SQL = """
+    SELECT DISTINCT tools, machine, process, location, ip_address
+    FROM device_master_tb
+    WHERE tools IS NOT NULL
+"""
+
+
+class DeviceMasterCache:
+    def __init__(self, connect):
+        self.connect = connect
+        self.conn = None
+        self.token = None
+        self.polls = 0
+        self.reloads = 0
+        self.devices = []        # one dict per device row (tools and machine set)
+        self.topic_list = []     # device_alive topic dicts, sorted by topic
+        self.measurements = []   # iot_{tools} of every row with tools, machine or not, sorted
+        self.by_topic = {}       # device_alive topic -> device
+        self.by_iot_topic = {}   # iot_sensors/iot_{tools}/{machine} -> device
+
+    def _cursor(self):
+        if self.conn is None:
+            self.conn = self.connect()
+            if not self.conn:
+                self.conn = None
+                raise Exception("MSSQL connection failed")
+        return self.conn.cursor()
+
+    def refresh(self):
+        """Reload when device_master_tb changed. Returns True when the maps were rebuilt."""
+        try:
+            cursor = self._cursor()
+            cursor.execute(TOKEN_SQL)
+            token = tuple(cursor.fetchone())
+            self.polls += 1
+            if token == self.token:
+                cursor.close()
+                return False
+
+            cursor.execute(DEVICES_SQL)
+            rows = cursor.fetchall()
+            cursor.close()
+            self.conn.commit()
+        except Exception as e:
+            error_msg = f"[DeviceMasterCache.refresh] Error reading device_master_tb: {str(e)}"
+            print(error_msg)
+            error_logger.error(error_msg)
+            if self.conn is not None:
+                try:
+                    self.conn.close()
+                except Exception:
+                    pass
+                self.conn = None
+            return False
+
+        self._build(rows)
+        self.token = token
+        self.reloads += 1
+        success_msg = (f"[DeviceMasterCache.refresh] Reloaded {len(self.devices)} devices "
+                       f"(reload {self.reloads} after {self.polls} polls)")
+        print(success_msg)
+        success_logger.info(success_msg)
+        return True
+
+    def _build(self, rows):
+        devices = [
+            {
+                'tools': row[0],
+                'machine': row[1],
+                'process': row[2],
+                'location': row[3],
+                'ip_address': row[4],
+                'topic': f"iot_sensors/device_alive/{row[0]}_{row[1]}",
+                'iot_topic': f"iot_sensors/iot_{row[0]}/{row[1]}",
+            }
+            for row in rows
+            if row[0] and row[1]
+        ]
+        self.devices = devices
+        self.by_topic = {device['topic']: device for device in devices}
+        self.topic_list = sorted(
+            ({key: device[key] for key in ('topic', 'iot_topic', 'process', 'location')} for device in self.by_topic.values()),
+            key=lambda x: x['topic']
+        )
+        # final6 syncs every tools of the table, also rows without a machine
+        self.measurements = sorted({f"iot_{row[0]}" for row in rows if row[0]})
+        self.by_iot_topic = {device['iot_topic']: device for device in devices}
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
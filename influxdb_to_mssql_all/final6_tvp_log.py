@@ -6,6 +6,14 @@ from dotenv import load_dotenv
 import os
 import logging
 import logging.handlers  # เพิ่มสำหรับ RotatingFileHandler
+import mssql_schema
+import mssql_writers
+from mssql_statements import quote_ident, get_cursor, release
+from mssql_writers import get_writer, parse_backend_map, group_multi_tvp, write_multi_tvp, counted_execute, counted_commit
+from schema_bootstrap import bootstrap, find_schema_changes
+from recent_keys import RecentKeyIndex, LatenessWatermark
+from shard_leases import balance_leases, renew_lease, SYNC_INSTANCE_ID
+from device_master_cache import DeviceMasterCache
 
 # Configure logging
 logging.basicConfig(
@@ -49,6 +57,31 @@ MSSQL_PORT = int(os.getenv('MSSQL_PORT', 1433))
 
 INTERVAL = int(os.getenv('INTERVAL', 1))
 
+# Writer backend (tvp, fast_executemany, values, bulk), overridable per table:
+# WRITER_BACKEND_MAP=iot_got1_tb=values,iot_got2_tb=fast_executemany
+WRITER_BACKEND = os.getenv('WRITER_BACKEND', 'tvp')
+WRITER_BACKEND_MAP = parse_backend_map(os.getenv('WRITER_BACKEND_MAP', ''))
+
+# FLUSH_MODE=per_measurement: one EXEC + commit per measurement
+# FLUSH_MODE=multi: pack several measurements' TVPs into one batch of EXECs, one commit per batch
+FLUSH_MODE = os.getenv('FLUSH_MODE', 'per_measurement')
+MULTI_FLUSH_MAX_ROWS = int(os.getenv('MULTI_FLUSH_MAX_ROWS', 50000))
+MULTI_FLUSH_MAX_TABLES = int(os.getenv('MULTI_FLUSH_MAX_TABLES', 50))
+
+# Late data: every cycle re-reads LATE_WINDOW_SECONDS behind the newest committed time and
+# drops rows already committed, using an in-memory (time, LATE_KEY_COLUMNS) index:
+# exact keys for LATE_EXACT_SECONDS, Bloom filters per hour for the rest of the window.
+# LATE_WINDOW_SECONDS=0 resumes at last time + 1µs as before.
+LATE_WINDOW_SECONDS = int(os.getenv('LATE_WINDOW_SECONDS', 300))
+LATE_EXACT_SECONDS = int(os.getenv('LATE_EXACT_SECONDS', 120))
+LATE_MAX_EXACT_KEYS = int(os.getenv('LATE_MAX_EXACT_KEYS', 500000))
+LATE_BLOOM_EXPECTED_KEYS = int(os.getenv('LATE_BLOOM_EXPECTED_KEYS', 200000))
+LATE_BLOOM_FP_RATE = float(os.getenv('LATE_BLOOM_FP_RATE', 0.001))
+# SYNC_SHARDING=1: several instances split the measurements through leases in MSSQL (shard_leases.py)
+SYNC_SHARDING = os.getenv('SYNC_SHARDING', '0') == '1'
+
+LATE_KEY_COLUMNS = [col.strip() for col in os.getenv('LATE_KEY_COLUMNS', 'topic').split(',') if col.strip()]
+
 def connect_influxdb():
     global influx_client
     try:
@@ -102,153 +135,100 @@ def connect_mssql():
         error_logger.error(error_msg)
         return None
 
+# device_master_tb, polled by change token
+device_master = DeviceMasterCache(connect_mssql)
+
+# One connection for the per-cycle statements (last time, inserts), kept across cycles so
+# the statements run through mssql_statements.get_cursor stay prepared; dropped on error
+sync_conn = None
+
+def get_sync_conn():
+    global sync_conn
+    if sync_conn is None:
+        sync_conn = connect_mssql()
+    return sync_conn
+
+def drop_sync_conn():
+    """Close the sync connection after an error; the next get_sync_conn() reconnects"""
+    global sync_conn
+    if sync_conn is not None:
+        release(sync_conn)
+        try:
+            sync_conn.close()
+        except Exception:
+            pass
+        sync_conn = None
+
 def get_tools_from_mssql():
-    try:
-        # Connect to MSSQL
-        conn = connect_mssql()
-        if not conn:
-            error_msg = "[get_tools_from_mssql] Failed to connect to MSSQL"
-            print(error_msg)
-            error_logger.error(error_msg)
-            return []
+    """Measurements (iot_{tools}) from the device_master_tb cache; the table is only re-read when it changed"""
+    device_master.refresh()
+    return list(device_master.measurements)
 
-        cursor = conn.cursor()
-        
-        # Query distinct tools from device_master_tb
-        query = "SELECT DISTINCT tools FROM device_master_tb WHERE tools IS NOT NULL"
-        cursor.execute(query)
-        
-        # Get all tools and add 'iot_' prefix
-        measurement_list = [f"iot_{row[0]}" for row in cursor.fetchall() if row[0]]
-        
-        # Close connection
-        cursor.close()
-        conn.close()
-        
-        # Return sorted unique measurements
-        return sorted(list(set(measurement_list)))
-    
+def update_schemas(schemas, measurements):
+    """Bootstrap measurements that are new or whose InfluxDB keys changed; no DDL otherwise"""
+    missing = [m for m in measurements if m not in schemas]
+    try:
+        changed = find_schema_changes(influx_client, {m: schemas[m] for m in measurements if m in schemas})
     except Exception as e:
-        error_msg = f"[get_tools_from_mssql] Error fetching measurements from MSSQL: {str(e)}"
+        error_msg = f"[update_schemas] Error checking InfluxDB keys: {str(e)}"
         print(error_msg)
         error_logger.error(error_msg)
-        return []
+        changed = []
+    if not missing and not changed:
+        return
 
-def map_influx_to_mssql_type(influx_type):
-    """Map InfluxDB data types to MSSQL data types"""
-    if isinstance(influx_type, int):
-        return "INT"
-    elif isinstance(influx_type, float):
-        return "FLOAT"
-    elif isinstance(influx_type, str):
-        return "NVARCHAR(255)"
-    elif isinstance(influx_type, bool):
-        return "BIT"
-    elif isinstance(influx_type, datetime.datetime):
-        return "DATETIME2(6)"
-    return "NVARCHAR(255)"  # Default type
-
-def create_table_mssql(measurement):
-    table_name = f"{measurement}_tb"
-    column_info = []
-    
-    mssql_conn = connect_mssql()
-    if not mssql_conn:
-        error_msg = f"[create_table_mssql] Failed to connect to MSSQL for creating table {table_name}"
+    conn = connect_mssql()
+    if not conn:
+        error_msg = f"[update_schemas] Failed to connect to MSSQL for schema bootstrap"
         error_logger.error(error_msg)
-        return None
-    
+        return
     try:
-        cursor = mssql_conn.cursor()
-        
-        cursor.execute(f"""
-            SELECT COUNT(*) 
-            FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_NAME = '{table_name}'
-        """)
-        table_exists = cursor.fetchone()[0] > 0
-        
-        cursor.execute(f"""
-            SELECT COUNT(*) 
-            FROM sys.table_types 
-            WHERE name = '{measurement}_tvp_type'
-        """)
-        tvp_exists = cursor.fetchone()[0] > 0
-        
-        if table_exists:
-            print(f"Table {table_name} already exists")
-            cursor.execute(f"""
-                SELECT COLUMN_NAME, DATA_TYPE
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_NAME = '{table_name}'
-            """)
-            columns = cursor.fetchall()
-            for column in columns:
-                column_info.append((column[0], column[1]))
-        else:
-            if not influx_client:
-                error_msg = f"[create_table_mssql] No InfluxDB connection"
-                print(error_msg)
-                error_logger.error(error_msg)
-                return None
-                
-            query = f'SELECT * FROM "{measurement}" ORDER BY time DESC LIMIT 1'
-            result = influx_client.query(query)
-            
-            if not result:
-                error_msg = f"[create_table_mssql] No data found for measurement {measurement}"
-                print(error_msg)
-                error_logger.error(error_msg)
-                return None
-                
-            points = list(result.get_points())
-            if not points:
-                error_msg = f"[create_table_mssql] No points found for measurement {measurement}"
-                print(error_msg)
-                error_logger.error(error_msg)
-                return None
-                
-            latest_point = points[0]
-            
-            columns = []
-            column_info.append(("time", "DATETIME2(6)"))
-            columns.append("time DATETIME2(6)")
-            
-            for key, value in latest_point.items():
-                if key != 'time':
-                    sql_type = map_influx_to_mssql_type(value)
-                    columns.append(f"[{key}] {sql_type}")
-                    column_info.append((key, sql_type))
-            
-            create_table_sql = f"""
-                CREATE TABLE {table_name} (
-                    {', '.join(columns)}
-                )
-            """
-            cursor.execute(create_table_sql)
-            print(f"Created table {table_name} successfully")
-        
-        if not tvp_exists:
-            tvp_columns = [f"{col[0]} {col[1]}" for col in column_info]
-            create_tvp_sql = f"""
-                CREATE TYPE {measurement}_tvp_type AS TABLE (
-                    {', '.join(tvp_columns)}
-                )
-            """
-            cursor.execute(create_tvp_sql)
-            print(f"Created TVP type {measurement}_tvp_type")
-        
-        mssql_conn.commit()
-        return column_info
-        
+        schemas.update(bootstrap(conn, influx_client, missing + changed, force=set(changed)))
     except Exception as e:
-        error_msg = f"[create_table_mssql] Error creating table/type {table_name}: {str(e)}"
+        error_msg = f"[update_schemas] Error bootstrapping schema: {str(e)}"
         print(error_msg)
         error_logger.error(error_msg)
-        return None
     finally:
-        if mssql_conn:
-            mssql_conn.close()
+        conn.close()
+
+def transform_points(column_info, points):
+    """InfluxDB points -> dicts typed like column_info, time shifted to UTC+7"""
+    transformed_data = []
+    for point in points:
+        transformed_point = {}
+        for column, dtype in column_info:
+            if column != 'time' and column in point:
+                value = point[column]
+                if dtype == "INT" and not isinstance(value, int):
+                    transformed_point[column] = int(value)
+                elif dtype == "FLOAT" and not isinstance(value, float):
+                    transformed_point[column] = float(value)
+                elif dtype == "NVARCHAR(255)" and not isinstance(value, str):
+                    transformed_point[column] = str(value)
+                elif dtype == "BIT" and not isinstance(value, bool):
+                    transformed_point[column] = bool(value)
+                elif dtype == "DATETIME2(6)" and not isinstance(value, datetime.datetime):
+                    try:
+                        transformed_point[column] = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+                    except ValueError:
+                        transformed_point[column] = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+                else:
+                    transformed_point[column] = value
+            elif column == 'time' and 'time' in point:
+                time_value = point['time']
+                if isinstance(time_value, str):
+                    try:
+                        # ลองแยกวิเคราะห์แบบมีไมโครวินาที
+                        time_value = datetime.datetime.strptime(time_value, "%Y-%m-%dT%H:%M:%S.%fZ")
+                    except ValueError:
+                        # ถ้าล้มเหลว ให้ใช้รูปแบบที่ไม่มีไมโครวินาที
+                        time_value = datetime.datetime.strptime(time_value, "%Y-%m-%dT%H:%M:%SZ")
+                time_value = time_value + datetime.timedelta(hours=7)
+                transformed_point['time'] = time_value
+
+        transformed_data.append(transformed_point)
+
+    return transformed_data
 
 def fetch_influxdb_data(column_info, measurement, time_exit):
     try:
@@ -271,42 +251,7 @@ def fetch_influxdb_data(column_info, measurement, time_exit):
 
         points = list(result.get_points(measurement=measurement))
         
-        transformed_data = []
-        for point in points:
-            transformed_point = {}
-            for column, dtype in column_info:
-                if column != 'time' and column in point:
-                    value = point[column]
-                    if dtype == "INT" and not isinstance(value, int):
-                        transformed_point[column] = int(value)
-                    elif dtype == "FLOAT" and not isinstance(value, float):
-                        transformed_point[column] = float(value)
-                    elif dtype == "NVARCHAR(255)" and not isinstance(value, str):
-                        transformed_point[column] = str(value)
-                    elif dtype == "BIT" and not isinstance(value, bool):
-                        transformed_point[column] = bool(value)
-                    elif dtype == "DATETIME2(6)" and not isinstance(value, datetime.datetime):
-                        try:
-                            transformed_point[column] = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
-                        except ValueError:
-                            transformed_point[column] = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
-                    else:
-                        transformed_point[column] = value
-                elif column == 'time' and 'time' in point:
-                    time_value = point['time']
-                    if isinstance(time_value, str):
-                        try:
-                            # ลองแยกวิเคราะห์แบบมีไมโครวินาที
-                            time_value = datetime.datetime.strptime(time_value, "%Y-%m-%dT%H:%M:%S.%fZ")
-                        except ValueError:
-                            # ถ้าล้มเหลว ให้ใช้รูปแบบที่ไม่มีไมโครวินาที
-                            time_value = datetime.datetime.strptime(time_value, "%Y-%m-%dT%H:%M:%SZ")
-                    time_value = time_value + datetime.timedelta(hours=7)
-                    transformed_point['time'] = time_value
-
-            transformed_data.append(transformed_point)
-
-        return transformed_data
+        return transform_points(column_info, points)
     except Exception as e:
         error_msg = f"[fetch_influxdb_data] Error fetching data from InfluxDB: {str(e)}"
         print(error_msg)
@@ -314,77 +259,62 @@ def fetch_influxdb_data(column_info, measurement, time_exit):
         return []
 
 def insert_mssql(data, table_name):
+    """Returns True when the rows are committed (or there was nothing to insert)"""
     if not data:
         success_msg = f"[insert_mssql] No data to insert into {table_name}"
         print(success_msg)
         success_logger.info(success_msg)  # Log success to success.log
-        return
+        return True
         
-    measurement = table_name.replace('_tb', '')
-    tvp_type = f"{measurement}_tvp_type"
+    backend = WRITER_BACKEND_MAP.get(table_name, WRITER_BACKEND)
     
     try:
-        conn = connect_mssql()
+        writer = get_writer(backend)
+        conn = get_sync_conn()
         if not conn:
             error_msg = f"[insert_mssql] MSSQL connection failed"
             print(error_msg)
             error_logger.error(error_msg)
-            return
-            
-        cursor = conn.cursor()
+            return False
         
         columns = list(data[0].keys())
-        tvp_data = [tuple(row[col] for col in columns) for row in data]
-        
-        cursor.execute(f"""
-            IF NOT EXISTS (SELECT * FROM sys.procedures WHERE name = 'usp_Insert_{measurement}')
-            BEGIN
-                EXECUTE sp_executesql N'
-                    CREATE PROCEDURE usp_Insert_{measurement}
-                        @tvp {tvp_type} READONLY
-                    AS
-                    BEGIN
-                        INSERT INTO {table_name} ({', '.join(columns)})
-                        SELECT {', '.join(columns)}
-                        FROM @tvp
-                    END
-                '
-            END
-        """)
+        rows = [tuple(row[col] for col in columns) for row in data]
         
-        sql = f"EXEC usp_Insert_{measurement} @tvp=?"
-        cursor.execute(sql, (tvp_data,))
+        writer(conn, table_name, columns, rows)
         
-        conn.commit()
-        success_msg = f"[insert_mssql] Successfully inserted {len(data)} rows into {table_name} using TVP"
+        counted_commit(conn)
+        success_msg = f"[insert_mssql] Successfully inserted {len(data)} rows into {table_name} using {backend}"
         print(success_msg)
         success_logger.info(success_msg)  # Log success to success.log
+        return True
         
     except Exception as e:
-        error_msg = f"[insert_mssql] Error inserting data into MSSQL using TVP: {str(e)}"
+        error_msg = f"[insert_mssql] Error inserting data into MSSQL using {backend}: {str(e)}"
         print(error_msg)
         error_logger.error(error_msg)
-    finally:
-        if conn:
-            conn.close()
+        drop_sync_conn()
+        return False
+
+# get_last_time() result when MSSQL could not be asked (None means the table is empty)
+LAST_TIME_UNKNOWN = object()
 
 def get_last_time(table_name):
+    """Latest stored time (UTC) of table_name, None when empty, LAST_TIME_UNKNOWN on error"""
     try:
-        conn = connect_mssql()
+        conn = get_sync_conn()
         if not conn:
             error_msg = f"[get_last_time] Error connecting to MSSQL for table {table_name}"
             print(error_msg)
             error_logger.error(error_msg)
-            return None
+            return LAST_TIME_UNKNOWN
 
-        cursor = conn.cursor()
-        
         query = f"""
             SELECT TOP 1 time 
-            FROM {table_name} 
+            FROM {quote_ident(table_name)} 
             ORDER BY time DESC
         """
-        cursor.execute(query)
+        cursor = get_cursor(conn, query)
+        counted_execute(cursor, query)
         row = cursor.fetchone()
         
         if not row:
@@ -399,13 +329,148 @@ def get_last_time(table_name):
         error_msg = f"[get_last_time] Error fetching latest time from MSSQL for table {table_name}: {str(e)}"
         print(error_msg)
         error_logger.error(error_msg)
+        drop_sync_conn()
+        return LAST_TIME_UNKNOWN
+
+def get_last_times(table_names):
+    """Latest time of several tables in one query (UNION ALL of TOP 1 per table)"""
+    last_times = {}
+    if not table_names:
+        return last_times
+    try:
+        conn = get_sync_conn()
+        if not conn:
+            error_msg = f"[get_last_times] Error connecting to MSSQL"
+            print(error_msg)
+            error_logger.error(error_msg)
+            return last_times
+
+        query = "\nUNION ALL\n".join(
+            f"SELECT ?, (SELECT TOP 1 time FROM {quote_ident(table_name)} ORDER BY time DESC)"
+            for table_name in table_names
+        )
+        cursor = get_cursor(conn, query)
+        counted_execute(cursor, query, *table_names)
+        for table_name, latest_time in cursor.fetchall():
+            last_times[table_name] = latest_time - datetime.timedelta(hours=7) if latest_time else None
+        return last_times
+
+    except Exception as e:
+        error_msg = f"[get_last_times] Error fetching latest times from MSSQL: {str(e)}"
+        print(error_msg)
+        error_logger.error(error_msg)
+        drop_sync_conn()
+        return last_times
+
+def flush_multi_tvp(pending):
+    """Write all pending (table_name, columns, rows) with as few EXEC batches as the limits allow.
+    Returns the set of table names whose rows were committed."""
+    committed = set()
+    batches = group_multi_tvp(pending, MULTI_FLUSH_MAX_ROWS, MULTI_FLUSH_MAX_TABLES)
+    if not batches:
+        return committed
+
+    conn = get_sync_conn()
+    if not conn:
+        error_msg = f"[flush_multi_tvp] MSSQL connection failed"
+        print(error_msg)
+        error_logger.error(error_msg)
+        return committed
+
+    for batch in batches:
+        table_names = ", ".join(item[0] for item in batch)
+        try:
+            rows = write_multi_tvp(conn, batch)
+            counted_commit(conn)
+            committed.update(item[0] for item in batch)
+            success_msg = f"[flush_multi_tvp] Successfully inserted {rows} rows into {table_names} in one batch"
+            print(success_msg)
+            success_logger.info(success_msg)
+        except Exception as e:
+            error_msg = f"[flush_multi_tvp] Error inserting batch {table_names}: {str(e)}"
+            print(error_msg)
+            error_logger.error(error_msg)
+            try:
+                conn.rollback()
+            except Exception:
+                drop_sync_conn()
+                break
+    return committed
+
+def new_watermark(last_time):
+    index = RecentKeyIndex(
+        datetime.timedelta(seconds=LATE_EXACT_SECONDS),
+        datetime.timedelta(seconds=LATE_WINDOW_SECONDS),
+        LATE_MAX_EXACT_KEYS,
+        bloom_expected_keys=LATE_BLOOM_EXPECTED_KEYS,
+        bloom_fp_rate=LATE_BLOOM_FP_RATE,
+    )
+    return LatenessWatermark(last_time, datetime.timedelta(seconds=LATE_WINDOW_SECONDS), index,
+                             LATE_KEY_COLUMNS, datetime.timedelta(hours=7))
+
+def fetch_new_rows(schemas, measurement, watermark):
+    """Rows after the watermark's scan position that were not committed yet"""
+    influx_data = fetch_influxdb_data(schemas[measurement], measurement, watermark.scan_from())
+    new_data = watermark.drop_seen(influx_data)
+    if len(new_data) < len(influx_data):
+        print(f"[fetch_new_rows] {measurement}: {len(influx_data) - len(new_data)} rows already committed, "
+              f"{len(new_data)} new")
+    return new_data
+
+def get_owned_measurements(measurements):
+    """Measurements leased to this instance; None when the lease table can't be reached"""
+    conn = connect_mssql()
+    if not conn:
+        error_msg = f"[get_owned_measurements] Failed to connect to MSSQL for leases"
+        error_logger.error(error_msg)
+        return None
+    try:
+        return balance_leases(conn, measurements)
+    except Exception as e:
+        error_msg = f"[get_owned_measurements] Error balancing leases: {str(e)}"
+        print(error_msg)
+        error_logger.error(error_msg)
         return None
-    
     finally:
-        if conn:
-            conn.close()
+        conn.close()
+
+def keep_lease(measurement):
+    """SYNC_SHARDING: renew the lease right before writing; False when another instance may own it now"""
+    if not SYNC_SHARDING:
+        return True
+    conn = get_sync_conn()
+    if not conn:
+        return False
+    try:
+        if renew_lease(conn, measurement):
+            return True
+        print(f"[keep_lease] Lease of {measurement} lost during the cycle, skipping it")
+        return False
+    except Exception as e:
+        error_msg = f"[keep_lease] Error renewing lease of {measurement}: {str(e)}"
+        print(error_msg)
+        error_logger.error(error_msg)
+        drop_sync_conn()
+        return False
+
+def setup_commit_mode():
+    conn = connect_mssql()
+    if not conn:
+        return
+    try:
+        conn.autocommit = True  # ALTER DATABASE is not allowed inside a transaction
+        cursor = conn.cursor()
+        if mssql_schema.configure_delayed_durability(cursor):
+            print("Delayed durability forced on the database")
+    finally:
+        conn.close()
 
 def main():
+    setup_commit_mode()
+    # column_info per measurement, filled by the schema bootstrap
+    schemas = {}
+    # LatenessWatermark per measurement; MSSQL is asked for the last time only once
+    watermarks = {}
     while True:
         try:
             start_time = time.time()
@@ -418,14 +483,68 @@ def main():
                 time.sleep(INTERVAL*30)
                 continue
                 
+            if SYNC_SHARDING:
+                owned = get_owned_measurements(MEASUREMENT_LIST)
+                if owned is None:
+                    # Without a confirmed lease another instance may own the measurement
+                    time.sleep(INTERVAL*30)
+                    continue
+                # A measurement coming back from another instance must re-read its last time
+                for measurement in [m for m in watermarks if m not in owned]:
+                    del watermarks[measurement]
+                print(f"[main] Instance {SYNC_INSTANCE_ID} owns {len(owned)}/{len(MEASUREMENT_LIST)} measurements")
+                MEASUREMENT_LIST = owned
+
             print(f"Processing measurements: {MEASUREMENT_LIST}")
-            for measurement in MEASUREMENT_LIST:
-                column_info = create_table_mssql(measurement)
-                if column_info is not None:
-                    last_time = get_last_time(f"{measurement}_tb")
-                    influx_data = fetch_influxdb_data(column_info, measurement, last_time)
+            update_schemas(schemas, MEASUREMENT_LIST)
+            ready = [m for m in MEASUREMENT_LIST if m in schemas]
+            round_trips_before = mssql_writers.round_trips
+            if FLUSH_MODE == 'multi':
+                unknown = [m for m in ready if m not in watermarks]
+                if unknown:
+                    last_times = get_last_times([f"{measurement}_tb" for measurement in unknown])
+                    for measurement in unknown:
+                        if f"{measurement}_tb" in last_times:
+                            watermarks[measurement] = new_watermark(last_times[f"{measurement}_tb"])
+                pending = []
+                fetched = {}
+                for measurement in ready:
+                    if measurement not in watermarks:
+                        continue
+                    table_name = f"{measurement}_tb"
+                    influx_data = fetch_new_rows(schemas, measurement, watermarks[measurement])
+                    if influx_data:
+                        columns = list(influx_data[0].keys())
+                        pending.append((table_name, columns, [tuple(row[col] for col in columns) for row in influx_data]))
+                        fetched[table_name] = (measurement, influx_data)
+                # Leases are renewed right before the flush; the new owner writes the lost ones
+                lost = {table_name for table_name, _, _ in pending if not keep_lease(fetched[table_name][0])}
+                for table_name in lost:
+                    del watermarks[fetched[table_name][0]]
+                pending = [item for item in pending if item[0] not in lost]
+                for table_name in flush_multi_tvp(pending):
+                    measurement, influx_data = fetched[table_name]
+                    watermarks[measurement].record_committed(influx_data)
+            else:
+                for measurement in ready:
+                    if measurement not in watermarks:
+                        last_time = get_last_time(f"{measurement}_tb")
+                        if last_time is LAST_TIME_UNKNOWN:
+                            # Try again next cycle; None would mean "empty table" and re-insert stored rows
+                            continue
+                        watermarks[measurement] = new_watermark(last_time)
+                    influx_data = fetch_new_rows(schemas, measurement, watermarks[measurement])
                     print("ok")
-                    insert_mssql(influx_data, f"{measurement}_tb")
+                    if influx_data and not keep_lease(measurement):
+                        # The new owner writes it; re-read the last time if it comes back
+                        del watermarks[measurement]
+                        continue
+                    if insert_mssql(influx_data, f"{measurement}_tb"):
+                        watermarks[measurement].record_committed(influx_data)
+            success_msg = (f"[main] Cycle: {len(MEASUREMENT_LIST)} measurements, "
+                           f"{mssql_writers.round_trips - round_trips_before} round trips for last time + insert ({FLUSH_MODE})")
+            print(success_msg)
+            success_logger.info(success_msg)
             elapsed_time = time.time() - start_time
             remaining_time = max(0, INTERVAL*60 - elapsed_time)
             time.sleep(remaining_time)
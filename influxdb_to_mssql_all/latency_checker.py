@@ -0,0 +1,199 @@
+import os
+import csv
+import time
+import argparse
+import datetime
+
+import final6_tvp_log as sync
+from mssql_statements import quote_ident
+from writer_pool import latency_summary
+
+# End-to-end latency of the pipeline, measured with probe messages.
+#
+# The generators (LATENCY_PROBE_INTERVAL > 0 in mqtt_python_0x/app.py) publish
+# {"probe_seq": n, "probe_sent_us": <epoch µs>} to iot_sensors/iot_{tools}/latency_probe.
+# They travel like any other device message: Telegraf -> InfluxDB -> final6 sync
+# -> iot_{tools}_tb (probe_seq / probe_sent_us become columns on the first probe).
+#
+# Every LATENCY_POLL_SECONDS the checker looks for new probes in InfluxDB, and for
+# the probes already seen there, in MSSQL. Per probe:
+#   telegraf   Telegraf timestamp of the point - sent       (no polling error)
+#   influx     first poll that saw it in InfluxDB - sent
+#   sync       first poll that saw it in MSSQL - first seen in InfluxDB
+#   total      first poll that saw it in MSSQL - sent
+# influx / sync / total include up to one poll interval of detection delay.
+# The generator and checker clocks must be in sync (same host or NTP).
+#
+# Every LATENCY_REPORT_SECONDS: p50/p99/max per hop for the probes completed in
+# that period, probes still pending, seq gaps (never reached InfluxDB) and
+# probes not in MSSQL after LATENCY_TIMEOUT_SECONDS.
+#
+#   python latency_checker.py                     all tools from device_master_tb
+#   python latency_checker.py iot_got1 --csv latency.csv
+
+LATENCY_POLL_SECONDS = float(os.getenv('LATENCY_POLL_SECONDS', 0.5))
+LATENCY_REPORT_SECONDS = float(os.getenv('LATENCY_REPORT_SECONDS', 60))
+LATENCY_TIMEOUT_SECONDS = float(os.getenv('LATENCY_TIMEOUT_SECONDS', 600))
+# How far back each InfluxDB poll looks; a probe must be visible within this long after Telegraf stamped it
+LATENCY_LOOKBACK_SECONDS = int(os.getenv('LATENCY_LOOKBACK_SECONDS', 60))
+PROBE_DEVICE = 'latency_probe'
+
+# Stored times are UTC+7 (see transform_points)
+TIME_OFFSET = datetime.timedelta(hours=7)
+EPOCH = datetime.datetime(1970, 1, 1)
+
+HOPS = ('telegraf', 'influx', 'sync', 'total')
+
+
+def now_us():
+    return time.time_ns() // 1000
+
+
+class ProbeTracker:
+    def __init__(self):
+        self.pending = {}     # sent_us -> (seq, telegraf point µs, first seen in InfluxDB µs)
+        self.done = set()     # sent_us of completed / expired probes still inside the lookback
+        self.last_seq = None
+        self.reset_period()
+        self.gaps = 0
+        self.lost = 0
+
+    def reset_period(self):
+        self.latencies = {hop: [] for hop in HOPS}
+
+    def influx_seen(self, seq, sent_us, point_us, seen_us):
+        if sent_us in self.pending or sent_us in self.done:
+            return
+        if self.last_seq is None or seq == 1 or seq > self.last_seq:
+            # seq 1: the generator restarted
+            if self.last_seq is not None and seq > self.last_seq + 1:
+                self.gaps += seq - self.last_seq - 1
+            self.last_seq = seq
+        else:
+            self.gaps = max(0, self.gaps - 1)  # out of order, fills a gap counted earlier
+        self.pending[sent_us] = (seq, point_us, seen_us)
+        self.latencies['telegraf'].append((point_us - sent_us) / 1e6)
+        self.latencies['influx'].append((seen_us - sent_us) / 1e6)
+
+    def mssql_seen(self, sent_us, seen_us):
+        probe = self.pending.pop(sent_us, None)
+        if probe is None:
+            return
+        self.done.add(sent_us)
+        self.latencies['sync'].append((seen_us - probe[2]) / 1e6)
+        self.latencies['total'].append((seen_us - sent_us) / 1e6)
+
+    def expire(self, current_us):
+        for sent_us, probe in list(self.pending.items()):
+            if current_us - probe[2] > LATENCY_TIMEOUT_SECONDS * 1e6:
+                del self.pending[sent_us]
+                self.done.add(sent_us)
+                self.lost += 1
+        horizon = current_us - (LATENCY_LOOKBACK_SECONDS + LATENCY_TIMEOUT_SECONDS) * 1e6
+        self.done = {sent_us for sent_us in self.done if sent_us > horizon}
+
+    def oldest_pending_point_us(self):
+        return min((probe[1] for probe in self.pending.values()), default=None)
+
+
+def poll_influx(tracker, measurement, topic):
+    query = (f'SELECT "probe_seq", "probe_sent_us" FROM "{measurement}" '
+             f'WHERE "topic" = \'{topic}\' AND time > now() - {LATENCY_LOOKBACK_SECONDS}s')
+    points = sync.influx_client.query(query, epoch='u').get_points(measurement=measurement)
+    seen_us = now_us()
+    for point in points:
+        if point.get('probe_sent_us') is None or point.get('probe_seq') is None:
+            continue
+        tracker.influx_seen(int(point['probe_seq']), int(point['probe_sent_us']), int(point['time']), seen_us)
+
+
+def poll_mssql(cursor, tracker, table_name, topic):
+    oldest_us = tracker.oldest_pending_point_us()
+    if oldest_us is None:
+        return
+    since = EPOCH + datetime.timedelta(microseconds=oldest_us - 1000000) + TIME_OFFSET
+    cursor.execute(f"SELECT probe_sent_us FROM {quote_ident(table_name)} WHERE topic = ? AND time >= ?",
+                   topic, since)
+    rows = cursor.fetchall()
+    seen_us = now_us()
+    for (sent_us,) in rows:
+        if sent_us is not None:
+            tracker.mssql_seen(int(sent_us), seen_us)
+
+
+def report_line(measurement, tracker):
+    parts = []
+    for hop in HOPS:
+        summary = latency_summary(tracker.latencies[hop])
+        parts.append(f"{hop} p50 {summary['p50_ms']:.0f} p99 {summary['p99_ms']:.0f} max {summary['max_ms']:.0f}ms")
+    return (f"[latency_checker] {measurement}: {len(tracker.latencies['total'])} probes | " + " | ".join(parts) +
+            f" | pending {len(tracker.pending)} gaps {tracker.gaps} lost {tracker.lost}")
+
+
+def write_csv(path, measurement, tracker):
+    new_file = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(['time', 'measurement', 'probes'] +
+                            [f"{hop}_{stat}" for hop in HOPS for stat in ('p50_ms', 'p99_ms', 'max_ms')] +
+                            ['pending', 'gaps', 'lost'])
+        row = [datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), measurement, len(tracker.latencies['total'])]
+        for hop in HOPS:
+            summary = latency_summary(tracker.latencies[hop])
+            row += [f"{summary['p50_ms']:.1f}", f"{summary['p99_ms']:.1f}", f"{summary['max_ms']:.1f}"]
+        writer.writerow(row + [len(tracker.pending), tracker.gaps, tracker.lost])
+
+
+def run(measurements, csv_path=None):
+    if not sync.connect_influxdb():
+        return
+    measurements = measurements or sync.get_tools_from_mssql()
+    conn = sync.connect_mssql()
+    if not conn:
+        return
+    trackers = {measurement: ProbeTracker() for measurement in measurements}
+    print(f"[latency_checker] watching {', '.join(measurements)}, poll {LATENCY_POLL_SECONDS}s, "
+          f"report every {LATENCY_REPORT_SECONDS:.0f}s")
+    next_report = time.time() + LATENCY_REPORT_SECONDS
+    try:
+        while True:
+            cursor = conn.cursor()
+            for measurement, tracker in trackers.items():
+                topic = f"iot_sensors/{measurement}/{PROBE_DEVICE}"
+                try:
+                    poll_influx(tracker, measurement, topic)
+                    poll_mssql(cursor, tracker, f"{measurement}_tb", topic)
+                except Exception as e:
+                    # The probe columns only exist once the sync has seen the first probe
+                    error_msg = f"[latency_checker] Error polling {measurement}: {str(e)}"
+                    sync.error_logger.error(error_msg)
+                tracker.expire(now_us())
+            cursor.close()
+
+            if time.time() >= next_report:
+                for measurement, tracker in trackers.items():
+                    line = report_line(measurement, tracker)
+                    print(line)
+                    sync.success_logger.info(line)
+                    if csv_path:
+                        write_csv(csv_path, measurement, tracker)
+                    tracker.reset_period()
+                next_report += LATENCY_REPORT_SECONDS
+            time.sleep(LATENCY_POLL_SECONDS)
+    except KeyboardInterrupt:
+        print("Stopping latency checker...")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency from probe messages")
+    parser.add_argument('measurements', nargs='*', help="iot_{tools} measurements (default: all tools)")
+    parser.add_argument('--csv', help="append one row per measurement and report period")
+    args = parser.parse_args()
+    run(args.measurements, args.csv)
+
+
+if __name__ == "__main__":
+    main()
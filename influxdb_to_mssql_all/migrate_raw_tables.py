@@ -0,0 +1,140 @@
+import os
+import re
+import argparse
+
+import pymssql
+from dotenv import load_dotenv
+
+from mssql_statements import sp_executesql, quote_ident
+from consolidated_storage import consolidated_table_name, ensure_day_partitions, create_consolidated_table
+
+# Move the per-topic raw_{tools}_{machine} tables written by app2.py
+# (STORAGE_MODE=per_topic) into the consolidated raw_{measurement}_all table.
+#
+#   python migrate_raw_tables.py test_data            copy, keep the old tables
+#   python migrate_raw_tables.py test_data --drop     copy, then drop every fully copied table
+#
+# Rows already present in the consolidated table are skipped, so the command
+# can be re-run at any time (e.g. while app2.py is still in per_topic mode).
+
+load_dotenv()
+
+MSSQL_CONFIG = {
+    'server': os.getenv('MSSQL_SERVER'),
+    'user': os.getenv('MSSQL_USER'),
+    'password': os.getenv('MSSQL_PASSWORD'),
+    'database': os.getenv('MSSQL_DATABASE'),
+    'port': int(os.getenv('MSSQL_PORT', 1433)),
+}
+
+
+def get_column_types(cursor, table_name):
+    sp_executesql(cursor, """
+        SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH
+        FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_NAME = ?
+        ORDER BY ORDINAL_POSITION
+    """, (table_name,))
+    column_types = {}
+    for name, data_type, max_length in cursor.fetchall():
+        if max_length is not None:
+            data_type = f"{data_type}({'MAX' if max_length == -1 else max_length})"
+        column_types[name] = data_type.upper()
+    return column_types
+
+
+def sanitize_table_name(topic):
+    """Per-topic table name, as app2.py names it"""
+    if topic.startswith("iot_sensors/"):
+        topic = topic[len("iot_sensors/"):]
+    return f"raw_{re.sub(r'[^a-zA-Z0-9_]', '_', topic)}"
+
+
+def find_topic_tables(cursor, measurement):
+    """
+    Per-topic tables of the measurement's topics. The raw_{measurement}_ prefix alone
+    also matches other measurements (raw_machine_temp_* for machine), so a table is
+    kept only when its topic is iot_sensors/{measurement}/... and names this table.
+    """
+    target = consolidated_table_name(measurement)
+    sp_executesql(cursor, "SELECT name FROM sys.tables WHERE name LIKE ? ORDER BY name",
+                  (f"raw_{measurement}_".replace('_', '[_]') + '%',))
+    candidates = [row[0] for row in cursor.fetchall() if row[0] != target]
+    tables = []
+    for name in candidates:
+        cursor.execute(f"SELECT TOP 1 topic FROM {quote_ident(name)} WHERE topic IS NOT NULL")
+        row = cursor.fetchone()
+        topic = row[0] if row else None
+        if topic and topic.startswith(f"iot_sensors/{measurement}/") and sanitize_table_name(topic) == name:
+            tables.append(name)
+        else:
+            print(f"⚠️ Skipping {name}: not a topic table of '{measurement}' (topic {topic!r})")
+    return tables
+
+
+def migrate_measurement(conn, measurement, drop):
+    cursor = conn.cursor()
+    target = consolidated_table_name(measurement)
+    sources = find_topic_tables(cursor, measurement)
+    if not sources:
+        print(f"⚠️ No per-topic tables found for '{measurement}'")
+        return
+
+    ensure_day_partitions(cursor)
+    target_columns = get_column_types(cursor, target)
+    if not target_columns:
+        # Take the data columns from the first per-topic table
+        source_columns = get_column_types(cursor, sources[0])
+        create_consolidated_table(cursor, target, [
+            f"{quote_ident(name)} {sql_type}" for name, sql_type in source_columns.items() if name not in ('time', 'topic')
+        ])
+        conn.commit()
+        target_columns = get_column_types(cursor, target)
+        print(f"✅ Created {target}")
+
+    for source in sources:
+        columns = ['time', 'topic'] + [
+            name for name in get_column_types(cursor, source) if name in target_columns and name not in ('time', 'topic')
+        ]
+        column_sql = ', '.join(quote_ident(col) for col in columns)
+        cursor.execute(f"""
+            INSERT INTO {quote_ident(target)} ({column_sql})
+            SELECT {column_sql}
+            FROM {quote_ident(source)} s
+            WHERE s.topic IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM {quote_ident(target)} t WHERE t.topic = s.topic AND t.time = s.time)
+        """)
+        copied = cursor.rowcount
+        conn.commit()
+
+        cursor.execute(f"""
+            SELECT COUNT(*) FROM {quote_ident(source)} s
+            WHERE NOT EXISTS (SELECT 1 FROM {quote_ident(target)} t WHERE t.topic = s.topic AND t.time = s.time)
+        """)
+        missing = cursor.fetchone()[0]
+        print(f"✅ {source} -> {target}: {copied} rows copied, {missing} rows not in target")
+
+        if drop and missing == 0:
+            cursor.execute(f"DROP TABLE {quote_ident(source)}")
+            conn.commit()
+            print(f"🗑️ Dropped {source}")
+
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move raw_* per-topic tables into raw_{measurement}_all")
+    parser.add_argument('measurements', nargs='+')
+    parser.add_argument('--drop', action='store_true', help="drop each per-topic table once all its rows are in the target")
+    args = parser.parse_args()
+
+    conn = pymssql.connect(**MSSQL_CONFIG)
+    try:
+        for measurement in args.measurements:
+            migrate_measurement(conn, measurement, args.drop)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
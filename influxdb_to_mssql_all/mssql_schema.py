@@ -0,0 +1,113 @@
+import os
+import logging
+
+# DDL generation for the per-measurement TVP types and insert procedures.
+#
+# TVP_MEMORY_OPTIMIZED=1 creates the {measurement}_tvp_type types as
+# MEMORY_OPTIMIZED table types, so table variables passed to usp_Insert_* live
+# in memory instead of tempdb. It needs In-Memory OLTP on the server and a
+# MEMORY_OPTIMIZED_DATA filegroup in the database; without them the normal
+# disk-based types are created.
+#
+# DELAYED_DURABILITY=1 sets DELAYED_DURABILITY = FORCED on the sync's database
+# (MSSQL_DATABASE only), so every commit there, including the plain
+# conn.commit() of the writers, flushes the log asynchronously. A server crash
+# can lose the last few ms of commits; the next cycle re-reads them from
+# InfluxDB. The setting stays on the database until it is set back with
+# ALTER DATABASE ... SET DELAYED_DURABILITY = DISABLED.
+
+error_logger = logging.getLogger('error_logger')
+success_logger = logging.getLogger('success_logger')
+
+TVP_MEMORY_OPTIMIZED = os.getenv('TVP_MEMORY_OPTIMIZED', '0') == '1'
+DELAYED_DURABILITY = os.getenv('DELAYED_DURABILITY', '0') == '1'
+
+# Detection results, checked once per process
+in_memory_oltp_supported = None
+delayed_durability_active = False
+
+
+def detect_in_memory_oltp(cursor):
+    """True when memory-optimized table types can be created in the current database"""
+    global in_memory_oltp_supported
+    if in_memory_oltp_supported is None:
+        try:
+            cursor.execute("""
+                SELECT CAST(SERVERPROPERTY('IsXTPSupported') AS INT),
+                       (SELECT COUNT(*) FROM sys.filegroups WHERE type = 'FX')
+            """)
+            xtp_supported, fx_filegroups = cursor.fetchone()
+            in_memory_oltp_supported = bool(xtp_supported) and fx_filegroups > 0
+        except Exception as e:
+            error_logger.error(f"[detect_in_memory_oltp] Detection failed, using disk-based types: {str(e)}")
+            in_memory_oltp_supported = False
+        if not in_memory_oltp_supported:
+            success_logger.info("[detect_in_memory_oltp] In-Memory OLTP not available, using disk-based TVP types")
+    return in_memory_oltp_supported
+
+
+def use_memory_optimized_types(cursor):
+    return TVP_MEMORY_OPTIMIZED and detect_in_memory_oltp(cursor)
+
+
+def configure_delayed_durability(cursor):
+    """
+    Force delayed durability on the current database if requested (cursor on an
+    autocommit connection: ALTER DATABASE is not allowed inside a transaction).
+    Returns True when commits are delayed.
+    """
+    global delayed_durability_active
+    try:
+        cursor.execute("SELECT delayed_durability_desc FROM sys.databases WHERE database_id = DB_ID()")
+        setting = cursor.fetchone()[0]
+        if not DELAYED_DURABILITY:
+            if setting == 'FORCED':
+                success_logger.info("[configure_delayed_durability] DELAYED_DURABILITY is FORCED on the database, run "
+                                    "ALTER DATABASE ... SET DELAYED_DURABILITY = DISABLED to restore full durability")
+            delayed_durability_active = setting == 'FORCED'
+            return delayed_durability_active
+        if setting != 'FORCED':
+            cursor.execute("ALTER DATABASE CURRENT SET DELAYED_DURABILITY = FORCED")
+        delayed_durability_active = True
+    except Exception as e:
+        error_logger.error(f"[configure_delayed_durability] Falling back to normal commits: {str(e)}")
+        delayed_durability_active = False
+    return delayed_durability_active
+
+
+def build_tvp_type_sql(measurement, column_types, memory_optimized):
+    """column_types: [(column, full SQL type)]"""
+    columns = [f"[{name}] {sql_type}" for name, sql_type in column_types]
+    if memory_optimized:
+        # Memory-optimized table types need at least one index
+        columns.append(f"INDEX ix_{measurement}_tvp_time NONCLUSTERED ([time])")
+        return f"""
+            CREATE TYPE {measurement}_tvp_type AS TABLE (
+                {', '.join(columns)}
+            ) WITH (MEMORY_OPTIMIZED = ON)
+        """
+    return f"""
+        CREATE TYPE {measurement}_tvp_type AS TABLE (
+            {', '.join(columns)}
+        )
+    """
+
+
+def build_insert_procedure_sql(measurement, table_name, columns):
+    """
+    Body for CREATE PROCEDURE usp_Insert_{measurement}. Kept to a single
+    set-based INSERT with explicit columns and no dynamic SQL, so the same body
+    can be natively compiled if the target table is ever memory-optimized.
+    """
+    column_sql = ', '.join(f"[{col}]" for col in columns)
+    return f"""
+        CREATE PROCEDURE dbo.usp_Insert_{measurement}
+            @tvp dbo.{measurement}_tvp_type READONLY
+        AS
+        BEGIN
+            SET NOCOUNT ON;
+            INSERT INTO dbo.{table_name} ({column_sql})
+            SELECT {column_sql}
+            FROM @tvp
+        END
+    """
@@ -0,0 +1,124 @@
+import re
+import datetime
+from collections import OrderedDict
+
+# Parameterized statements for MSSQL.
+#
+# Values always travel as parameters so the statement text stays the same from
+# one call to the next and SQL Server reuses one cached plan instead of
+# compiling a new ad-hoc plan per literal. Identifiers (table/column names)
+# cannot be parameters: they are validated and bracket-quoted instead.
+#
+# pyodbc:  execute(conn, "SELECT ... WHERE TABLE_NAME = ?", (table_name,))
+#          Cursors are kept per connection and per statement text, and pyodbc
+#          re-uses the prepared handle when a cursor runs the same text again.
+#          Only worth it on a long-lived connection (final6's sync connection);
+#          call release(conn) before closing it.
+# pymssql: sp_executesql(cursor, "SELECT ... WHERE TABLE_NAME = ?", (table_name,))
+#          pymssql substitutes %s client side, which would still produce one
+#          ad-hoc plan per value, so the statement is wrapped in sp_executesql.
+
+IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]{0,127}$')
+
+# Prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 64
+
+# connection -> OrderedDict(sql -> cursor); keyed on the connection object, which
+# the cache keeps alive until release(), so a new connection never gets old cursors
+statement_cache = {}
+
+
+def quote_ident(name):
+    """Validate a table/column name and return it bracket-quoted"""
+    if not isinstance(name, str) or not IDENTIFIER_PATTERN.match(name):
+        raise ValueError(f"Invalid SQL identifier: {name!r}")
+    return f"[{name}]"
+
+
+def get_cursor(conn, sql):
+    cursors = statement_cache.setdefault(conn, OrderedDict())
+    cursor = cursors.get(sql)
+    if cursor is not None:
+        cursors.move_to_end(sql)
+        return cursor
+    cursor = conn.cursor()
+    cursors[sql] = cursor
+    if len(cursors) > STATEMENT_CACHE_SIZE:
+        _, oldest = cursors.popitem(last=False)
+        oldest.close()
+    return cursor
+
+
+def execute(conn, sql, params=()):
+    """Run a ?-parameterized statement on a cached cursor (pyodbc) and return the cursor"""
+    cursor = get_cursor(conn, sql)
+    cursor.execute(sql, params) if params else cursor.execute(sql)
+    return cursor
+
+
+def release(conn):
+    """Close the cached cursors of a connection, call before conn.close()"""
+    for cursor in statement_cache.pop(conn, {}).values():
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+def sql_param_type(value):
+    if isinstance(value, bool):
+        return "BIT"
+    if isinstance(value, int):
+        return "BIGINT"
+    if isinstance(value, float):
+        return "FLOAT"
+    if isinstance(value, datetime.datetime):
+        return "DATETIME2(7)"
+    return "NVARCHAR(4000)"
+
+
+# INFORMATION_SCHEMA.COLUMNS.DATA_TYPE -> sp_executesql parameter type
+COLUMN_PARAM_TYPES = {
+    'bit': "BIT",
+    'tinyint': "BIGINT",
+    'smallint': "BIGINT",
+    'int': "BIGINT",
+    'bigint': "BIGINT",
+    'float': "FLOAT",
+    'real': "FLOAT",
+    'decimal': "FLOAT",
+    'numeric': "FLOAT",
+    'datetime': "DATETIME2(7)",
+    'datetime2': "DATETIME2(7)",
+    'smalldatetime': "DATETIME2(7)",
+}
+
+
+def column_param_type(data_type):
+    return COLUMN_PARAM_TYPES.get((data_type or '').lower(), "NVARCHAR(4000)")
+
+
+def build_sp_executesql(sql, params, param_types=None):
+    """
+    Turn a ?-parameterized statement into an EXEC sp_executesql with pymssql %s placeholders.
+    param_types: declared type per parameter; by default taken from the values of params,
+    pass them when the same statement is reused for other rows (executemany).
+    """
+    parts = sql.split('?')
+    if len(parts) - 1 != len(params):
+        raise ValueError(f"Statement has {len(parts) - 1} placeholders but {len(params)} parameters")
+    inner = parts[0] + ''.join(f"@p{i}{part}" for i, part in enumerate(parts[1:]))
+    inner = inner.replace("'", "''")
+    if not params:
+        return f"EXEC sp_executesql N'{inner}'"
+    inner = inner.replace('%', '%%')
+    param_types = param_types or [sql_param_type(value) for value in params]
+    declarations = ', '.join(f"@p{i} {param_type}" for i, param_type in enumerate(param_types))
+    assignments = ', '.join(f"@p{i}=%s" for i in range(len(params)))
+    return f"EXEC sp_executesql N'{inner}', N'{declarations}', {assignments}"
+
+
+def sp_executesql(cursor, sql, params=()):
+    """Run a ?-parameterized statement through sp_executesql (pymssql)"""
+    cursor.execute(build_sp_executesql(sql, params), tuple(params) if params else None)
+    return cursor
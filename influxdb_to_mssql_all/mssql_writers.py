@@ -0,0 +1,230 @@
+import os
+import uuid
+import datetime
+import logging
+
+from mssql_statements import quote_ident
+
+# Writer backends for MSSQL (pyodbc connections).
+#
+# Every backend has the same signature:
+#     write(conn, table_name, columns, rows) -> number of rows sent
+# `rows` is a list of tuples ordered like `columns`. Backends do not commit,
+# the caller decides the transaction boundary.
+
+error_logger = logging.getLogger('error_logger')
+
+# SQL Server limits: 1000 rows per VALUES constructor, 2100 parameters per request
+MAX_VALUES_ROWS = 1000
+MAX_PARAMS = 2099
+
+# BULK INSERT needs a file the *server* can read. BULK_STAGE_DIR is where this
+# process writes the file, BULK_STAGE_SERVER_DIR is the same directory as seen
+# by SQL Server (e.g. a UNC share). They are the same path when both run on one host.
+BULK_STAGE_DIR = os.getenv('BULK_STAGE_DIR', '/tmp/mssql_stage')
+BULK_STAGE_SERVER_DIR = os.getenv('BULK_STAGE_SERVER_DIR', BULK_STAGE_DIR)
+
+# Requests sent to the server by the write path (execute/commit), for round-trip reporting
+round_trips = 0
+
+
+def count_round_trip():
+    global round_trips
+    round_trips += 1
+
+
+def counted_execute(cursor, sql, *params):
+    count_round_trip()
+    return cursor.execute(sql, *params)
+
+
+def counted_commit(conn):
+    count_round_trip()
+    conn.commit()
+
+
+def measurement_from_table(table_name):
+    return table_name[:-3] if table_name.endswith('_tb') else table_name
+
+
+def write_tvp(conn, table_name, columns, rows):
+    """EXEC usp_Insert_{measurement} with the whole batch as one table-valued parameter.
+    The type and procedure are created by schema_bootstrap.py."""
+    if not rows:
+        return 0
+    cursor = conn.cursor()
+    counted_execute(cursor, f"EXEC {quote_ident('usp_Insert_' + measurement_from_table(table_name))} @tvp=?", (rows,))
+    cursor.close()
+    return len(rows)
+
+
+def write_fast_executemany(conn, table_name, columns, rows):
+    """Parameterized INSERT sent as one parameter array (pyodbc fast_executemany)"""
+    if not rows:
+        return 0
+    cursor = conn.cursor()
+    cursor.fast_executemany = True
+    column_sql = ', '.join(quote_ident(col) for col in columns)
+    placeholders = ', '.join(['?'] * len(columns))
+    count_round_trip()
+    cursor.executemany(f"INSERT INTO {quote_ident(table_name)} ({column_sql}) VALUES ({placeholders})", rows)
+    cursor.close()
+    return len(rows)
+
+
+def write_multi_values(conn, table_name, columns, rows):
+    """INSERT ... VALUES (...), (...), ... with as many rows per statement as the limits allow"""
+    if not rows:
+        return 0
+    cursor = conn.cursor()
+    column_sql = ', '.join(quote_ident(col) for col in columns)
+    row_sql = f"({', '.join(['?'] * len(columns))})"
+    chunk_size = max(1, min(MAX_VALUES_ROWS, MAX_PARAMS // len(columns)))
+
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        sql = f"INSERT INTO {quote_ident(table_name)} ({column_sql}) VALUES {', '.join([row_sql] * len(chunk))}"
+        params = [value for row in chunk for value in row]
+        counted_execute(cursor, sql, params)
+    cursor.close()
+    return len(rows)
+
+
+def format_bulk_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+    # Field/row terminators cannot appear inside a value
+    return str(value).replace('\t', ' ').replace('\n', ' ').replace('\r', ' ')
+
+
+def get_table_column_order(cursor, table_name):
+    counted_execute(cursor, 
+        "SELECT name FROM sys.columns WHERE object_id = OBJECT_ID(?) ORDER BY column_id",
+        (table_name,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def get_table_column_types(cursor, table_name):
+    """Return [(column, full SQL type)] in column order, e.g. ('topic', 'NVARCHAR(255)')"""
+    cursor.execute("""
+        SELECT c.name, t.name, c.max_length, c.precision, c.scale
+        FROM sys.columns c
+        JOIN sys.types t ON c.user_type_id = t.user_type_id
+        WHERE c.object_id = OBJECT_ID(?)
+        ORDER BY c.column_id
+    """, (table_name,))
+    column_types = []
+    for name, type_name, max_length, precision, scale in cursor.fetchall():
+        type_name = type_name.upper()
+        if type_name in ('NVARCHAR', 'NCHAR'):
+            type_name += '(MAX)' if max_length == -1 else f"({max_length // 2})"
+        elif type_name in ('VARCHAR', 'CHAR', 'VARBINARY', 'BINARY'):
+            type_name += '(MAX)' if max_length == -1 else f"({max_length})"
+        elif type_name in ('DATETIME2', 'TIME', 'DATETIMEOFFSET'):
+            type_name += f"({scale})"
+        elif type_name in ('DECIMAL', 'NUMERIC'):
+            type_name += f"({precision}, {scale})"
+        column_types.append((name, type_name))
+    return column_types
+
+
+def write_bulk_insert(conn, table_name, columns, rows):
+    """Stage the batch as a tab separated file and load it with BULK INSERT"""
+    if not rows:
+        return 0
+    cursor = conn.cursor()
+
+    # BULK INSERT maps fields by ordinal, so write them in the table's column order.
+    # ROWTERMINATOR '\n' is read by BULK INSERT as CRLF.
+    table_columns = get_table_column_order(cursor, table_name)
+    positions = {col: i for i, col in enumerate(columns)}
+
+    os.makedirs(BULK_STAGE_DIR, exist_ok=True)
+    file_name = f"{table_name}_{uuid.uuid4().hex}.tsv"
+    local_path = os.path.join(BULK_STAGE_DIR, file_name)
+    server_path = BULK_STAGE_SERVER_DIR.rstrip('/\\') + ('\\' if '\\' in BULK_STAGE_SERVER_DIR else '/') + file_name
+
+    try:
+        with open(local_path, 'w', encoding='utf-16-le', newline='') as f:
+            for row in rows:
+                fields = [format_bulk_value(row[positions[col]]) if col in positions else '' for col in table_columns]
+                f.write('\t'.join(fields) + '\r\n')
+
+        counted_execute(cursor, f"""
+            BULK INSERT {quote_ident(table_name)}
+            FROM '{server_path}'
+            WITH (DATAFILETYPE = 'widechar', FIELDTERMINATOR = '\\t', ROWTERMINATOR = '\\n',
+                  KEEPNULLS, TABLOCK)
+        """)
+    finally:
+        cursor.close()
+        try:
+            os.remove(local_path)
+        except OSError as e:
+            error_logger.error(f"[write_bulk_insert] Could not remove staged file {local_path}: {str(e)}")
+    return len(rows)
+
+
+def write_multi_tvp(conn, batch):
+    """
+    Write several measurements in one request:
+        SET NOCOUNT ON; EXEC usp_Insert_a @tvp=?; EXEC usp_Insert_b @tvp=?; ...
+    batch is a list of (table_name, columns, rows). Each rows list is sent as its own TVP parameter.
+    """
+    batch = [item for item in batch if item[2]]
+    if not batch:
+        return 0
+    cursor = conn.cursor()
+    statements = [f"EXEC {quote_ident('usp_Insert_' + measurement_from_table(table_name))} @tvp=?;"
+                  for table_name, _, _ in batch]
+    sql = "SET NOCOUNT ON;\n" + "\n".join(statements)
+    counted_execute(cursor, sql, tuple(rows for _, _, rows in batch))
+    cursor.close()
+    return sum(len(rows) for _, _, rows in batch)
+
+
+def group_multi_tvp(items, max_rows, max_tables):
+    """Pack (table_name, columns, rows) items into batches of at most max_rows rows / max_tables tables"""
+    batches = []
+    current = []
+    current_rows = 0
+    for item in items:
+        rows = len(item[2])
+        if current and (current_rows + rows > max_rows or len(current) >= max_tables):
+            batches.append(current)
+            current = []
+            current_rows = 0
+        current.append(item)
+        current_rows += rows
+    if current:
+        batches.append(current)
+    return batches
+
+
+WRITERS = {
+    'tvp': write_tvp,
+    'fast_executemany': write_fast_executemany,
+    'values': write_multi_values,
+    'bulk': write_bulk_insert,
+}
+
+
+def parse_backend_map(value):
+    """Parse 'table=backend,table=backend' into a dict"""
+    backend_map = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            table_name, backend = item.split('=', 1)
+            backend_map[table_name.strip()] = backend.strip()
+    return backend_map
+
+
+def get_writer(backend):
+    if backend not in WRITERS:
+        raise ValueError(f"Unknown writer backend '{backend}', expected one of {', '.join(WRITERS)}")
+    return WRITERS[backend]
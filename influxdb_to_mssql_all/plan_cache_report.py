@@ -0,0 +1,55 @@
+import argparse
+
+from final6_tvp_log import connect_mssql
+
+# Plan-cache entries created per hour in the sync database, by object type.
+#
+#   python plan_cache_report.py --hours 24
+#
+# Run it across the switch to parameterized statements: "Adhoc" entries per
+# hour should drop to near zero and "Prepared" stay flat, because one plan per
+# statement text is reused instead of one plan per literal value.
+
+REPORT_SQL = """
+    SELECT DATEADD(HOUR, DATEDIFF(HOUR, 0, q.created), 0) AS hour_start,
+           cp.objtype,
+           COUNT(*) AS plans,
+           SUM(CAST(cp.size_in_bytes AS BIGINT)) / 1024 AS size_kb
+    FROM sys.dm_exec_cached_plans cp
+    CROSS APPLY (
+        SELECT MIN(qs.creation_time) AS created
+        FROM sys.dm_exec_query_stats qs
+        WHERE qs.plan_handle = cp.plan_handle
+    ) q
+    CROSS APPLY sys.dm_exec_plan_attributes(cp.plan_handle) pa
+    WHERE cp.cacheobjtype = 'Compiled Plan'
+      AND pa.attribute = 'dbid'
+      AND CAST(pa.value AS INT) = DB_ID()
+      AND q.created >= DATEADD(HOUR, -?, GETDATE())
+    GROUP BY DATEADD(HOUR, DATEDIFF(HOUR, 0, q.created), 0), cp.objtype
+    ORDER BY hour_start, cp.objtype
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan-cache entries created per hour (needs VIEW SERVER STATE)")
+    parser.add_argument('--hours', type=int, default=24)
+    args = parser.parse_args()
+
+    conn = connect_mssql()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.execute(REPORT_SQL, (args.hours,))
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    print(f"{'hour':<18}{'objtype':<12}{'plans':>8}{'size KB':>12}")
+    for hour_start, objtype, plans, size_kb in rows:
+        print(f"{hour_start:%Y-%m-%d %H:00}  {objtype:<12}{plans:>8}{size_kb:>12}")
+
+
+if __name__ == "__main__":
+    main()
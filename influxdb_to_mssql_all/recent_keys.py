@@ -0,0 +1,134 @@
+import heapq
+import hashlib
+import math
+
+# Late data handling for final6_tvp_log.py.
+#
+# The sync used to resume at last_time + 1µs, so a point that reaches InfluxDB
+# after a newer one was already copied (Telegraf flush jitter, devices sending
+# their buffer after a reconnect) was never copied. Now every cycle re-reads a
+# lateness window behind the watermark (newest committed time) and drops the
+# rows that were already committed, using keys kept in memory instead of
+# reading them back from MSSQL like final.py / final2.py do:
+#   - exact tier: set of (time, key columns) for the newest exact_window
+#   - Bloom tier: one Bloom filter per time bucket for the rest of the lateness
+#     window. A false positive drops a genuinely new late row, with probability
+#     fp_rate, so keep the exact tier covering the usual lateness.
+# The index only knows what this process committed; scan_from() never goes back
+# before the point where the process started recording (covered_from).
+
+
+class BloomFilter:
+    def __init__(self, expected_items, fp_rate):
+        self.size = max(8, int(-expected_items * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / expected_items * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class RecentKeyIndex:
+    def __init__(self, exact_window, bloom_window, max_exact_keys,
+                 bucket_seconds=3600, bloom_expected_keys=200000, bloom_fp_rate=0.001):
+        self.exact_window = exact_window
+        self.bloom_window = bloom_window
+        self.max_exact_keys = max_exact_keys
+        self.bucket_seconds = bucket_seconds
+        self.bloom_expected_keys = bloom_expected_keys
+        self.bloom_fp_rate = bloom_fp_rate
+        self.exact = set()
+        self.exact_by_time = []  # heap of the same keys (time first) for eviction
+        self.blooms = {}  # bucket number -> BloomFilter
+        self.newest = None
+
+    def _bucket(self, row_time):
+        return int(row_time.timestamp()) // self.bucket_seconds
+
+    def _bloom_key(self, key):
+        return '|'.join(str(part) for part in key)
+
+    def __contains__(self, key):
+        if key in self.exact:
+            return True
+        bloom = self.blooms.get(self._bucket(key[0]))
+        return bloom is not None and self._bloom_key(key) in bloom
+
+    def add(self, key):
+        if key in self.exact:
+            return
+        self.exact.add(key)
+        heapq.heappush(self.exact_by_time, key)
+        if self.newest is None or key[0] > self.newest:
+            self.newest = key[0]
+
+    def expire(self):
+        """Move keys older than exact_window (or over max_exact_keys) to the Bloom tier, drop buckets past bloom_window"""
+        if self.newest is None:
+            return
+        exact_from = self.newest - self.exact_window
+        while self.exact_by_time and (self.exact_by_time[0][0] < exact_from or len(self.exact) > self.max_exact_keys):
+            key = heapq.heappop(self.exact_by_time)
+            self.exact.discard(key)
+            if key[0] >= self.newest - self.bloom_window:
+                bucket = self._bucket(key[0])
+                if bucket not in self.blooms:
+                    self.blooms[bucket] = BloomFilter(self.bloom_expected_keys, self.bloom_fp_rate)
+                self.blooms[bucket].add(self._bloom_key(key))
+
+        oldest_bucket = self._bucket(self.newest - self.bloom_window)
+        for bucket in [b for b in self.blooms if b < oldest_bucket]:
+            del self.blooms[bucket]
+
+
+def row_key(row, key_columns):
+    # '' for a missing tag keeps keys comparable in the eviction heap
+    return (row['time'],) + tuple('' if row.get(col) is None else row[col] for col in key_columns)
+
+
+class LatenessWatermark:
+    """Scan position of one measurement: watermark (newest committed time) and the keys committed since startup"""
+
+    def __init__(self, last_time, lateness, index, key_columns, time_offset):
+        self.watermark = last_time
+        self.covered_from = last_time  # None: the table was empty, every row in it was recorded here
+        self.lateness = lateness
+        self.index = index
+        self.key_columns = key_columns
+        self.time_offset = time_offset  # stored row time - InfluxDB UTC time
+
+    def scan_from(self):
+        """Exclusive lower bound (UTC) for the next InfluxDB read"""
+        if self.watermark is None:
+            return self.covered_from
+        start = self.watermark - self.lateness
+        if self.covered_from is not None and start < self.covered_from:
+            return self.covered_from
+        return start
+
+    def drop_seen(self, rows):
+        new_rows = []
+        for row in rows:
+            key = row_key(row, self.key_columns)
+            if key not in self.index:
+                new_rows.append(row)
+        return new_rows
+
+    def record_committed(self, rows):
+        for row in rows:
+            self.index.add(row_key(row, self.key_columns))
+        self.index.expire()
+        if rows:
+            newest = max(row['time'] for row in rows) - self.time_offset
+            if self.watermark is None or newest > self.watermark:
+                self.watermark = newest
@@ -0,0 +1,197 @@
+import os
+import time
+import argparse
+import datetime
+
+import final6_tvp_log as sync
+from schema_bootstrap import bootstrap
+from mssql_statements import quote_ident
+from mssql_writers import get_writer, counted_commit
+from recent_keys import row_key
+
+# Find and repair rows missing in MSSQL without a full resync.
+#
+# Per measurement, row counts per (hour, topic) are compared between InfluxDB
+# (COUNT(*) GROUP BY time(1h), topic) and {measurement}_tb (GROUP BY hour,
+# topic): two aggregate queries, whatever the data volume. Only the buckets
+# where MSSQL has fewer rows are re-read from InfluxDB; rows whose (time, topic)
+# already exists in that bucket are skipped, the rest go through the same
+# writer as final6_tvp_log.py. Buckets where MSSQL has more rows (duplicates)
+# are only reported.
+#
+#   python reconciler.py                         all tools, last RECONCILE_HOURS hours
+#   python reconciler.py iot_got1 --hours 48 --dry-run
+#   python reconciler.py --interval-minutes 30   run in the background
+#
+# The newest RECONCILE_SETTLE_MINUTES are left to the sync loop.
+
+RECONCILE_HOURS = int(os.getenv('RECONCILE_HOURS', 24))
+RECONCILE_SETTLE_MINUTES = int(os.getenv('RECONCILE_SETTLE_MINUTES', 10))
+
+# Stored times are UTC+7 (see transform_points)
+TIME_OFFSET = datetime.timedelta(hours=7)
+BUCKET = datetime.timedelta(hours=1)
+
+
+def reconcile_window(hours, now=None):
+    """[start, end) in UTC: whole hours, ending before the settle period"""
+    now = now or datetime.datetime.utcnow()
+    end = (now - datetime.timedelta(minutes=RECONCILE_SETTLE_MINUTES)).replace(minute=0, second=0, microsecond=0)
+    return end - datetime.timedelta(hours=hours), end
+
+
+def influx_time(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def get_influx_bucket_counts(measurement, start, end):
+    """{(bucket start UTC, topic): points}"""
+    query = (f'SELECT COUNT(*) FROM "{measurement}" '
+             f'WHERE time >= \'{influx_time(start)}\' AND time < \'{influx_time(end)}\' '
+             f'GROUP BY time(1h), "topic"')
+    counts = {}
+    for (_, tags), points in sync.influx_client.query(query).items():
+        topic = (tags or {}).get('topic') or ''
+        for point in points:
+            # one count_<field> per field; a point has at least one of them
+            count = max((value for key, value in point.items() if key.startswith('count_') and value), default=0)
+            if count:
+                bucket = datetime.datetime.strptime(point['time'], "%Y-%m-%dT%H:%M:%SZ")
+                counts[(bucket, topic)] = count
+    return counts
+
+
+def get_mssql_bucket_counts(cursor, table_name, start, end):
+    """{(bucket start UTC, topic): rows}"""
+    cursor.execute(f"""
+        SELECT DATEADD(HOUR, DATEDIFF(HOUR, 0, time), 0) AS bucket, ISNULL(topic, ''), COUNT(*)
+        FROM {quote_ident(table_name)}
+        WHERE time >= ? AND time < ?
+        GROUP BY DATEADD(HOUR, DATEDIFF(HOUR, 0, time), 0), ISNULL(topic, '')
+    """, (start + TIME_OFFSET, end + TIME_OFFSET))
+    return {(bucket - TIME_OFFSET, topic): count for bucket, topic, count in cursor.fetchall()}
+
+
+def compare_buckets(influx_counts, mssql_counts):
+    """(missing, extra): lists of (bucket, topic, influx count, mssql count)"""
+    missing, extra = [], []
+    for key in sorted(set(influx_counts) | set(mssql_counts)):
+        influx_count = influx_counts.get(key, 0)
+        mssql_count = mssql_counts.get(key, 0)
+        if mssql_count < influx_count:
+            missing.append(key + (influx_count, mssql_count))
+        elif mssql_count > influx_count:
+            extra.append(key + (influx_count, mssql_count))
+    return missing, extra
+
+
+def fetch_bucket(column_info, measurement, bucket, topic):
+    columns = [col[0] for col in column_info if col[0] != 'time']
+    topic_filter = "\"topic\" = '" + topic.replace("'", "\\'") + "'"
+    query = (f'SELECT {", ".join(columns) or "*"} FROM "{measurement}" '
+             f'WHERE time >= \'{influx_time(bucket)}\' AND time < \'{influx_time(bucket + BUCKET)}\' '
+             f'AND {topic_filter} ORDER BY time ASC')
+    points = list(sync.influx_client.query(query).get_points(measurement=measurement))
+    return sync.transform_points(column_info, points)
+
+
+def get_bucket_keys(cursor, table_name, bucket, topic):
+    cursor.execute(f"""
+        SELECT time, ISNULL(topic, '') FROM {quote_ident(table_name)}
+        WHERE time >= ? AND time < ? AND ISNULL(topic, '') = ?
+    """, (bucket + TIME_OFFSET, bucket + BUCKET + TIME_OFFSET, topic))
+    return {tuple(row) for row in cursor.fetchall()}
+
+
+def repair_bucket(conn, column_info, measurement, bucket, topic):
+    """Insert the rows of one (hour, topic) bucket that are not in MSSQL yet. Returns rows inserted."""
+    table_name = f"{measurement}_tb"
+    cursor = conn.cursor()
+    existing = get_bucket_keys(cursor, table_name, bucket, topic)
+    cursor.close()
+
+    data = [row for row in fetch_bucket(column_info, measurement, bucket, topic)
+            if row_key(row, ['topic']) not in existing]
+    if not data:
+        return 0
+
+    columns = list(data[0].keys())
+    backend = sync.WRITER_BACKEND_MAP.get(table_name, sync.WRITER_BACKEND)
+    get_writer(backend)(conn, table_name, columns, [tuple(row[col] for col in columns) for row in data])
+    counted_commit(conn)
+    return len(data)
+
+
+def reconcile_measurement(conn, column_info, measurement, hours, dry_run):
+    table_name = f"{measurement}_tb"
+    start, end = reconcile_window(hours)
+    influx_counts = get_influx_bucket_counts(measurement, start, end)
+    cursor = conn.cursor()
+    mssql_counts = get_mssql_bucket_counts(cursor, table_name, start, end)
+    cursor.close()
+
+    missing, extra = compare_buckets(influx_counts, mssql_counts)
+    for bucket, topic, influx_count, mssql_count in extra:
+        print(f"[reconcile] {table_name} {bucket:%Y-%m-%d %H}:00 {topic}: {mssql_count - influx_count} more rows than InfluxDB")
+
+    repaired = 0
+    for bucket, topic, influx_count, mssql_count in missing:
+        if dry_run:
+            print(f"[reconcile] {table_name} {bucket:%Y-%m-%d %H}:00 {topic}: {influx_count - mssql_count} rows missing")
+            continue
+        try:
+            inserted = repair_bucket(conn, column_info, measurement, bucket, topic)
+            repaired += inserted
+            print(f"[reconcile] {table_name} {bucket:%Y-%m-%d %H}:00 {topic}: inserted {inserted} missing rows")
+        except Exception as e:
+            conn.rollback()
+            error_msg = f"[reconcile] Error repairing {table_name} {bucket} {topic}: {str(e)}"
+            print(error_msg)
+            sync.error_logger.error(error_msg)
+
+    success_msg = (f"[reconcile] {measurement}: {len(influx_counts)} buckets in InfluxDB, {len(missing)} with missing rows, "
+                   f"{len(extra)} with extra rows, {repaired} rows repaired")
+    print(success_msg)
+    sync.success_logger.info(success_msg)
+
+
+def run_reconcile(measurements, hours, dry_run):
+    if not sync.connect_influxdb():
+        return
+    measurements = measurements or sync.get_tools_from_mssql()
+    conn = sync.connect_mssql()
+    if not conn:
+        return
+    try:
+        schemas = bootstrap(conn, sync.influx_client, measurements)
+        for measurement in measurements:
+            if measurement not in schemas:
+                continue
+            try:
+                reconcile_measurement(conn, schemas[measurement], measurement, hours, dry_run)
+            except Exception as e:
+                conn.rollback()
+                error_msg = f"[reconcile] Error reconciling {measurement}: {str(e)}"
+                print(error_msg)
+                sync.error_logger.error(error_msg)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare hourly row counts between InfluxDB and MSSQL and repair missing rows")
+    parser.add_argument('measurements', nargs='*', help="default: all tools from device_master_tb")
+    parser.add_argument('--hours', type=int, default=RECONCILE_HOURS)
+    parser.add_argument('--dry-run', action='store_true', help="only report mismatched buckets")
+    parser.add_argument('--interval-minutes', type=int, default=0, help="repeat every N minutes (0 = run once)")
+    args = parser.parse_args()
+
+    while True:
+        run_reconcile(args.measurements, args.hours, args.dry_run)
+        if args.interval_minutes <= 0:
+            break
+        time.sleep(args.interval_minutes * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import os
+import time
+import argparse
+import datetime
+
+from final6_tvp_log import connect_mssql, error_logger, success_logger
+from mssql_writers import parse_backend_map
+from mssql_statements import quote_ident
+
+# Retention for the MSSQL tables written by the sync scripts.
+#
+# InfluxDB keeps 7 days (the 7_days retention policy); without this job the
+# MSSQL copies grow forever. Per table:
+#   - partitioned tables (raw_{measurement}_all): every partition that lies
+#     completely before the cutoff is emptied with TRUNCATE ... WITH (PARTITIONS)
+#     or, on servers without it, SWITCHed out to a staging table and truncated.
+#     Both are metadata operations, the table lock is held for milliseconds.
+#   - other tables ({measurement}_tb, RETENTION_TABLES): DELETE TOP (n) batches,
+#     each committed on its own and kept below the 5000-lock escalation
+#     threshold, so the sync keeps writing between batches. An index on time
+#     keeps each batch from scanning the table.
+#
+#   python retention_purge.py                     purge once
+#   python retention_purge.py --interval-minutes 60
+#   python retention_purge.py --dry-run
+#
+# RETENTION_DAYS=7 (default), RETENTION_MAP=iot_got1=30,test_data=3 per measurement.
+#
+# Only tables the sync owns are touched: iot_{tools}_tb for the tools in
+# device_master_tb, {measurement}_tb of the measurements in schema_manifest_tb,
+# raw_*_all, plus the names listed in RETENTION_TABLES (e.g. per-topic raw_*
+# tables). Other tables with a time column are skipped and listed in the log.
+
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', 7))
+RETENTION_MAP = {k: int(v) for k, v in parse_backend_map(os.getenv('RETENTION_MAP', '')).items()}
+DELETE_BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', 4000))
+DELETE_BATCH_PAUSE = float(os.getenv('DELETE_BATCH_PAUSE', 0.05))  # seconds between batches
+
+# Stored times are UTC+7 (see fetch_influxdb_data)
+TIME_OFFSET_HOURS = 7
+
+RETENTION_TABLES = {name.strip() for name in os.getenv('RETENTION_TABLES', '').split(',') if name.strip()}
+
+EXCLUDED_TABLES = {'device_master_tb', 'schema_manifest_tb'}
+
+
+def measurement_of(table_name):
+    """{m}_tb, raw_{m}_all and raw_{m}_{machine} -> measurement (longest RETENTION_MAP match for per-topic tables)"""
+    if table_name.startswith('raw_') and table_name.endswith('_all'):
+        return table_name[len('raw_'):-len('_all')]
+    if table_name.endswith('_tb'):
+        return table_name[:-len('_tb')]
+    if table_name.startswith('raw_'):
+        name = table_name[len('raw_'):]
+        matches = [m for m in RETENTION_MAP if name.startswith(m + '_')]
+        return max(matches, key=len) if matches else name
+    return table_name
+
+
+def retention_days_for(table_name):
+    return RETENTION_MAP.get(measurement_of(table_name), RETENTION_DAYS)
+
+
+def owned_tables(cursor):
+    """Names of the {measurement}_tb tables written by the sync, plus RETENTION_TABLES"""
+    names = set(RETENTION_TABLES)
+    cursor.execute("SELECT DISTINCT tools FROM device_master_tb WHERE tools IS NOT NULL")
+    names.update(f"iot_{row[0]}_tb" for row in cursor.fetchall())
+    cursor.execute("SELECT OBJECT_ID('schema_manifest_tb', 'U')")
+    if cursor.fetchone()[0] is not None:
+        cursor.execute("SELECT measurement FROM schema_manifest_tb")
+        names.update(f"{row[0]}_tb" for row in cursor.fetchall())
+    return names
+
+
+def find_tables(cursor):
+    """(tables to purge, skipped tables): user tables with a time column, purged only when the sync owns them"""
+    cursor.execute("""
+        SELECT t.name
+        FROM sys.tables t
+        JOIN sys.columns c ON c.object_id = t.object_id AND c.name = 'time'
+        WHERE t.is_ms_shipped = 0
+        ORDER BY t.name
+    """)
+    candidates = [row[0] for row in cursor.fetchall() if row[0] not in EXCLUDED_TABLES]
+    owned = owned_tables(cursor)
+    tables, skipped = [], []
+    for table_name in candidates:
+        if table_name in owned or (table_name.startswith('raw_') and table_name.endswith('_all')):
+            tables.append(table_name)
+        else:
+            skipped.append(table_name)
+    return tables, skipped
+
+
+def get_expired_partitions(cursor, table_name, cutoff):
+    """[(partition_number, rows)] of partitions whose upper boundary is <= cutoff (RANGE RIGHT)"""
+    cursor.execute("""
+        SELECT p.partition_number, p.rows
+        FROM sys.partitions p
+        JOIN sys.indexes i ON i.object_id = p.object_id AND i.index_id = p.index_id
+        JOIN sys.partition_schemes ps ON ps.data_space_id = i.data_space_id
+        JOIN sys.partition_range_values prv
+          ON prv.function_id = ps.function_id AND prv.boundary_id = p.partition_number
+        WHERE p.object_id = OBJECT_ID(?) AND p.index_id IN (0, 1)
+          AND CAST(prv.value AS DATETIME2) <= ?
+        ORDER BY p.partition_number
+    """, (table_name, cutoff))
+    return cursor.fetchall()
+
+
+def is_partitioned(cursor, table_name):
+    cursor.execute("""
+        SELECT COUNT(*) FROM sys.partitions
+        WHERE object_id = OBJECT_ID(?) AND index_id IN (0, 1)
+    """, (table_name,))
+    return cursor.fetchone()[0] > 1
+
+
+def switch_out_partition(cursor, table_name, partition_number):
+    """Fallback for servers without TRUNCATE ... WITH (PARTITIONS): SWITCH to an empty staging copy"""
+    stage = f"{table_name}_purge_stage"
+    cursor.execute(f"IF OBJECT_ID(?, 'U') IS NOT NULL DROP TABLE {quote_ident(stage)}", (stage,))
+    cursor.execute(f"SELECT TOP 0 * INTO {quote_ident(stage)} FROM {quote_ident(table_name)}")
+
+    # The staging table needs the same clustered key as the source
+    cursor.execute("""
+        SELECT c.name
+        FROM sys.index_columns ic
+        JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+        WHERE ic.object_id = OBJECT_ID(?) AND ic.index_id = 1 AND ic.key_ordinal > 0
+        ORDER BY ic.key_ordinal
+    """, (table_name,))
+    key_columns = [row[0] for row in cursor.fetchall()]
+    if key_columns:
+        cursor.execute(
+            f"ALTER TABLE {quote_ident(stage)} ADD CONSTRAINT {quote_ident('PK_' + stage)} "
+            f"PRIMARY KEY CLUSTERED ({', '.join(quote_ident(col) for col in key_columns)})"
+        )
+
+    cursor.execute(f"ALTER TABLE {quote_ident(table_name)} SWITCH PARTITION {int(partition_number)} TO {quote_ident(stage)}")
+    cursor.execute(f"DROP TABLE {quote_ident(stage)}")
+
+
+def purge_partitioned(conn, table_name, cutoff, dry_run):
+    cursor = conn.cursor()
+    purged = 0
+    lock_seconds = []
+    for partition_number, rows in get_expired_partitions(cursor, table_name, cutoff):
+        if rows == 0:
+            continue
+        if dry_run:
+            purged += rows
+            continue
+        start = time.perf_counter()
+        try:
+            cursor.execute(f"TRUNCATE TABLE {quote_ident(table_name)} WITH (PARTITIONS ({int(partition_number)}))")
+        except Exception:
+            conn.rollback()
+            start = time.perf_counter()
+            switch_out_partition(cursor, table_name, partition_number)
+        conn.commit()
+        lock_seconds.append(time.perf_counter() - start)
+        purged += rows
+    cursor.close()
+    return purged, lock_seconds
+
+
+def purge_batched(conn, table_name, cutoff, dry_run):
+    cursor = conn.cursor()
+    if dry_run:
+        cursor.execute(f"SELECT COUNT(*) FROM {quote_ident(table_name)} WHERE time < ?", (cutoff,))
+        count = cursor.fetchone()[0]
+        cursor.close()
+        return count, []
+
+    purged = 0
+    lock_seconds = []
+    sql = f"DELETE TOP (?) FROM {quote_ident(table_name)} WHERE time < ?"
+    while True:
+        start = time.perf_counter()
+        cursor.execute(sql, (DELETE_BATCH_SIZE, cutoff))
+        deleted = cursor.rowcount
+        conn.commit()
+        lock_seconds.append(time.perf_counter() - start)
+        purged += max(deleted, 0)
+        if deleted < DELETE_BATCH_SIZE:
+            break
+        time.sleep(DELETE_BATCH_PAUSE)
+    cursor.close()
+    return purged, lock_seconds
+
+
+def merge_empty_boundaries(conn, cutoff):
+    """Merge day boundaries before the cutoff whose neighbouring partitions are empty in every table"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT pf.name, CAST(prv.value AS DATETIME2), prv.boundary_id
+        FROM sys.partition_functions pf
+        JOIN sys.partition_range_values prv ON prv.function_id = pf.function_id
+        WHERE CAST(prv.value AS DATETIME2) <= ?
+          AND NOT EXISTS (
+              SELECT 1
+              FROM sys.partition_schemes ps
+              JOIN sys.indexes i ON i.data_space_id = ps.data_space_id
+              JOIN sys.partitions p ON p.object_id = i.object_id AND p.index_id = i.index_id
+              WHERE ps.function_id = pf.function_id
+                AND p.partition_number IN (prv.boundary_id, prv.boundary_id + 1)
+                AND p.rows > 0
+          )
+        ORDER BY pf.name, prv.boundary_id DESC
+    """, (cutoff,))
+    merged = 0
+    for function_name, boundary, _ in cursor.fetchall():
+        cursor.execute(f"ALTER PARTITION FUNCTION {quote_ident(function_name)}() MERGE RANGE (?)", (boundary,))
+        conn.commit()
+        merged += 1
+    cursor.close()
+    return merged
+
+
+def run_purge(dry_run=False):
+    conn = connect_mssql()
+    if not conn:
+        return
+    now = datetime.datetime.utcnow() + datetime.timedelta(hours=TIME_OFFSET_HOURS)
+    total_purged = 0
+    try:
+        cursor = conn.cursor()
+        tables, skipped = find_tables(cursor)
+        cursor.close()
+        if skipped:
+            skip_msg = f"[run_purge] Skipped {len(skipped)} tables not owned by the sync: {', '.join(skipped)}"
+            print(skip_msg)
+            success_logger.info(skip_msg)
+
+        for table_name in tables:
+            cutoff = now - datetime.timedelta(days=retention_days_for(table_name))
+            try:
+                cursor = conn.cursor()
+                partitioned = is_partitioned(cursor, table_name)
+                cursor.close()
+                if partitioned:
+                    purged, lock_seconds = purge_partitioned(conn, table_name, cutoff, dry_run)
+                else:
+                    purged, lock_seconds = purge_batched(conn, table_name, cutoff, dry_run)
+            except Exception as e:
+                conn.rollback()
+                error_msg = f"[run_purge] Error purging {table_name}: {str(e)}"
+                print(error_msg)
+                error_logger.error(error_msg)
+                continue
+
+            total_purged += purged
+            if purged or lock_seconds:
+                success_msg = (
+                    f"[run_purge] {table_name}: {'would purge' if dry_run else 'purged'} {purged} rows before {cutoff:%Y-%m-%d %H:%M} "
+                    f"({'partition' if partitioned else 'batched delete'}), lock held {sum(lock_seconds):.3f}s total, "
+                    f"{max(lock_seconds, default=0):.3f}s max over {len(lock_seconds)} operations"
+                )
+                print(success_msg)
+                success_logger.info(success_msg)
+
+        if not dry_run:
+            oldest_cutoff = now - datetime.timedelta(days=max([RETENTION_DAYS] + list(RETENTION_MAP.values())))
+            merged = merge_empty_boundaries(conn, oldest_cutoff)
+            if merged:
+                print(f"[run_purge] Merged {merged} empty day partitions")
+    finally:
+        conn.close()
+
+    print(f"[run_purge] Done: {total_purged} rows {'to purge' if dry_run else 'purged'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Purge MSSQL rows older than the retention period")
+    parser.add_argument('--dry-run', action='store_true', help="only count what would be purged")
+    parser.add_argument('--interval-minutes', type=int, default=0, help="repeat every N minutes (0 = run once)")
+    args = parser.parse_args()
+
+    while True:
+        run_purge(args.dry_run)
+        if args.interval_minutes <= 0:
+            break
+        time.sleep(args.interval_minutes * 60)
+
+
+if __name__ == "__main__":
+    main()
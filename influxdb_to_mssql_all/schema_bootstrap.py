@@ -0,0 +1,217 @@
+import json
+import hashlib
+import logging
+
+import mssql_schema
+from mssql_statements import quote_ident
+from mssql_writers import get_table_column_types
+
+# One-time DDL for the per-measurement objects used by final6_tvp_log.py:
+#     {measurement}_tb, {measurement}_tvp_type, usp_Insert_{measurement}
+#
+# The state applied to each measurement is recorded in schema_manifest_tb. At
+# startup a measurement whose manifest row has the current SCHEMA_VERSION (and
+# the same TVP mode) is used as recorded, without touching the catalog. Others
+# are reconciled: missing table/columns are added from InfluxDB's field and tag
+# keys, then the TVP type and procedure are recreated. The sync loop keeps the
+# column lists in memory and only comes back here when InfluxDB reports new keys.
+#
+# Bump SCHEMA_VERSION whenever the generated DDL changes.
+#
+#   python schema_bootstrap.py                 reconcile what is out of date
+#   python schema_bootstrap.py --force iot_got1  rebuild type/procedure of iot_got1
+
+SCHEMA_VERSION = 1
+MANIFEST_TABLE = 'schema_manifest_tb'
+
+error_logger = logging.getLogger('error_logger')
+success_logger = logging.getLogger('success_logger')
+
+INFLUX_FIELD_TYPES = {
+    'integer': 'INT',
+    'float': 'FLOAT',
+    'string': 'NVARCHAR(255)',
+    'boolean': 'BIT',
+}
+
+
+def columns_hash(column_info):
+    return hashlib.sha256(json.dumps(column_info).encode('utf-8')).hexdigest()
+
+
+def get_influx_columns(influx_client, measurement):
+    """[(column, SQL type)] for a measurement from SHOW TAG KEYS / SHOW FIELD KEYS, time first"""
+    columns = [('time', 'DATETIME2(6)')]
+    seen = {'time'}
+    for point in influx_client.query(f'SHOW TAG KEYS FROM "{measurement}"').get_points():
+        if point['tagKey'] not in seen:
+            columns.append((point['tagKey'], 'NVARCHAR(255)'))
+            seen.add(point['tagKey'])
+    for point in influx_client.query(f'SHOW FIELD KEYS FROM "{measurement}"').get_points():
+        if point['fieldKey'] not in seen:
+            columns.append((point['fieldKey'], INFLUX_FIELD_TYPES.get(point['fieldType'], 'NVARCHAR(255)')))
+            seen.add(point['fieldKey'])
+    return columns if len(columns) > 1 else []
+
+
+def get_all_influx_keys(influx_client):
+    """{measurement: set of tag and field keys} for every measurement, in two queries"""
+    keys = {}
+    for query, key_name in (('SHOW TAG KEYS', 'tagKey'), ('SHOW FIELD KEYS', 'fieldKey')):
+        for (measurement, _), points in influx_client.query(query).items():
+            keys.setdefault(measurement, set()).update(point[key_name] for point in points)
+    return keys
+
+
+def find_schema_changes(influx_client, schemas):
+    """Measurements whose InfluxDB keys are no longer all covered by the known columns"""
+    influx_keys = get_all_influx_keys(influx_client)
+    changed = []
+    for measurement, column_info in schemas.items():
+        known = {column for column, _ in column_info}
+        if influx_keys.get(measurement, set()) - known:
+            changed.append(measurement)
+    return changed
+
+
+def ensure_manifest_table(cursor):
+    cursor.execute(f"""
+        IF OBJECT_ID('{MANIFEST_TABLE}', 'U') IS NULL
+        CREATE TABLE {MANIFEST_TABLE} (
+            measurement NVARCHAR(128) NOT NULL PRIMARY KEY,
+            schema_version INT NOT NULL,
+            columns_hash CHAR(64) NOT NULL,
+            columns_json NVARCHAR(MAX) NOT NULL,
+            memory_optimized BIT NOT NULL,
+            applied_at DATETIME2(3) NOT NULL DEFAULT SYSUTCDATETIME()
+        )
+    """)
+
+
+def load_manifest(cursor):
+    cursor.execute(f"SELECT measurement, schema_version, columns_json, memory_optimized FROM {MANIFEST_TABLE}")
+    return {
+        row[0]: {
+            'schema_version': row[1],
+            'columns': [tuple(column) for column in json.loads(row[2])],
+            'memory_optimized': bool(row[3]),
+        }
+        for row in cursor.fetchall()
+    }
+
+
+def record_manifest(cursor, measurement, column_info, memory_optimized):
+    cursor.execute(f"""
+        MERGE {MANIFEST_TABLE} AS target
+        USING (SELECT ? AS measurement) AS source
+        ON target.measurement = source.measurement
+        WHEN MATCHED THEN
+            UPDATE SET schema_version = ?, columns_hash = ?, columns_json = ?,
+                       memory_optimized = ?, applied_at = SYSUTCDATETIME()
+        WHEN NOT MATCHED THEN
+            INSERT (measurement, schema_version, columns_hash, columns_json, memory_optimized)
+            VALUES (?, ?, ?, ?, ?);
+    """, (
+        measurement,
+        SCHEMA_VERSION, columns_hash(column_info), json.dumps(column_info), memory_optimized,
+        measurement, SCHEMA_VERSION, columns_hash(column_info), json.dumps(column_info), memory_optimized,
+    ))
+
+
+def reconcile_measurement(conn, influx_client, measurement):
+    """Bring table, TVP type and procedure of one measurement up to date. Returns column_info."""
+    table_name = f"{measurement}_tb"
+    tvp_type = f"{measurement}_tvp_type"
+    procedure = f"usp_Insert_{measurement}"
+    cursor = conn.cursor()
+
+    influx_columns = get_influx_columns(influx_client, measurement)
+    cursor.execute("SELECT OBJECT_ID(?, 'U')", (table_name,))
+    table_exists = cursor.fetchone()[0] is not None
+
+    if not table_exists:
+        if not influx_columns:
+            raise Exception(f"No data in InfluxDB for measurement {measurement}")
+        column_sql = ', '.join(f"{quote_ident(name)} {sql_type}" for name, sql_type in influx_columns)
+        cursor.execute(f"CREATE TABLE {quote_ident(table_name)} ({column_sql})")
+        print(f"Created table {table_name} successfully")
+    else:
+        existing = {name for name, _ in get_table_column_types(cursor, table_name)}
+        for name, sql_type in influx_columns:
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {quote_ident(table_name)} ADD {quote_ident(name)} {sql_type} NULL")
+                print(f"Added column {name} to {table_name}")
+
+    column_info = get_table_column_types(cursor, table_name)
+    memory_optimized = mssql_schema.use_memory_optimized_types(cursor)
+
+    # The procedure depends on the type, so it goes first
+    cursor.execute(f"IF OBJECT_ID(?, 'P') IS NOT NULL DROP PROCEDURE {quote_ident(procedure)}", (procedure,))
+    cursor.execute(f"IF TYPE_ID(?) IS NOT NULL DROP TYPE {quote_ident(tvp_type)}", (tvp_type,))
+    cursor.execute(mssql_schema.build_tvp_type_sql(measurement, column_info, memory_optimized))
+    cursor.execute(mssql_schema.build_insert_procedure_sql(measurement, table_name, [name for name, _ in column_info]))
+
+    record_manifest(cursor, measurement, column_info, memory_optimized)
+    conn.commit()
+    cursor.close()
+
+    success_msg = f"[reconcile_measurement] {measurement} at schema version {SCHEMA_VERSION} (memory optimized: {memory_optimized})"
+    print(success_msg)
+    success_logger.info(success_msg)
+    return column_info
+
+
+def bootstrap(conn, influx_client, measurements, force=()):
+    """
+    Return {measurement: column_info} for the given measurements, reconciling
+    only those that are missing/out of date in the manifest or listed in force.
+    """
+    cursor = conn.cursor()
+    ensure_manifest_table(cursor)
+    conn.commit()
+    manifest = load_manifest(cursor)
+    memory_optimized = mssql_schema.use_memory_optimized_types(cursor)
+    cursor.close()
+
+    schemas = {}
+    for measurement in measurements:
+        entry = manifest.get(measurement)
+        if (measurement not in force and entry
+                and entry['schema_version'] == SCHEMA_VERSION
+                and entry['memory_optimized'] == memory_optimized):
+            schemas[measurement] = entry['columns']
+            continue
+        try:
+            schemas[measurement] = reconcile_measurement(conn, influx_client, measurement)
+        except Exception as e:
+            conn.rollback()
+            error_msg = f"[bootstrap] Error reconciling schema for {measurement}: {str(e)}"
+            print(error_msg)
+            error_logger.error(error_msg)
+    return schemas
+
+
+def main():
+    import argparse
+    import final6_tvp_log as sync
+
+    parser = argparse.ArgumentParser(description="Reconcile MSSQL tables, TVP types and procedures with the schema manifest")
+    parser.add_argument('--force', action='store_true', help="rebuild even when the manifest is up to date")
+    parser.add_argument('measurements', nargs='*', help="default: all tools from device_master_tb")
+    args = parser.parse_args()
+
+    if not sync.connect_influxdb():
+        return
+    measurements = args.measurements or sync.get_tools_from_mssql()
+    conn = sync.connect_mssql()
+    if not conn:
+        return
+    try:
+        schemas = bootstrap(conn, sync.influx_client, measurements, force=set(measurements) if args.force else ())
+        print(f"Schema version {SCHEMA_VERSION}: {len(schemas)}/{len(measurements)} measurements ready")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import os
+import math
+import socket
+
+# Measurement leases for running several final6_tvp_log.py instances (SYNC_SHARDING=1).
+#
+# Every instance heartbeats a row in sync_instance_tb and owns the measurements
+# whose sync_lease_tb row carries its id and an expires_at in the future. Each
+# cycle an instance renews its leases, gives back what is above its fair share
+# (ceil(measurements / live instances)) and takes free or expired leases up to
+# it. Taking a lease is a single conditional UPDATE, so two instances can never
+# own the same measurement. When an instance dies its heartbeat and leases
+# expire after LEASE_SECONDS and the others pick its measurements up. Leases of
+# measurements no longer in device_master_tb are given back.
+#
+# A cycle can take longer than LEASE_SECONDS, so the sync calls renew_lease()
+# right before writing a measurement and skips it when the lease was lost; the
+# write itself then has LEASE_SECONDS to finish.
+
+SYNC_INSTANCE_ID = os.getenv('SYNC_INSTANCE_ID') or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SECONDS = int(os.getenv('LEASE_SECONDS', 180))
+
+INSTANCE_TABLE = 'sync_instance_tb'
+LEASE_TABLE = 'sync_lease_tb'
+
+
+def ensure_lease_tables(cursor):
+    cursor.execute(f"""
+        IF OBJECT_ID('{INSTANCE_TABLE}', 'U') IS NULL
+        CREATE TABLE {INSTANCE_TABLE} (
+            instance_id NVARCHAR(128) NOT NULL PRIMARY KEY,
+            heartbeat_at DATETIME2(3) NOT NULL
+        )
+    """)
+    cursor.execute(f"""
+        IF OBJECT_ID('{LEASE_TABLE}', 'U') IS NULL
+        CREATE TABLE {LEASE_TABLE} (
+            measurement NVARCHAR(128) NOT NULL PRIMARY KEY,
+            owner NVARCHAR(128) NULL,
+            expires_at DATETIME2(3) NULL
+        )
+    """)
+
+
+def heartbeat(cursor, instance_id):
+    cursor.execute(f"""
+        UPDATE {INSTANCE_TABLE} SET heartbeat_at = SYSUTCDATETIME() WHERE instance_id = ?;
+        IF @@ROWCOUNT = 0
+            INSERT INTO {INSTANCE_TABLE} (instance_id, heartbeat_at) VALUES (?, SYSUTCDATETIME());
+    """, (instance_id, instance_id))
+
+
+def get_live_instances(cursor):
+    cursor.execute(f"""
+        SELECT instance_id FROM {INSTANCE_TABLE}
+        WHERE heartbeat_at > DATEADD(SECOND, -?, SYSUTCDATETIME())
+    """, (LEASE_SECONDS,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def add_lease_rows(cursor, measurements):
+    for measurement in measurements:
+        cursor.execute(f"""
+            IF NOT EXISTS (SELECT 1 FROM {LEASE_TABLE} WITH (UPDLOCK, HOLDLOCK) WHERE measurement = ?)
+                INSERT INTO {LEASE_TABLE} (measurement) VALUES (?)
+        """, (measurement, measurement))
+
+
+def get_owned(cursor, instance_id):
+    cursor.execute(f"""
+        SELECT measurement FROM {LEASE_TABLE}
+        WHERE owner = ? AND expires_at > SYSUTCDATETIME()
+        ORDER BY measurement
+    """, (instance_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def renew(cursor, instance_id):
+    cursor.execute(f"""
+        UPDATE {LEASE_TABLE} SET expires_at = DATEADD(SECOND, ?, SYSUTCDATETIME())
+        WHERE owner = ? AND expires_at > SYSUTCDATETIME()
+    """, (LEASE_SECONDS, instance_id))
+
+
+def release(cursor, instance_id, measurements):
+    for measurement in measurements:
+        cursor.execute(f"""
+            UPDATE {LEASE_TABLE} SET owner = NULL, expires_at = NULL
+            WHERE measurement = ? AND owner = ?
+        """, (measurement, instance_id))
+
+
+def renew_lease(conn, measurement, instance_id=SYNC_INSTANCE_ID):
+    """Extend the lease of one measurement; False when this instance no longer owns it"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        UPDATE {LEASE_TABLE} SET expires_at = DATEADD(SECOND, ?, SYSUTCDATETIME())
+        WHERE measurement = ? AND owner = ? AND expires_at > SYSUTCDATETIME()
+    """, (LEASE_SECONDS, measurement, instance_id))
+    renewed = cursor.rowcount == 1
+    conn.commit()
+    cursor.close()
+    return renewed
+
+
+def try_acquire(cursor, instance_id, measurement):
+    cursor.execute(f"""
+        UPDATE {LEASE_TABLE} SET owner = ?, expires_at = DATEADD(SECOND, ?, SYSUTCDATETIME())
+        WHERE measurement = ? AND (owner IS NULL OR expires_at IS NULL OR expires_at <= SYSUTCDATETIME())
+    """, (instance_id, LEASE_SECONDS, measurement))
+    return cursor.rowcount == 1
+
+
+def balance_leases(conn, measurements, instance_id=SYNC_INSTANCE_ID):
+    """Heartbeat, renew, rebalance. Returns the sorted measurements this instance owns for the next cycle."""
+    cursor = conn.cursor()
+    ensure_lease_tables(cursor)
+    heartbeat(cursor, instance_id)
+    add_lease_rows(cursor, measurements)
+    renew(cursor, instance_id)
+    conn.commit()
+
+    live = get_live_instances(cursor)
+    share = math.ceil(len(measurements) / max(1, len(live)))
+    owned = get_owned(cursor, instance_id)
+    # Measurements removed from device_master_tb: stop renewing them
+    release(cursor, instance_id, [m for m in owned if m not in measurements])
+    owned = [m for m in owned if m in measurements]
+
+    if len(owned) > share:
+        release(cursor, instance_id, owned[share:])
+        owned = owned[:share]
+    else:
+        # Start at a different offset per instance so they don't all race for the same rows
+        offset = sorted(live).index(instance_id) * share if instance_id in live else 0
+        candidates = measurements[offset:] + measurements[:offset]
+        for measurement in candidates:
+            if len(owned) >= share:
+                break
+            if measurement not in owned and try_acquire(cursor, instance_id, measurement):
+                owned.append(measurement)
+    conn.commit()
+    cursor.close()
+    return sorted(owned)
@@ -0,0 +1,166 @@
+import os
+import glob
+import struct
+import argparse
+from collections import defaultdict
+
+# Bytes per point on disk, InfluxDB TSM shards and MSSQL tables, per measurement.
+#
+# InfluxDB: the index of every .tsm file under INFLUXDB_DATA_DIR/<db>/<rp>/<shard>
+# lists each series key + field with the offset and size of its blocks; the
+# number of points of a block is read from its timestamp header. Gives block
+# bytes and points per measurement and field, and index bytes per measurement.
+# Points still in the WAL / cache are not counted: run the report once the
+# shard has been snapshotted (cache-snapshot-write-cold-duration, 10m by default).
+#
+# MSSQL: used pages and rows of {measurement}_tb from sys.dm_db_partition_stats
+# (all indexes) and the compression of its partitions.
+#
+# Compare value models: run mqtt_python_0x/fleet_sim.py value_models_spec.json
+# (one measurement per model: iot_model_walk, iot_model_sine, ...), then
+#   python storage_report.py iot_model_ --fields
+#   python storage_report.py iot_got1 iot_got2 --no-mssql
+# The sync only creates iot_model_*_tb for tools in device_master_tb: insert the
+# model_* rows first (README, next to value_models_spec.json), else mssql rows is 0.
+
+INFLUXDB_DATA_DIR = os.getenv('INFLUXDB_DATA_DIR', '../influxdb/data/data')
+INFLUXDB_DATABASE = os.getenv('INFLUXDB_DATABASE', 'test_db')
+INFLUXDB_RETENTION_POLICY = os.getenv('INFLUXDB_RETENTION_POLICY', '7_days')
+
+TSM_MAGIC = 0x16D116D1
+FIELD_SEPARATOR = b'#!~#'
+INDEX_ENTRY = struct.Struct('>qqqI')   # min time, max time, offset, size
+# Values per simple8b word, by selector (top 4 bits)
+SIMPLE8B_COUNTS = [240, 120, 60, 30, 20, 15, 12, 10, 8, 7, 6, 5, 4, 3, 2, 1]
+
+MSSQL_SIZE_SQL = """
+    SELECT t.name,
+           SUM(CASE WHEN ps.index_id IN (0, 1) THEN ps.row_count ELSE 0 END),
+           SUM(ps.used_page_count) * 8192,
+           MAX(p.data_compression_desc)
+    FROM sys.tables t
+    JOIN sys.dm_db_partition_stats ps ON ps.object_id = t.object_id
+    JOIN sys.partitions p ON p.partition_id = ps.partition_id
+    WHERE t.name LIKE ?
+    GROUP BY t.name
+"""
+
+
+def uvarint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, pos
+
+
+def block_points(block):
+    """Points of a TSM block (CRC, type, uvarint timestamp length, timestamps, values)"""
+    length, pos = uvarint(block, 5)
+    timestamps = block[pos:pos + length]
+    encoding = timestamps[0] >> 4
+    if encoding == 0:    # uncompressed
+        return (len(timestamps) - 1) // 8
+    if encoding == 1:    # simple8b: first value, then packed deltas
+        return 1 + sum(SIMPLE8B_COUNTS[struct.unpack_from('>Q', timestamps, i)[0] >> 60]
+                       for i in range(9, len(timestamps), 8))
+    if encoding == 2:    # run length: first value, delta, count
+        _, pos = uvarint(timestamps, 9)
+        count, _ = uvarint(timestamps, pos)
+        return count
+    raise ValueError(f"Unknown TSM timestamp encoding {encoding}")
+
+
+def read_tsm(path, stats, prefixes):
+    """Add {(measurement, field): [block bytes, points]} and {(measurement, None): [index bytes, 0]} of one file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 13 or struct.unpack_from('>I', data, 0)[0] != TSM_MAGIC:
+        raise ValueError(f"{path} is not a TSM file")
+    pos, = struct.unpack_from('>Q', data, len(data) - 8)
+    end = len(data) - 8
+    while pos < end:
+        start = pos
+        key_length, = struct.unpack_from('>H', data, pos)
+        key = data[pos + 2:pos + 2 + key_length]
+        pos += 2 + key_length
+        _, entries = struct.unpack_from('>BH', data, pos)
+        pos += 3
+        series, _, field = key.partition(FIELD_SEPARATOR)
+        measurement = series.split(b',', 1)[0].decode('utf-8', 'replace')
+        if prefixes and not measurement.startswith(prefixes):
+            pos += entries * INDEX_ENTRY.size
+            continue
+        field_stats = stats[(measurement, field.decode('utf-8', 'replace'))]
+        for _ in range(entries):
+            _, _, offset, size = INDEX_ENTRY.unpack_from(data, pos)
+            pos += INDEX_ENTRY.size
+            field_stats[0] += size
+            field_stats[1] += block_points(data[offset:offset + size])
+        stats[(measurement, None)][0] += pos - start
+
+
+def influx_storage(prefixes, data_dir=INFLUXDB_DATA_DIR):
+    stats = defaultdict(lambda: [0, 0])
+    files = sorted(glob.glob(os.path.join(data_dir, INFLUXDB_DATABASE, INFLUXDB_RETENTION_POLICY, '*', '*.tsm')))
+    for path in files:
+        read_tsm(path, stats, prefixes)
+    return stats, len(files)
+
+
+def mssql_storage(prefixes):
+    """{measurement: (rows, used bytes, compression)} of the {measurement}_tb tables"""
+    import final6_tvp_log as sync
+
+    conn = sync.connect_mssql()
+    if not conn:
+        return {}
+    result = {}
+    try:
+        cursor = conn.cursor()
+        for prefix in prefixes or ('',):
+            cursor.execute(MSSQL_SIZE_SQL, prefix.replace('_', '[_]') + '%[_]tb')
+            for table_name, rows, used_bytes, compression in cursor.fetchall():
+                result[table_name[:-3]] = (rows or 0, used_bytes or 0, compression)
+        cursor.close()
+    finally:
+        conn.close()
+    return result
+
+
+def report(prefixes, show_fields=False, with_mssql=True):
+    stats, files = influx_storage(prefixes)
+    tables = mssql_storage(prefixes) if with_mssql else {}
+    measurements = sorted({measurement for measurement, _ in stats} | set(tables))
+    print(f"{files} TSM files in {os.path.join(INFLUXDB_DATA_DIR, INFLUXDB_DATABASE, INFLUXDB_RETENTION_POLICY)}")
+    print(f"{'measurement':<24}{'fields':>7}{'rows':>12}{'tsm B/value':>13}{'tsm B/row':>11}"
+          f"{'mssql rows':>12}{'mssql B/row':>13}  compression")
+    for measurement in measurements:
+        fields = {field: value for (m, field), value in stats.items() if m == measurement and field is not None}
+        block_bytes = sum(value[0] for value in fields.values())
+        values = sum(value[1] for value in fields.values())
+        rows = max((value[1] for value in fields.values()), default=0)
+        tsm_bytes = block_bytes + stats[(measurement, None)][0] if fields else 0
+        mssql_rows, mssql_bytes, compression = tables.get(measurement, (0, 0, ''))
+        print(f"{measurement:<24}{len(fields):>7}{rows:>12}{block_bytes / values if values else 0:>13.2f}"
+              f"{tsm_bytes / rows if rows else 0:>11.1f}{mssql_rows:>12}"
+              f"{mssql_bytes / mssql_rows if mssql_rows else 0:>13.1f}  {compression or ''}")
+        if show_fields:
+            for field, (field_bytes, points) in sorted(fields.items()):
+                print(f"  {field:<22}{'':>7}{points:>12}{field_bytes / points if points else 0:>13.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per point in InfluxDB TSM shards and MSSQL tables")
+    parser.add_argument('prefixes', nargs='*', help="measurement name prefixes (default: all)")
+    parser.add_argument('--fields', action='store_true', help="bytes per value of every field")
+    parser.add_argument('--no-mssql', action='store_true')
+    args = parser.parse_args()
+    report(tuple(args.prefixes), args.fields, not args.no_mssql)
+
+
+if __name__ == "__main__":
+    main()
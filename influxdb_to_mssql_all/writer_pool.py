@@ -0,0 +1,81 @@
+import time
+import queue
+import threading
+import logging
+
+# Spread per-table writes over several MSSQL connections.
+#
+# Tables are independent, so they can be written in parallel. Each table is
+# handed to exactly one worker per call and all of its rows are written there,
+# so the order of writes inside a table is the same as with one connection.
+# pool_size is the global concurrency limit: at most pool_size connections
+# (and therefore at most pool_size transactions) are open at any time.
+
+error_logger = logging.getLogger('error_logger')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(latencies):
+    """p50/p90/p99/max of a list of seconds, in milliseconds"""
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 50) * 1000,
+        'p90_ms': percentile(values, 90) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': (values[-1] if values else 0.0) * 1000,
+    }
+
+
+def write_tables_concurrently(data, connect, write_table, pool_size):
+    """
+    data:        {table_name: rows}
+    connect:     function returning a new DB-API connection
+    write_table: function(conn, table_name, rows), commits its own transaction and
+                 returns True when it did (False: nothing to write or the write failed)
+    Returns {table_name: seconds from start of the write to commit} of the committed tables.
+    """
+    table_queue = queue.Queue()
+    # Biggest tables first so a large table does not start last and stretch the cycle
+    for table_name, rows in sorted(data.items(), key=lambda item: len(item[1]), reverse=True):
+        table_queue.put((table_name, rows))
+
+    latencies = {}
+    latencies_lock = threading.Lock()
+
+    def worker():
+        conn = connect()
+        try:
+            while True:
+                try:
+                    table_name, rows = table_queue.get_nowait()
+                except queue.Empty:
+                    return
+                start = time.perf_counter()
+                try:
+                    committed = write_table(conn, table_name, rows)
+                except Exception as e:
+                    error_logger.error(f"[write_tables_concurrently] Error writing {table_name}: {str(e)}")
+                    continue
+                if not committed:
+                    continue
+                with latencies_lock:
+                    latencies[table_name] = time.perf_counter() - start
+        finally:
+            conn.close()
+
+    workers = [
+        threading.Thread(target=worker, name=f"mssql-writer-{i}", daemon=True)
+        for i in range(max(1, min(pool_size, table_queue.qsize())))
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies
@@ -2,6 +2,11 @@ import paho.mqtt.client as mqtt
 import json
 import time
 import threading
+import os
+
+import loadgen
+import payloads
+import value_models
 
 # MQTT Broker Configuration
 BROKER = "localhost"  # เปลี่ยนเป็น IP หรือ hostname ของ MQTT Broker
@@ -14,6 +19,21 @@ TOPIC_PREFIX2 = "iot_sensors/device_log/got_"  # Prefix สำหรับ topic
 NUM_TOPICS2 = 200       # จำนวน topics
 PUBLISH_INTERVAL2 = 30   # วินาที
 
+# MODE=interval: publish every topic, then sleep PUBLISH_INTERVAL (default)
+# MODE=loadgen: publish the topics round-robin at exactly LOADGEN_RATE msg/s (loadgen.py)
+# MODE=qos_sweep: unthrottled loadgen per QoS level (QOS_SWEEP), prints acked msg/s of each
+# Every mode publishes with PUBLISH_QOS and at most INFLIGHT_WINDOW unacknowledged messages (loadgen.PublishTracker)
+PUBLISH_REPORT_SECONDS = float(os.getenv('PUBLISH_REPORT_SECONDS', 60))
+MODE = os.getenv('MODE', 'interval')
+# PAYLOAD_FORMAT=dict: json.dumps(generate_payload()) per message (default)
+# PAYLOAD_FORMAT=json / line: pre-serialized template per topic, only data_id and modelled values are encoded (payloads.py)
+PAYLOAD_FORMAT = os.getenv('PAYLOAD_FORMAT', 'dict')
+# LATENCY_PROBE_INTERVAL>0: also publish a probe (seq + send time in µs) to {TOPIC_PREFIX}/latency_probe
+# every LATENCY_PROBE_INTERVAL seconds, for influxdb_to_mssql_all/latency_checker.py
+LATENCY_PROBE_INTERVAL = float(os.getenv('LATENCY_PROBE_INTERVAL', 0))
+# VALUE_MODEL / VALUE_MODELS / VALUE_SEED: the numeric fields follow a value model instead of
+# staying constant (value_models.py); the generate_payload values are the base values
+
 count = 0
 # Payload Template
 def generate_payload(topic_id,count):
@@ -38,10 +58,27 @@ def generate_payload2(topic_id2,count):
         "ram": 1000000,
     }
 
+field_values = {}
+
+# Value models of a device, created on first use from its first payload
+def device_values(topic, payload):
+    values = field_values.get(topic)
+    if values is None:
+        fields = dict(payload)
+        del fields["data_id"]
+        values = value_models.FieldValues(value_models.apply_env_models(fields), topic)
+        field_values[topic] = values
+    return values
+
 # Publish Messages to MQTT Broker
 def publish_topic(client, topic_id,count):
+    if PAYLOAD_FORMAT != 'dict':
+        client.publish(*encode_message(topic_id, count))
+        return
     topic = f"{TOPIC_PREFIX}/mc_{topic_id}"
     payload = generate_payload(topic_id,count)
+    values = device_values(topic, payload)
+    payload.update(zip(values.dynamic_fields, values.next()))
     print(payload)
     client.publish(topic, json.dumps(payload))
     print(f"Published to {topic}: {payload}")
@@ -49,6 +86,8 @@ def publish_topic(client, topic_id,count):
 def publish_topic2(client, topic_id,count):
     topic2 = f"{TOPIC_PREFIX2}/mc_{topic_id}"
     payload = generate_payload2(topic_id,count)
+    values = device_values(topic2, payload)
+    payload.update(zip(values.dynamic_fields, values.next()))
     print(payload)
     client.publish(topic2, json.dumps(payload))
     print(f"Published to {topic2}: {payload}")
@@ -62,6 +101,42 @@ def publish_all_topics(client):
             publish_topic(client, topic_id,count)
         time.sleep(PUBLISH_INTERVAL)
 
+templates = {}
+
+# (topic, payload) in PAYLOAD_FORMAT
+def encode_message(topic_id, count):
+    topic = f"{TOPIC_PREFIX}/mc_{topic_id}"
+    if PAYLOAD_FORMAT == 'dict':
+        payload = generate_payload(topic_id, count)
+        values = device_values(topic, payload)
+        payload.update(zip(values.dynamic_fields, values.next()))
+        return topic, json.dumps(payload)
+    template = templates.get(topic_id)
+    if template is None:
+        values = device_values(topic, generate_payload(topic_id, count))
+        template = payloads.make_template(PAYLOAD_FORMAT, TOPIC_PREFIX.split('/')[1], values.static,
+                                          ["data_id"] + values.dynamic_fields, tags={"topic": topic})
+        templates[topic_id] = template
+    return payloads.topic_for_format(topic, PAYLOAD_FORMAT), template.encode(count, *field_values[topic].next())
+
+# Message k of the load generator: topics round-robin, data_id = round number
+def loadgen_message(k):
+    topic_id = k % NUM_TOPICS + 1
+    return encode_message(topic_id, k // NUM_TOPICS + 1)
+
+# Thread for latency probes, on an absolute timeline so a slow publish does not shift later probes
+def publish_probes(client):
+    topic = f"{TOPIC_PREFIX}/latency_probe"
+    seq = 0
+    next_due = time.perf_counter()
+    while True:
+        seq += 1
+        payload = {"master": "latency_probe", "master_id": "probe", "probe_seq": seq,
+                   "probe_sent_us": time.time_ns() // 1000}
+        client.publish(topic, json.dumps(payload))
+        next_due += LATENCY_PROBE_INTERVAL
+        time.sleep(max(0.0, next_due - time.perf_counter()))
+
 # Main Function
 def main():
     # Create MQTT Client
@@ -69,12 +144,34 @@ def main():
     client.connect(BROKER, PORT)
     client.loop_start()
 
+    if MODE == 'qos_sweep':
+        loadgen.qos_sweep(client, loadgen_message)
+        client.loop_stop()
+        client.disconnect()
+        return
+
+    # Publishes go through the tracker: QoS, in-flight window, ack latency, failed / unacked counts
+    publisher = loadgen.PublishTracker(client)
+
+    if LATENCY_PROBE_INTERVAL > 0:
+        threading.Thread(target=publish_probes, args=(publisher,), daemon=True).start()
+
+    if MODE == 'loadgen':
+        loadgen.run(publisher, loadgen_message)
+        client.loop_stop()
+        client.disconnect()
+        return
+
     # Start publishing in a separate thread
-    threading.Thread(target=publish_all_topics, args=(client,), daemon=True).start()
+    threading.Thread(target=publish_all_topics, args=(publisher,), daemon=True).start()
 
     try:
+        next_report = time.time() + PUBLISH_REPORT_SECONDS
         while True:
             time.sleep(1)  # Keep the main thread alive
+            if time.time() >= next_report:
+                print(f"[publish] QoS {publisher.qos}: {publisher.period_summary()}")
+                next_report += PUBLISH_REPORT_SECONDS
     except KeyboardInterrupt:
         print("Stopping publisher...")
         client.loop_stop()
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import heapq
+import argparse
+import multiprocessing
+
+import paho.mqtt.client as mqtt
+
+import payloads
+import value_models
+from loadgen import percentile
+
+# Fleet simulator: many devices from one spec, spread over worker processes.
+#
+#   python fleet_sim.py fleet_spec.json
+#   python fleet_sim.py fleet_spec.json --processes 8 --duration 300
+#
+# Spec (see fleet_spec.json):
+#   broker, port, processes, clients_per_process, duration (0 = until stopped), report_seconds,
+#   format (json | line, see payloads.py), seed (value models)
+#   fleets: [{tools, devices, iot: {interval, fields}, device_alive: {interval, fields}}]
+#   a field is a constant or a value model: {"model": "sine", "base": 50, ...} (value_models.py)
+#
+# Device i of a fleet publishes to iot_sensors/iot_{tools}/mc_{i} and
+# iot_sensors/device_alive/{tools}_mc_{i} (the topics device_master_tb expects).
+# Devices are dealt round-robin to the processes; each process spreads its
+# devices over the interval (no bursts at the top of the interval), sends on an
+# absolute timeline over clients_per_process MQTT clients and reports its
+# counters every report_seconds to the parent, which prints the fleet totals.
+#
+# This file is the same in mqtt_python_01 and mqtt_python_02.
+
+
+def load_spec(path):
+    with open(path, encoding='utf-8') as f:
+        spec = json.load(f)
+    spec.setdefault('broker', 'localhost')
+    spec.setdefault('port', 1883)
+    spec.setdefault('processes', os.cpu_count() or 1)
+    spec.setdefault('clients_per_process', 1)
+    spec.setdefault('duration', 0)
+    spec.setdefault('report_seconds', 10)
+    spec.setdefault('format', 'json')
+    spec.setdefault('seed', value_models.VALUE_SEED)
+    return spec
+
+
+def build_streams(spec, shard=None):
+    """[(topic, interval, fields, device number)] for every device and stream of the spec (or of one shard)"""
+    streams = []
+    device_index = 0
+    for fleet in spec['fleets']:
+        tools = fleet['tools']
+        for i in range(1, fleet['devices'] + 1):
+            device_index += 1
+            if shard is not None and device_index % spec['processes'] != shard:
+                continue
+            if fleet.get('iot'):
+                streams.append((f"iot_sensors/iot_{tools}/mc_{i}", fleet['iot']['interval'], fleet['iot'].get('fields', {}), i))
+            if fleet.get('device_alive'):
+                streams.append((f"iot_sensors/device_alive/{tools}_mc_{i}", fleet['device_alive']['interval'],
+                                fleet['device_alive'].get('fields', {}), i))
+    return streams
+
+
+def worker(shard, spec, stats_queue, stop_event):
+    streams = build_streams(spec, shard)
+    clients = []
+    for n in range(spec['clients_per_process']):
+        client = mqtt.Client(client_id=f"fleet_sim_{os.getpid()}_{n}")
+        client.connect(spec['broker'], spec['port'])
+        client.loop_start()
+        clients.append(client)
+
+    # Pre-serialized payload per stream, only data_id and the modelled fields change
+    templates = []
+    for topic, interval, fields, number in streams:
+        values = value_models.FieldValues(fields, topic, spec['seed'])
+        template = payloads.make_template(spec['format'], topic.split('/')[1],
+                                          {'master': f"data_{number}", 'master_id': 'test', **values.static},
+                                          ['data_id'] + values.dynamic_fields, tags={'topic': topic})
+        templates.append((payloads.topic_for_format(topic, spec['format']), template, values))
+
+    start = time.perf_counter()
+    timeline = [(start + interval * index / len(streams), index, 1)
+                for index, (_, interval, _, _) in enumerate(streams)]
+    heapq.heapify(timeline)
+
+    sent = errors = 0
+    lags = []
+    next_report = start + spec['report_seconds']
+    while timeline and not stop_event.is_set():
+        due, index, count = timeline[0]
+        now = time.perf_counter()
+        if due > now:
+            time.sleep(min(due - now, max(0.0, next_report - now), 0.1))
+        else:
+            topic, template, values = templates[index]
+            info = clients[index % len(clients)].publish(topic, template.encode(count, *values.next()))
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                sent += 1
+            else:
+                errors += 1
+            lags.append(now - due)
+            heapq.heapreplace(timeline, (due + streams[index][1], index, count + 1))
+        if now >= next_report:
+            stats_queue.put((shard, len(streams), sent, errors, lags[::max(1, len(lags) // 10000)]))
+            sent = errors = 0
+            lags = []
+            next_report += spec['report_seconds']
+
+    stats_queue.put((shard, len(streams), sent, errors, lags))
+    for client in clients:
+        client.loop_stop()
+        client.disconnect()
+
+
+def report(spec, stats_queue, workers, stop_event):
+    start = time.time()
+    totals = {'sent': 0, 'errors': 0}
+    while any(w.is_alive() for w in workers) or not stats_queue.empty():
+        interval_stats = []
+        deadline = time.time() + spec['report_seconds']
+        while len(interval_stats) < len(workers) and time.time() < deadline + 1:
+            if spec['duration'] and time.time() - start >= spec['duration']:
+                stop_event.set()
+            try:
+                interval_stats.append(stats_queue.get(timeout=1))
+            except Exception:
+                if not any(w.is_alive() for w in workers):
+                    break
+        if not interval_stats:
+            continue
+        sent = sum(item[2] for item in interval_stats)
+        errors = sum(item[3] for item in interval_stats)
+        lags = sorted(lag for item in interval_stats for lag in item[4])
+        totals['sent'] += sent
+        totals['errors'] += errors
+        per_shard = ' '.join(f"{item[0]}:{item[2] / spec['report_seconds']:.0f}" for item in sorted(interval_stats))
+        print(f"[fleet_sim] {time.time() - start:.0f}s {sent / spec['report_seconds']:.0f} msg/s "
+              f"({len(interval_stats)} shards reporting, {errors} errors) lag p50 {percentile(lags, 50) * 1000:.1f}ms "
+              f"p99 {percentile(lags, 99) * 1000:.1f}ms | per shard msg/s {per_shard}")
+    elapsed = time.time() - start
+    print(f"[fleet_sim] total {totals['sent']} messages, {totals['errors']} errors in {elapsed:.0f}s "
+          f"({totals['sent'] / elapsed if elapsed else 0:.0f} msg/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process MQTT fleet simulator")
+    parser.add_argument('spec', nargs='?', default=os.getenv('FLEET_SPEC', 'fleet_spec.json'))
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--duration', type=float)
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    if args.processes:
+        spec['processes'] = args.processes
+    if args.duration is not None:
+        spec['duration'] = args.duration
+
+    streams = build_streams(spec)
+    rate = sum(1.0 / interval for _, interval, _, _ in streams)
+    print(f"[fleet_sim] {len(streams)} streams over {spec['processes']} processes "
+          f"x {spec['clients_per_process']} clients, expected {rate:.0f} msg/s")
+
+    stats_queue = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=worker, args=(shard, spec, stats_queue, stop_event), daemon=True)
+               for shard in range(spec['processes'])]
+    for w in workers:
+        w.start()
+    try:
+        report(spec, stats_queue, workers, stop_event)
+    except KeyboardInterrupt:
+        stop_event.set()
+        print("Stopping fleet simulator...")
+    for w in workers:
+        w.join(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
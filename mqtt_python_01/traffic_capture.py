@@ -0,0 +1,298 @@
+import os
+import gzip
+import zlib
+import time
+import queue
+import signal
+import struct
+import argparse
+
+import paho.mqtt.client as mqtt
+
+import loadgen
+
+# Record real MQTT traffic and publish it again with the same timing.
+#
+#   python traffic_capture.py capture capture.bin.gz                 subscribe CAPTURE_TOPICS (iot_sensors/#)
+#   python traffic_capture.py replay capture.bin.gz --speed 10       10x faster, same inter-arrival shape
+#   python traffic_capture.py replay capture.bin.gz --speed max      as fast as the client can publish
+#   python traffic_capture.py info capture.bin.gz
+#
+# File: gzip, append-only. Every CAPTURE_FLUSH_SECONDS the records of the
+# interval are appended as one complete gzip member that starts its own session,
+# so a killed capture loses at most the last interval and the file stays
+# readable. SIGTERM (docker stop) and Ctrl-C write the last interval before
+# exiting. A capture appending to a file cut short by a crash first truncates
+# it to its last complete member; read_capture stops at a truncated end.
+# Records:
+#   S  <Q start µs>                                   session start: resets clock and topic ids
+#   T  <H topic id> <H length> topic                  first use of a topic in the session
+#   M  <I µs since previous record> <H topic id> <I length> payload
+# Topics are written once per session, a message costs 11 bytes + payload
+# before compression. A gap longer than the <I> range starts a new session.
+#
+# on_message (paho network thread) only queues the message with its arrival
+# time; the main loop encodes and compresses.
+#
+# This file is the same in mqtt_python_01 and mqtt_python_02.
+
+MQTT_BROKER = os.getenv('MQTT_BROKER', 'localhost')
+MQTT_PORT = int(os.getenv('MQTT_PORT', 1883))
+CAPTURE_TOPICS = os.getenv('CAPTURE_TOPICS', 'iot_sensors/#')
+CAPTURE_FLUSH_SECONDS = float(os.getenv('CAPTURE_FLUSH_SECONDS', 5))
+CAPTURE_REPORT_SECONDS = float(os.getenv('CAPTURE_REPORT_SECONDS', 10))
+
+SESSION = struct.Struct('<Q')
+TOPIC = struct.Struct('<HH')
+MESSAGE = struct.Struct('<IHI')
+MAX_DELTA_US = 0xFFFFFFFF
+MAX_TOPICS = 0xFFFF
+
+
+def complete_length(path):
+    """Bytes at the start of path taken by complete gzip members"""
+    complete = offset = 0
+    member = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                return complete
+            while data:
+                try:
+                    member.decompress(data)
+                except zlib.error:
+                    return complete
+                if not member.eof:
+                    offset += len(data)
+                    break
+                offset += len(data) - len(member.unused_data)
+                complete = offset
+                data = member.unused_data
+                member = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.path = path
+        self.buffer = bytearray()
+        self.topics = {}
+        self.last_us = None
+        self.messages = 0
+        self.payload_bytes = 0
+        self._repair()
+
+    def _repair(self):
+        """Cut a member left incomplete by a killed capture, appending after it would make the rest unreadable"""
+        if not os.path.exists(self.path):
+            open(self.path, 'ab').close()
+            return
+        size = os.path.getsize(self.path)
+        length = complete_length(self.path)
+        if length < size:
+            print(f"[capture] {self.path}: dropping {size - length} bytes of an incomplete gzip member")
+            with open(self.path, 'r+b') as f:
+                f.truncate(length)
+
+    def _start_session(self, arrival_us):
+        self.buffer += b'S' + SESSION.pack(arrival_us)
+        self.topics = {}
+        self.last_us = arrival_us
+
+    def write(self, topic, payload, arrival_us):
+        if self.last_us is None or arrival_us - self.last_us > MAX_DELTA_US or len(self.topics) >= MAX_TOPICS:
+            self._start_session(arrival_us)
+        topic_id = self.topics.get(topic)
+        if topic_id is None:
+            topic_id = self.topics[topic] = len(self.topics)
+            encoded = topic.encode('utf-8')
+            self.buffer += b'T' + TOPIC.pack(topic_id, len(encoded)) + encoded
+        delta = max(0, arrival_us - self.last_us)
+        self.last_us += delta
+        self.buffer += b'M' + MESSAGE.pack(delta, topic_id, len(payload)) + payload
+        self.messages += 1
+        self.payload_bytes += len(payload)
+
+    def flush(self):
+        """Append the buffered records as one gzip member; the next record starts a new session"""
+        if not self.buffer:
+            return
+        with open(self.path, 'ab') as f:
+            f.write(gzip.compress(bytes(self.buffer)))
+        self.buffer = bytearray()
+        self.last_us = None
+
+    def close(self):
+        self.flush()
+
+
+def read_exact(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise EOFError("record cut short")
+    return data
+
+
+def read_capture(path):
+    """Yields (arrival µs, topic, payload) in capture order, up to a truncated end"""
+    with gzip.open(path, 'rb') as f:
+        topics = {}
+        clock = 0
+        try:
+            while True:
+                kind = f.read(1)
+                if not kind:
+                    return
+                if kind == b'S':
+                    clock, = SESSION.unpack(read_exact(f, SESSION.size))
+                    topics = {}
+                elif kind == b'T':
+                    topic_id, length = TOPIC.unpack(read_exact(f, TOPIC.size))
+                    topics[topic_id] = read_exact(f, length).decode('utf-8')
+                elif kind == b'M':
+                    delta, topic_id, length = MESSAGE.unpack(read_exact(f, MESSAGE.size))
+                    clock += delta
+                    yield clock, topics[topic_id], read_exact(f, length)
+                else:
+                    raise ValueError(f"Corrupt capture file {path}: unknown record {kind!r}")
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            # Capture killed while writing a member: keep what was complete
+            print(f"[read_capture] {path} ends with an incomplete record, stopping there ({e})")
+
+
+def capture(path, topics, duration):
+    records = queue.SimpleQueue()
+    writer = CaptureWriter(path)
+
+    def on_connect(client, userdata, flags, rc):
+        for topic in topics:
+            client.subscribe(topic)
+
+    def on_message(client, userdata, msg):
+        records.put((msg.topic, msg.payload, time.time_ns() // 1000))
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(MQTT_BROKER, MQTT_PORT, 60)
+    client.loop_start()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    start = time.time()
+    next_flush = start + CAPTURE_FLUSH_SECONDS
+    next_report = start + CAPTURE_REPORT_SECONDS
+    last_messages = 0
+    print(f"[capture] {', '.join(topics)} -> {path}")
+    try:
+        while not duration or time.time() - start < duration:
+            try:
+                writer.write(*records.get(timeout=0.5))
+            except queue.Empty:
+                pass
+            now = time.time()
+            if now >= next_flush:
+                writer.flush()
+                next_flush = now + CAPTURE_FLUSH_SECONDS
+            if now >= next_report:
+                print(f"[capture] {writer.messages} messages ({(writer.messages - last_messages) / CAPTURE_REPORT_SECONDS:.0f}/s), "
+                      f"{writer.payload_bytes / 1e6:.1f} MB payload, file {os.path.getsize(path) / 1e6:.1f} MB")
+                last_messages = writer.messages
+                next_report = now + CAPTURE_REPORT_SECONDS
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        client.loop_stop()
+        client.disconnect()
+        while not records.empty():
+            writer.write(*records.get())
+        writer.close()
+    print(f"[capture] {writer.messages} messages, {writer.payload_bytes / 1e6:.1f} MB payload, "
+          f"file {os.path.getsize(path) / 1e6:.1f} MB")
+
+
+def replay(path, speed, topic_prefix=None, qos=0, loop=False):
+    """speed: 1.0 = original timing, 10.0 = 10x faster, None = no waiting"""
+    client = mqtt.Client()
+    client.connect(MQTT_BROKER, MQTT_PORT, 60)
+    client.loop_start()
+    print(f"[replay] {path} at {f'{speed:g}x' if speed else 'max speed'}")
+    try:
+        while True:
+            start = time.perf_counter()
+            stats = loadgen.LoadStats(start)
+            first_us = None
+            for arrival_us, topic, payload in read_capture(path):
+                if first_us is None:
+                    first_us = arrival_us
+                due = start + (arrival_us - first_us) / 1e6 / speed if speed else time.perf_counter()
+                now = time.perf_counter()
+                if due - now > loadgen.MIN_SLEEP:
+                    time.sleep(due - now)
+                if topic_prefix:
+                    topic = topic_prefix + topic[topic.index('/'):]
+                client.publish(topic, payload, qos=qos)
+                stats.add(max(0.0, time.perf_counter() - due))
+            elapsed = time.perf_counter() - start
+            original = (arrival_us - first_us) / 1e6 if first_us is not None else 0.0
+            print(f"[replay] {stats.sent} messages in {elapsed:.1f}s (captured over {original:.1f}s), "
+                  f"{stats.sent / elapsed if elapsed else 0:.0f} msg/s {loadgen.lag_summary(stats.all_lags)}")
+            if not loop:
+                break
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+
+
+def info(path):
+    messages = payload_bytes = 0
+    topics = set()
+    first_us = last_us = None
+    for arrival_us, topic, payload in read_capture(path):
+        messages += 1
+        payload_bytes += len(payload)
+        topics.add(topic)
+        first_us = arrival_us if first_us is None else first_us
+        last_us = arrival_us
+    span = (last_us - first_us) / 1e6 if messages else 0.0
+    size = os.path.getsize(path)
+    print(f"{path}: {messages} messages, {len(topics)} topics over {span:.1f}s "
+          f"({messages / span if span else 0:.0f} msg/s), payload {payload_bytes / 1e6:.1f} MB, "
+          f"file {size / 1e6:.1f} MB ({size / messages if messages else 0:.1f} bytes/message)")
+
+
+def parse_speed(value):
+    return None if value == 'max' else float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture and replay MQTT traffic")
+    commands = parser.add_subparsers(dest='command', required=True)
+    capture_parser = commands.add_parser('capture')
+    capture_parser.add_argument('path')
+    capture_parser.add_argument('--topics', default=CAPTURE_TOPICS, help="comma separated subscriptions")
+    capture_parser.add_argument('--duration', type=float, default=0, help="seconds, 0 = until stopped")
+    replay_parser = commands.add_parser('replay')
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--speed', type=parse_speed, default=1.0, help="1, 10, ... or max")
+    replay_parser.add_argument('--topic-prefix', help="replace the first topic level, e.g. iot_sensors_replay")
+    replay_parser.add_argument('--qos', type=int, default=0, choices=(0, 1, 2))
+    replay_parser.add_argument('--loop', action='store_true')
+    info_parser = commands.add_parser('info')
+    info_parser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'capture':
+        capture(args.path, [topic.strip() for topic in args.topics.split(',') if topic.strip()], args.duration)
+    elif args.command == 'replay':
+        replay(args.path, args.speed, args.topic_prefix, args.qos, args.loop)
+    else:
+        info(args.path)
+
+
+if __name__ == "__main__":
+    main()
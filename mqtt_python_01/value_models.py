@@ -0,0 +1,187 @@
+import os
+import math
+import random
+import argparse
+
+# Value models for the numeric fields of the generated payloads.
+#
+# generate_payload() sends constants (1000000 / 1000000.058), which TSM and
+# MSSQL page compression store almost for free. A model turns a field into a
+# signal; the constant becomes its base value:
+#   constant      base (old behaviour)
+#   random_walk   base + gaussian steps (step, decimals)
+#   sine          base + amplitude * sin(sample / period) + noise (amplitude, period, noise, decimals)
+#   step          one of `levels` values within base +- spread, held ~hold samples (levels, spread, hold)
+#   counter       base, base + increment (+ jitter), ... as integers (increment, jitter)
+#   sparse        base, with an event (base + exponential, mean magnitude) with probability p (probability, magnitude)
+#
+# Every (seed, device, field) gets its own random.Random, so a run is
+# reproducible with the same VALUE_SEED whatever the order of publishing.
+#
+# app.py: VALUE_MODEL applies to every numeric field, VALUE_MODELS overrides per
+# field (VALUE_MODELS=data_4=counter,data_11=sine). fleet_sim.py: a field of the
+# spec can be {"model": "sine", "base": 50, "amplitude": 5, ...} instead of a number.
+#
+#   python value_models.py --preview sine --base 1000000        first samples of a model
+#
+# This file is the same in mqtt_python_01 and mqtt_python_02.
+
+VALUE_MODEL = os.getenv('VALUE_MODEL', 'constant')
+VALUE_MODELS = os.getenv('VALUE_MODELS', '')
+VALUE_SEED = int(os.getenv('VALUE_SEED', 1))
+
+
+def scale(base, fraction, minimum):
+    return max(abs(base) * fraction, minimum)
+
+
+class Constant:
+    def __init__(self, rng, base):
+        self.base = base
+
+    def next(self):
+        return self.base
+
+
+class RandomWalk:
+    def __init__(self, rng, base, step=None, decimals=2):
+        self.rng = rng
+        self.value = float(base)
+        self.step = step if step is not None else scale(base, 0.001, 0.01)
+        self.decimals = decimals
+
+    def next(self):
+        self.value += self.rng.gauss(0, self.step)
+        return round(self.value, self.decimals)
+
+
+class Sine:
+    def __init__(self, rng, base, amplitude=None, period=600, noise=None, decimals=2):
+        self.rng = rng
+        self.base = base
+        self.amplitude = amplitude if amplitude is not None else scale(base, 0.05, 1)
+        self.period = period
+        self.noise = noise if noise is not None else self.amplitude * 0.02
+        self.decimals = decimals
+        self.sample = rng.randrange(period)
+
+    def next(self):
+        self.sample += 1
+        value = self.base + self.amplitude * math.sin(2 * math.pi * self.sample / self.period)
+        return round(value + self.rng.gauss(0, self.noise), self.decimals)
+
+
+class Step:
+    def __init__(self, rng, base, levels=5, spread=None, hold=100):
+        self.rng = rng
+        spread = spread if spread is not None else scale(base, 0.1, 1)
+        self.levels = [base + spread * (2 * k / (levels - 1) - 1) if levels > 1 else base for k in range(levels)]
+        self.hold = hold
+        self.value = rng.choice(self.levels)
+
+    def next(self):
+        if self.rng.random() < 1.0 / self.hold:
+            self.value = self.rng.choice(self.levels)
+        return self.value
+
+
+class Counter:
+    def __init__(self, rng, base, increment=1, jitter=0):
+        self.rng = rng
+        self.value = int(base)
+        self.increment = increment
+        self.jitter = jitter
+
+    def next(self):
+        value = self.value
+        self.value += self.increment + (self.rng.randint(0, self.jitter) if self.jitter else 0)
+        return value
+
+
+class Sparse:
+    def __init__(self, rng, base, probability=0.01, magnitude=None):
+        self.rng = rng
+        self.base = base
+        self.probability = probability
+        self.magnitude = magnitude if magnitude is not None else scale(base, 0.1, 1)
+
+    def next(self):
+        if self.rng.random() < self.probability:
+            return round(self.base + self.rng.expovariate(1.0 / self.magnitude), 2)
+        return self.base
+
+
+MODELS = {
+    'constant': Constant,
+    'random_walk': RandomWalk,
+    'sine': Sine,
+    'step': Step,
+    'counter': Counter,
+    'sparse': Sparse,
+}
+
+
+def is_model(value):
+    return isinstance(value, dict) and 'model' in value
+
+
+def make_model(spec, rng):
+    params = dict(spec)
+    name = params.pop('model')
+    if name not in MODELS:
+        raise ValueError(f"Unknown value model '{name}', expected one of {', '.join(MODELS)}")
+    return MODELS[name](rng, **params)
+
+
+class FieldValues:
+    """Per device: fields {name: constant or model spec} split into static fields and models"""
+
+    def __init__(self, fields, device, seed=VALUE_SEED):
+        self.static = {}
+        self.models = {}
+        for name, value in fields.items():
+            if is_model(value) and value['model'] != 'constant':
+                self.models[name] = make_model(value, random.Random(f"{seed}/{device}/{name}"))
+            else:
+                self.static[name] = value['base'] if is_model(value) else value
+        self.dynamic_fields = list(self.models)
+
+    def next(self):
+        """Values of the modelled fields, in dynamic_fields order"""
+        return [model.next() for model in self.models.values()]
+
+
+def parse_field_models(text):
+    """'data_4=counter,data_11=sine' -> {'data_4': 'counter', 'data_11': 'sine'}"""
+    result = {}
+    for item in text.split(','):
+        if '=' in item:
+            field, model = item.split('=', 1)
+            result[field.strip()] = model.strip()
+    return result
+
+
+def apply_env_models(fields, default_model=VALUE_MODEL, overrides=VALUE_MODELS):
+    """Numeric constants of fields -> model specs from VALUE_MODEL / VALUE_MODELS; other fields unchanged"""
+    field_models = parse_field_models(overrides)
+    result = {}
+    for name, value in fields.items():
+        model = field_models.get(name, default_model)
+        numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+        result[name] = {'model': model, 'base': value} if numeric and model != 'constant' else value
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preview value models")
+    parser.add_argument('--preview', choices=list(MODELS), required=True)
+    parser.add_argument('--base', type=float, default=1000000)
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=VALUE_SEED)
+    args = parser.parse_args()
+    model = make_model({'model': args.preview, 'base': args.base}, random.Random(f"{args.seed}/preview/value"))
+    print(' '.join(str(model.next()) for _ in range(args.samples)))
+
+
+if __name__ == "__main__":
+    main()
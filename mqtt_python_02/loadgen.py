@@ -0,0 +1,269 @@
+import os
+import time
+import random
+import threading
+
+import paho.mqtt.client as mqtt
+
+# Load generator mode for app.py (MODE=loadgen).
+#
+# Messages are sent on an absolute timeline: message k is due at
+# start + k / LOADGEN_RATE, whatever the time spent publishing, so the rate does
+# not drift like "publish all topics, then sleep". The token bucket lets the
+# sender catch up at most LOADGEN_BURST messages after a stall; a longer
+# backlog is skipped (and counted) instead of being flushed as a spike.
+# Nothing is printed per message.
+#
+# Every LOADGEN_REPORT_SECONDS: target vs achieved msg/s and scheduling lag
+# (actual send time - due time) p50/p99/max. LOADGEN_RATE=0: no rate limit, the
+# in-flight window alone paces the sender.
+#
+# PublishTracker wraps the client for every mode of app.py: PUBLISH_QOS 0/1/2,
+# at most INFLIGHT_WINDOW messages without on_publish (QoS 0: written to the
+# socket, 1: PUBACK, 2: PUBCOMP). It counts publish() errors as failed and
+# messages without ack after ACK_TIMEOUT seconds as unacked, and measures
+# publish -> ack latency. Acks arriving after their message was counted unacked
+# are dropped (late); paho reuses mids after 65535, so an ack is only matched to
+# a publish() that started before it. MODE=qos_sweep runs LOADGEN_DURATION
+# (default 30s) unthrottled per QoS level and prints the acked msg/s of each.
+#
+# This file is the same in mqtt_python_01 and mqtt_python_02.
+
+LOADGEN_RATE = float(os.getenv('LOADGEN_RATE', 1000))          # messages/sec
+LOADGEN_BURST = int(os.getenv('LOADGEN_BURST', 100))
+LOADGEN_DURATION = float(os.getenv('LOADGEN_DURATION', 0))     # seconds, 0 = until stopped
+LOADGEN_REPORT_SECONDS = float(os.getenv('LOADGEN_REPORT_SECONDS', 10))
+PUBLISH_QOS = int(os.getenv('PUBLISH_QOS', 0))
+INFLIGHT_WINDOW = int(os.getenv('INFLIGHT_WINDOW', 100))
+ACK_TIMEOUT = float(os.getenv('ACK_TIMEOUT', 30))
+QOS_SWEEP = [int(qos) for qos in os.getenv('QOS_SWEEP', '0,1,2').split(',')]
+
+# Sleeping for less than this costs more than it saves
+MIN_SLEEP = 0.001
+LAG_SAMPLES = 100000
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, start):
+        self.interval = 1.0 / rate
+        self.max_backlog = burst * self.interval
+        self.next_due = start
+        self.skipped = 0
+
+    def acquire(self):
+        """Wait for the next slot on the timeline; returns its due time"""
+        now = time.perf_counter()
+        due = self.next_due
+        if due - now > MIN_SLEEP:
+            time.sleep(due - now)
+        elif now - due > self.max_backlog:
+            # Too far behind: forget the slots beyond one burst
+            behind = int((now - due - self.max_backlog) / self.interval)
+            self.skipped += behind
+            due += behind * self.interval
+        self.next_due = due + self.interval
+        return due
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def lag_summary(lags):
+    values = sorted(lags)
+    return (f"lag p50 {percentile(values, 50) * 1000:.2f}ms p99 {percentile(values, 99) * 1000:.2f}ms "
+            f"max {(values[-1] if values else 0) * 1000:.2f}ms")
+
+
+class LoadStats:
+    def __init__(self, start):
+        self.start = start
+        self.sent = 0
+        self.lags = []          # since the last report
+        self.all_lags = []      # reservoir sample over the whole run
+        self.seen = 0
+        self.random = random.Random(0)
+
+    def add(self, lag):
+        self.sent += 1
+        self.lags.append(lag)
+        self.seen += 1
+        if len(self.all_lags) < LAG_SAMPLES:
+            self.all_lags.append(lag)
+        else:
+            slot = self.random.randrange(self.seen)
+            if slot < LAG_SAMPLES:
+                self.all_lags[slot] = lag
+
+
+class PublishTracker:
+    def __init__(self, client, window=INFLIGHT_WINDOW, qos=PUBLISH_QOS, ack_timeout=ACK_TIMEOUT, previous=None):
+        """previous: drained tracker of the same client, late acks of its messages are dropped"""
+        self.client = client
+        self.window = window
+        self.qos = qos
+        self.ack_timeout = ack_timeout
+        self.pending = {}     # mid -> publish time
+        self.reserved = 0     # window slots taken by publish() calls still inside client.publish()
+        self.early = {}       # mid -> time of an ack that arrived before publish() returned the mid
+        self.expired = dict(previous.expired) if previous else {}   # mid -> time it was counted unacked
+        self.condition = threading.Condition()
+        self.sent = 0
+        self.failed = 0
+        self.unacked = 0
+        self.late = 0
+        self.acks = LoadStats(time.perf_counter())   # lags = publish -> ack latencies
+        client.max_inflight_messages_set(window)
+        client.on_publish = self.on_publish
+
+    def on_publish(self, client, userdata, mid):
+        now = time.perf_counter()
+        with self.condition:
+            published = self.pending.pop(mid, None)
+            if published is None:
+                if self.expired.pop(mid, None) is not None:
+                    self.late += 1
+                else:
+                    self.early[mid] = now
+                return
+            self.acks.add(now - published)
+            self.condition.notify()
+
+    def expire(self):
+        """Count messages without ack for ack_timeout as unacked and free their slots (condition is reentrant)"""
+        now = time.perf_counter()
+        limit = now - self.ack_timeout
+        with self.condition:
+            for mid, published in list(self.pending.items()):
+                if published < limit:
+                    del self.pending[mid]
+                    self.expired[mid] = now
+                    self.unacked += 1
+            # A late ack older than this ends up in early, where publish() ignores it
+            self.expired = {mid: at for mid, at in self.expired.items() if at >= limit}
+            self.early = {mid: at for mid, at in self.early.items() if at >= limit}
+
+    def publish(self, topic, payload, qos=None):
+        """client.publish() within the in-flight window; the slot is reserved before the lock is released,
+        so concurrent publishers (app.py's probe thread) can't exceed it"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.pending) + self.reserved < self.window, self.ack_timeout):
+                self.expire()
+            self.reserved += 1
+        published = time.perf_counter()
+        try:
+            info = self.client.publish(topic, payload, qos=self.qos if qos is None else qos)
+        except Exception:
+            with self.condition:
+                self.reserved -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.reserved -= 1
+            self.sent += 1
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.failed += 1
+                self.condition.notify()
+                return info
+            # The mid now belongs to this message, an older ack of it does not count
+            self.expired.pop(info.mid, None)
+            acked = self.early.pop(info.mid, None)
+            if acked is not None and acked >= published:
+                self.acks.add(acked - published)
+                self.condition.notify()
+            else:
+                self.pending[info.mid] = published
+        return info
+
+    def drain(self, timeout=None):
+        """Wait for the outstanding acks, then count the rest as unacked"""
+        with self.condition:
+            self.condition.wait_for(lambda: not self.pending and not self.reserved,
+                                    self.ack_timeout if timeout is None else timeout)
+            self.unacked += len(self.pending)
+            now = time.perf_counter()
+            self.expired.update((mid, now) for mid in self.pending)
+            self.pending.clear()
+
+    def summary(self, lags=None):
+        """Ack latency of lags (default: whole run sample) and the counters"""
+        self.expire()
+        with self.condition:
+            values = sorted(self.acks.all_lags if lags is None else lags)
+            return (f"acked {self.acks.seen}/{self.sent} ack p50 {percentile(values, 50) * 1000:.2f}ms "
+                    f"p99 {percentile(values, 99) * 1000:.2f}ms max {(values[-1] if values else 0) * 1000:.2f}ms "
+                    f"in flight {len(self.pending)} failed {self.failed} unacked {self.unacked} late {self.late}")
+
+    def period_summary(self):
+        """summary() of the acks since the previous call"""
+        with self.condition:
+            lags, self.acks.lags = self.acks.lags, []
+        return self.summary(lags)
+
+
+def run(publisher, next_message, rate=LOADGEN_RATE, burst=LOADGEN_BURST, duration=LOADGEN_DURATION,
+        report_seconds=LOADGEN_REPORT_SECONDS, qos=None):
+    """
+    Publish next_message(k) -> (topic, payload) for k = 0, 1, 2, ... at rate messages/sec
+    (rate 0: as fast as the in-flight window allows) through a PublishTracker.
+    Returns the LoadStats of the run and its elapsed seconds, drain included.
+    """
+    qos = publisher.qos if qos is None else qos
+    start = time.perf_counter()
+    bucket = TokenBucket(rate, burst, start) if rate else None
+    stats = LoadStats(start)
+    next_report = start + report_seconds
+    last_report, last_sent, last_acked = start, 0, publisher.acks.seen
+    k = 0
+    target = f"{rate:.0f}/s" if rate else "unlimited"
+    print(f"[loadgen] target {target}, burst {burst}, QoS {qos}, window {publisher.window}, "
+          f"duration {duration or 'unlimited'}s")
+    try:
+        while not duration or time.perf_counter() - start < duration:
+            due = bucket.acquire() if bucket else time.perf_counter()
+            topic, payload = next_message(k)
+            publisher.publish(topic, payload, qos=qos)
+            now = time.perf_counter()
+            stats.add(max(0.0, now - due))
+            k += 1
+            if now >= next_report:
+                achieved = (stats.sent - last_sent) / (now - last_report)
+                acked = (publisher.acks.seen - last_acked) / (now - last_report)
+                print(f"[loadgen] {now - start:.0f}s target {target} achieved {achieved:.0f}/s acked {acked:.0f}/s "
+                      f"{lag_summary(stats.lags)} skipped {bucket.skipped if bucket else 0} | "
+                      f"{publisher.period_summary()}")
+                stats.lags = []
+                last_report, last_sent, last_acked = now, stats.sent, publisher.acks.seen
+                next_report = now + report_seconds
+    except KeyboardInterrupt:
+        pass
+
+    publisher.drain()
+    elapsed = time.perf_counter() - start
+    elapsed = elapsed or 1e-9
+    print(f"[loadgen] total {stats.sent} messages in {elapsed:.1f}s: target {target} "
+          f"achieved {stats.sent / elapsed:.0f}/s acked {publisher.acks.seen / elapsed:.0f}/s "
+          f"{lag_summary(stats.all_lags)} skipped {bucket.skipped if bucket else 0} | {publisher.summary()}")
+    return stats, elapsed
+
+
+def qos_sweep(client, next_message, levels=QOS_SWEEP, duration=LOADGEN_DURATION or 30, window=INFLIGHT_WINDOW):
+    """Unthrottled run per QoS level; prints acked msg/s, ack latency and losses of each"""
+    results = []
+    publisher = None
+    for qos in levels:
+        # run() drained the previous level: on_publish moves to the new tracker only now,
+        # and acks still arriving for the previous level are dropped as late
+        publisher = PublishTracker(client, window, qos, previous=publisher)
+        _, elapsed = run(publisher, next_message, rate=0, duration=duration)
+        values = sorted(publisher.acks.all_lags)
+        results.append((qos, publisher.acks.seen / elapsed, percentile(values, 50), percentile(values, 99),
+                        publisher.failed, publisher.unacked))
+    print(f"[loadgen] QoS sweep, window {window}, {duration:.0f}s per level")
+    print(f"{'QoS':<5}{'acked/s':>10}{'ack p50 ms':>12}{'ack p99 ms':>12}{'failed':>8}{'unacked':>9}")
+    for qos, acked_rate, p50, p99, failed, unacked in results:
+        print(f"{qos:<5}{acked_rate:>10.0f}{p50 * 1000:>12.2f}{p99 * 1000:>12.2f}{failed:>8}{unacked:>9}")
+    return results
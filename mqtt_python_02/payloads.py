@@ -0,0 +1,157 @@
+import json
+import time
+import argparse
+
+# Payload encoders for the generators.
+#
+# A template is built once per topic from the fields that never change; per
+# message only the dynamic fields (data_id, values) are encoded and spliced
+# between the pre-serialized byte parts.
+#
+#   json  {"master": "data_1", ..., "data_id": 42}  -> iot_sensors/...      (Telegraf data_format = "json")
+#   line  iot_got1 master="data_1",...,data_id=42   -> iot_sensors_lp/...   (Telegraf data_format = "influx")
+#
+# Line protocol goes to its own topic tree because Telegraf picks the parser per
+# mqtt_consumer (see telegraf.conf). No timestamp is sent, Telegraf stamps the
+# points on arrival like it does for JSON.
+#
+#   python payloads.py --bench        encode cost and size per format
+#
+# This file is the same in mqtt_python_01 and mqtt_python_02.
+
+LINE_TOPIC_ROOT = 'iot_sensors_lp'
+
+
+def json_scalar(value):
+    if value is True:
+        return b'true'
+    if value is False:
+        return b'false'
+    if isinstance(value, int):
+        return str(value).encode('ascii')
+    if isinstance(value, float):
+        return repr(value).encode('ascii')
+    return json.dumps(value).encode('utf-8')
+
+
+def line_escape(text):
+    return str(text).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def line_field(value):
+    if value is True:
+        return b'true'
+    if value is False:
+        return b'false'
+    if isinstance(value, int):
+        # No "i" suffix: the JSON parser stores every number as float and
+        # InfluxDB rejects a field whose type changes within a shard
+        return str(value).encode('ascii')
+    if isinstance(value, float):
+        return repr(value).encode('ascii')
+    return ('"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"').encode('utf-8')
+
+
+class JsonTemplate:
+    def __init__(self, static_fields, dynamic_fields):
+        self.dynamic_fields = list(dynamic_fields)
+        head = json.dumps(static_fields)[:-1]
+        separator = ', ' if static_fields else ''
+        self.parts = []
+        for name in self.dynamic_fields:
+            self.parts.append((head + separator + json.dumps(name) + ': ').encode('utf-8'))
+            head, separator = '', ', '
+        self.tail = b'}' if self.parts else (head + '}').encode('utf-8')
+
+    def encode(self, *values):
+        chunks = []
+        for part, value in zip(self.parts, values):
+            chunks.append(part)
+            chunks.append(json_scalar(value))
+        chunks.append(self.tail)
+        return b''.join(chunks)
+
+
+class LineTemplate:
+    def __init__(self, measurement, tags, static_fields, dynamic_fields):
+        self.dynamic_fields = list(dynamic_fields)
+        tag_sql = ''.join(f",{line_escape(k)}={line_escape(v)}" for k, v in sorted(tags.items()))
+        head = (line_escape(measurement) + tag_sql + ' ').encode('utf-8')
+        head += b','.join(line_escape(k).encode('utf-8') + b'=' + line_field(v) for k, v in static_fields.items())
+        separator = b',' if static_fields else b''
+        self.parts = []
+        for name in self.dynamic_fields:
+            self.parts.append(head + separator + line_escape(name).encode('utf-8') + b'=')
+            head, separator = b'', b','
+        self.tail = b'' if self.parts else head
+
+    def encode(self, *values):
+        chunks = []
+        for part, value in zip(self.parts, values):
+            chunks.append(part)
+            chunks.append(line_field(value))
+        chunks.append(self.tail)
+        return b''.join(chunks)
+
+
+FORMATS = ('dict', 'json', 'line')
+
+
+def make_template(payload_format, measurement, static_fields, dynamic_fields, tags=None):
+    """Template with encode(*dynamic values) -> bytes; payload_format 'json' or 'line'"""
+    if payload_format == 'json':
+        return JsonTemplate(static_fields, dynamic_fields)
+    if payload_format == 'line':
+        return LineTemplate(measurement, tags or {}, static_fields, dynamic_fields)
+    raise ValueError(f"Unknown payload format '{payload_format}', expected json or line")
+
+
+def topic_for_format(topic, payload_format):
+    """iot_sensors/iot_got1/mc_1 -> iot_sensors_lp/iot_got1/mc_1 for line protocol"""
+    if payload_format == 'line':
+        return LINE_TOPIC_ROOT + topic[topic.index('/'):]
+    return topic
+
+
+def bench(messages, dynamic_count):
+    static_fields = {'master': 'data_1', 'master_id': 'test'}
+    static_fields.update({f"data_{i}": 1000000 for i in range(4, 11 - dynamic_count + 4)})
+    dynamic_fields = ['data_id'] + [f"value_{i}" for i in range(dynamic_count - 1)]
+
+    def dynamic_values(k):
+        return [k] + [1000000.058 + k + i for i in range(dynamic_count - 1)]
+
+    print(f"{messages} messages, {len(static_fields)} static + {len(dynamic_fields)} dynamic fields")
+    print(f"{'format':<8}{'us/msg':>10}{'bytes/msg':>12}")
+
+    start = time.perf_counter()
+    for k in range(messages):
+        payload = dict(static_fields)
+        payload.update(zip(dynamic_fields, dynamic_values(k)))
+        encoded = json.dumps(payload).encode('utf-8')
+    elapsed = time.perf_counter() - start
+    print(f"{'dict':<8}{elapsed / messages * 1e6:>10.2f}{len(encoded):>12}")
+
+    for payload_format in ('json', 'line'):
+        template = make_template(payload_format, 'iot_got1', static_fields, dynamic_fields)
+        start = time.perf_counter()
+        for k in range(messages):
+            encoded = template.encode(*dynamic_values(k))
+        elapsed = time.perf_counter() - start
+        print(f"{payload_format:<8}{elapsed / messages * 1e6:>10.2f}{len(encoded):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode cost per payload format")
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--dynamic', type=int, default=1, help="dynamic fields per message (data_id + values)")
+    args = parser.parse_args()
+    if args.bench:
+        bench(args.messages, args.dynamic)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()